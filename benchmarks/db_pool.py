@@ -0,0 +1,93 @@
+"""
+Задержка дешевого запроса с пулом соединений и без него (NullPool, как при DB_POOL_SIZE=0).
+
+Каждый "запрос" - отдельная сессия с одним коротким SELECT, как у push/is_alive и search/users,
+поэтому без пула в задержку входит TCP-подключение и авторизация MySQL.
+Нужна запущенная БД (db/docker-compose.yml) с примененными миграциями.
+
+  python benchmarks/db_pool.py [--requests 2000] [--concurrency 20] [--pool-size 10] [--url mysql+asyncmy://...]
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+
+# Модули приложения импортируются и как пакет pxproto, и из его каталога (как при запуске main.py)
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path[:0] = [os.path.join(ROOT, 'pxproto'), ROOT]
+
+from dotenv import load_dotenv
+
+load_dotenv('.env')
+load_dotenv('.env.local', override=True)
+
+from sqlalchemy import NullPool, select
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, async_sessionmaker, create_async_engine
+
+import database
+from models import User
+
+
+async def measure(engine: AsyncEngine, requests: int, concurrency: int) -> tuple[list[float], float]:
+  """Задержки запросов (секунды) и общее время"""
+  session_factory = async_sessionmaker(bind=engine, class_=AsyncSession, expire_on_commit=False)
+  latencies = []
+  semaphore = asyncio.Semaphore(concurrency)
+
+  async def one_request():
+    async with semaphore:
+      started = time.perf_counter()
+      async with session_factory() as session:
+        await session.execute(select(User.id).where(User.username == 'benchmark').limit(1))
+      latencies.append(time.perf_counter() - started)
+
+  # Прогрев: подключения пула и кэш запросов SQLAlchemy
+  await asyncio.gather(*(one_request() for _ in range(concurrency)))
+  latencies.clear()
+
+  started = time.perf_counter()
+  await asyncio.gather(*(one_request() for _ in range(requests)))
+  return latencies, time.perf_counter() - started
+
+
+def report(name: str, latencies: list[float], elapsed: float):
+  latencies = sorted(latencies)
+  quantiles = statistics.quantiles(latencies, n=100)
+  print(f'{name:<8} {len(latencies) / elapsed:>9.0f} {quantiles[49] * 1e3:>8.2f} '
+        f'{quantiles[94] * 1e3:>8.2f} {quantiles[98] * 1e3:>8.2f} {latencies[-1] * 1e3:>8.2f}')
+
+
+async def main():
+  parser = argparse.ArgumentParser()
+  parser.add_argument('--requests', type=int, default=2000)
+  parser.add_argument('--concurrency', type=int, default=20)
+  parser.add_argument('--pool-size', type=int, default=max(database.DB_POOL_SIZE, 10))
+  parser.add_argument('--url', default=database.SQLALCHEMY_DATABASE_URL)
+  args = parser.parse_args()
+
+  engines = {
+    'nullpool': create_async_engine(args.url, poolclass=NullPool),
+    'pooled': create_async_engine(
+      args.url,
+      pool_size=args.pool_size,
+      max_overflow=database.DB_MAX_OVERFLOW,
+      pool_timeout=database.DB_POOL_TIMEOUT,
+      pool_recycle=database.DB_POOL_RECYCLE,
+      pool_pre_ping=database.DB_POOL_PRE_PING,
+    ),
+  }
+
+  print(f'{args.requests} requests, concurrency {args.concurrency}, pool size {args.pool_size}')
+  print(f'{"mode":<8} {"req/s":>9} {"p50, ms":>8} {"p95, ms":>8} {"p99, ms":>8} {"max, ms":>8}')
+  for name, engine in engines.items():
+    try:
+      latencies, elapsed = await measure(engine, args.requests, args.concurrency)
+      report(name, latencies, elapsed)
+    finally:
+      await engine.dispose()
+
+
+if __name__ == '__main__':
+  asyncio.run(main())
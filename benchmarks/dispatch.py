@@ -0,0 +1,148 @@
+"""
+Накладные расходы диспетчеризации pxws: прежний путь (рефлексия на каждое сообщение)
+против DispatchPlan, скомпилированного при регистрации. Для каждого зарегистрированного маршрута.
+
+Обработчик не вызывается, измеряются только сборка аргументов и подготовка ответа.
+Модели pydantic в обоих вариантах проверяются одинаково (model_validate готового экземпляра),
+поэтому разница - чистая стоимость рефлексии.
+
+  python benchmarks/dispatch.py [--number 20000] [--route accounts/transfer/by_number]
+"""
+import argparse
+import inspect
+import os
+import sys
+import timeit
+import typing
+from typing import get_origin
+
+# Модули приложения импортируются и как пакет pxproto, и из его каталога (как при запуске main.py)
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path[:0] = [os.path.join(ROOT, 'pxproto'), ROOT]
+
+from dotenv import load_dotenv
+
+load_dotenv('.env')
+load_dotenv('.env.local', override=True)
+
+from pxws.handler import HandlerInfo, _is_pydantic_model
+from main import create_server
+
+
+class _Ctx:
+  """Контекст соединения: обработчики не вызываются, нужен только объект для ctx"""
+
+
+def legacy_prepare_response_data(result, response_model):
+  """_prepare_response_data до DispatchPlan: разбор типа ответа на каждый вызов"""
+  if response_model is None:
+    return result
+
+  origin_type = get_origin(response_model) or response_model
+
+  if origin_type is typing.Union:
+    args = typing.get_args(response_model)
+    if type(None) in args:
+      if result is None:
+        return None
+      actual_type = next(arg for arg in args if arg is not type(None))
+      return legacy_prepare_response_data(result, actual_type)
+
+  if origin_type in (list, typing.List) or isinstance(result, list):
+    item_type = typing.get_args(response_model)[0] if get_origin(response_model) else None
+    if item_type and _is_pydantic_model(item_type):
+      return [legacy_prepare_response_data(item, item_type) for item in result]
+    return result
+
+  if origin_type in (dict, typing.Dict):
+    key_type, val_type = typing.get_args(response_model)
+    if _is_pydantic_model(val_type):
+      return {k: legacy_prepare_response_data(v, val_type) for k, v in result.items()}
+    return result
+
+  if _is_pydantic_model(response_model):
+    if isinstance(result, response_model):
+      return result.model_dump(exclude_none=True)
+    return response_model(**result).model_dump()
+
+  return result
+
+
+def legacy_dispatch(handler_info: HandlerInfo, ctx, data, result):
+  """Сборка аргументов и ответа так, как это делал Server._on_message до DispatchPlan"""
+  handler = handler_info['original_func']
+  kwargs = {}
+  if data is None:
+    data = {}
+
+  sig = inspect.signature(handler)
+  if 'ctx' in sig.parameters:
+    kwargs['ctx'] = ctx
+
+  if not handler_info['is_single_param'] or not handler_info['has_pydantic_params']:
+    for param_name in handler_info['expected_params']:
+      if param_name not in data:
+        raise ValueError(f"Missing parameter '{param_name}' in request data", handler)
+
+      param_type = handler_info['type_hints'].get(param_name)
+      if _is_pydantic_model(param_type):
+        kwargs[param_name] = param_type.model_validate(data[param_name])
+      else:
+        kwargs[param_name] = data[param_name]
+  else:
+    param_name = next(iter(handler_info['expected_params']))
+    param_type = handler_info['type_hints'].get(param_name)
+    if _is_pydantic_model(param_type):
+      kwargs[param_name] = param_type.model_validate(data)
+    else:
+      kwargs[param_name] = data
+
+  return kwargs, legacy_prepare_response_data(result, handler_info['type_hints'].get('return'))
+
+
+def plan_dispatch(handler_info: HandlerInfo, ctx, data, result):
+  plan = handler_info['plan']
+  return plan.bind(ctx, data), plan.serialize(result)
+
+
+def sample_data(handler_info: HandlerInfo):
+  """Данные запроса со всеми параметрами. Модели - экземпляры без проверки полей (model_construct)"""
+  plan = handler_info['plan']
+  if plan.is_single:
+    _, model, _ = plan.params[0]
+    return model.model_construct() if model is not None else {}
+  return {name: model.model_construct() if model is not None else None for name, model, _ in plan.params}
+
+
+def main():
+  parser = argparse.ArgumentParser()
+  parser.add_argument('--number', type=int, default=20000, help='вызовов на маршрут')
+  parser.add_argument('--route', action='append', help='только эти маршруты (можно несколько раз)')
+  args = parser.parse_args()
+
+  handlers = create_server()._handlers
+  routes = args.route or sorted(handlers)
+  ctx = _Ctx()
+
+  print(f'{"route":<36} {"legacy, us":>11} {"plan, us":>9} {"speedup":>8}')
+  total_legacy = total_plan = 0.0
+  for type_name in routes:
+    handler_info = handlers[type_name]
+    data = sample_data(handler_info)
+    # Ответ пустой: обработчики без аннотации ответа, как почти все маршруты, возвращают данные как есть
+    result = {}
+
+    legacy = timeit.timeit(lambda: legacy_dispatch(handler_info, ctx, data, result), number=args.number)
+    plan = timeit.timeit(lambda: plan_dispatch(handler_info, ctx, data, result), number=args.number)
+    total_legacy += legacy
+    total_plan += plan
+
+    print(f'{type_name:<36} {legacy / args.number * 1e6:>11.2f} {plan / args.number * 1e6:>9.2f} '
+          f'{legacy / plan:>7.1f}x')
+
+  print(f'{"total":<36} {total_legacy / args.number * 1e6:>11.2f} {total_plan / args.number * 1e6:>9.2f} '
+        f'{total_legacy / total_plan:>7.1f}x')
+
+
+if __name__ == '__main__':
+  main()
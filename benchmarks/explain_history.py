@@ -0,0 +1,145 @@
+"""
+Проверка планов запросов истории транзакций (TransactionDAO._stmt_with_filter) на заполненной БД.
+
+Создает отдельную базу (по умолчанию pxdb_explain на том же сервере, что и приложение),
+заполняет ее пользователями, организациями, счетами, транзакциями и ledger_entry,
+и выполняет EXPLAIN страницы истории пользователя и организации в обоих режимах
+(UNION ALL веток transaction и HISTORY_FROM_LEDGER). Таблицы transaction и ledger_entry
+должны читаться по индексу, без полного сканирования (type=ALL). Код выхода 1 - есть нарушения.
+
+  python benchmarks/explain_history.py [--transactions 200000] [--database pxdb_explain] [--url mysql+asyncmy://...]
+"""
+import argparse
+import asyncio
+import datetime
+import os
+import random
+import sys
+from decimal import Decimal
+
+# Модули приложения импортируются и как пакет pxproto, и из его каталога (как при запуске main.py)
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path[:0] = [os.path.join(ROOT, 'pxproto'), ROOT]
+
+from dotenv import load_dotenv
+
+load_dotenv('.env')
+load_dotenv('.env.local', override=True)
+
+from sqlalchemy import func, insert, make_url, select
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncSession, create_async_engine
+
+import database
+import dao.transaction
+from dao.ledger import LedgerDAO
+from dao.transaction import TransactionDAO
+from models import Account, Base, Currency, Organization, Transaction, User
+
+USERS = 500
+ORGS = 50
+ACCOUNTS_PER_USER = 2
+INSERT_CHUNK = 5000
+# Таблицы, которые не должны читаться полным сканированием
+INDEXED_TABLES = ('transaction', 'ledger_entry')
+
+
+async def seed(conn: AsyncConnection, transactions: int):
+  """Заполняет пустую базу. Повторный запуск с уже заполненной базой ничего не делает"""
+  if (await conn.execute(select(func.count()).select_from(Transaction))).scalar_one() >= transactions:
+    return
+
+  rnd = random.Random(1)
+  await conn.execute(insert(Currency), [{'id': 1, 'name': 'explain', 'icon': 'explain'}])
+  await conn.execute(insert(User), [{'id': i, 'username': f'user{i}', 'password': ''} for i in range(1, USERS + 1)])
+  await conn.execute(insert(Organization), [
+    {'id': i, 'name': f'org{i}', 'owner_id': rnd.randint(1, USERS)} for i in range(1, ORGS + 1)
+  ])
+
+  accounts = [{'user_id': user_id} for user_id in range(1, USERS + 1) for _ in range(ACCOUNTS_PER_USER)]
+  accounts += [{'organization_id': org_id} for org_id in range(1, ORGS + 1)]
+  await conn.execute(insert(Account), [
+    row | {'id': i, 'currency_id': 1, 'name': 'explain', 'account_number': str(100000 + i), 'balance': 0}
+    for i, row in enumerate(accounts, start=1)
+  ])
+
+  started = datetime.datetime.utcnow() - datetime.timedelta(days=365)
+  for offset in range(0, transactions, INSERT_CHUNK):
+    rows = []
+    for _ in range(min(INSERT_CHUNK, transactions - offset)):
+      sender, recipient = rnd.sample(range(1, len(accounts) + 1), 2)
+      rows.append({
+        'sender_account_id': sender,
+        'recipient_account_id': recipient,
+        'amount': Decimal(rnd.randint(1, 10000)) / 100,
+        'created_at': started + datetime.timedelta(seconds=rnd.randint(0, 365 * 86400)),
+      })
+    await conn.execute(insert(Transaction), rows)
+
+  session = AsyncSession(bind=conn)
+  await LedgerDAO.backfill_range(session, 0, await LedgerDAO.max_transaction_id(session))
+
+  for table in ('user', 'organization', 'account', 'transaction', 'ledger_entry'):
+    await conn.exec_driver_sql(f'ANALYZE TABLE `{table}`')
+
+
+async def explain(conn: AsyncConnection, stmt) -> list[dict]:
+  # Значения подставляются в текст: EXPLAIN выполняется в обход обработки параметров SQLAlchemy
+  compiled = stmt.compile(dialect=conn.dialect, compile_kwargs={'literal_binds': True})
+  result = await conn.exec_driver_sql('EXPLAIN ' + str(compiled))
+  return [dict(row._mapping) for row in result]
+
+
+def violations(plan: list[dict]) -> list[dict]:
+  """Строки плана, где transaction или ledger_entry читаются без индекса"""
+  return [
+    row for row in plan
+    if row['table'] in INDEXED_TABLES and (row['type'] == 'ALL' or row['key'] is None)
+  ]
+
+
+async def main():
+  parser = argparse.ArgumentParser()
+  parser.add_argument('--transactions', type=int, default=200000)
+  parser.add_argument('--database', default='pxdb_explain', help='отдельная база, будет создана и заполнена')
+  parser.add_argument('--url', default=database.SQLALCHEMY_DATABASE_URL, help='сервер MySQL')
+  args = parser.parse_args()
+
+  url = make_url(args.url)
+  if args.database == url.database:
+    parser.error('нужна отдельная база: скрипт создает и заполняет таблицы')
+
+  server_engine = create_async_engine(url.set(database=None))
+  async with server_engine.begin() as conn:
+    await conn.exec_driver_sql(f'CREATE DATABASE IF NOT EXISTS `{args.database}`')
+  await server_engine.dispose()
+
+  engine = create_async_engine(url.set(database=args.database))
+  failed = False
+  try:
+    async with engine.begin() as conn:
+      await conn.run_sync(Base.metadata.create_all)
+      await seed(conn, args.transactions)
+
+    async with engine.connect() as conn:
+      for from_ledger in (False, True):
+        dao.transaction.HISTORY_FROM_LEDGER = from_ledger
+        for name, build_stmt in (('user', TransactionDAO.get_user_transactions_stmt),
+                                 ('org', TransactionDAO.get_org_transactions_stmt)):
+          for page in ('first page', 'keyset page'):
+            after = (datetime.datetime.utcnow() - datetime.timedelta(days=180), 0) if page == 'keyset page' else None
+            plan = await explain(conn, build_stmt(1, 11, after=after))
+            bad = violations(plan)
+            failed |= bool(bad)
+
+            print(f'\n{name} history, {"ledger" if from_ledger else "union all"}, {page}: {"FAIL" if bad else "ok"}')
+            for row in plan:
+              print(f'  {row["id"]!s:>3} {row["select_type"]:<14} {row["table"]!s:<16} {row["type"]!s:<7} '
+                    f'key={row["key"]} rows={row["rows"]} {row["Extra"] or ""}')
+  finally:
+    await engine.dispose()
+
+  sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+  asyncio.run(main())
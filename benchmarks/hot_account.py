@@ -0,0 +1,196 @@
+"""
+Нагрузочный тест горячего счета: много плательщиков переводят на один счет, а его владелец
+одновременно переводит с него (списание сливает шарды в баланс - consolidate).
+
+Прогон повторяется для каждого значения --shards (0 - без шардов) на отдельной базе
+(по умолчанию pxdb_load на том же сервере, что и приложение, пересоздается перед каждым прогоном).
+Переводы идут через обработчик accounts/transfer/by_number с его блокировками и retry_on_deadlock.
+Печатаются пропускная способность, задержки, число повторов после deadlock и отказов;
+в конце проверяется, что сумма всех балансов и шардов не изменилась. Код выхода 1 - расхождение.
+
+  python benchmarks/hot_account.py [--shards 0,8] [--payers 50] [--transfers 20] [--debitors 2] [--url mysql+asyncmy://...]
+"""
+import argparse
+import asyncio
+import logging
+import os
+import statistics
+import sys
+import time
+from decimal import Decimal
+
+# Модули приложения импортируются и как пакет pxproto, и из его каталога (как при запуске main.py)
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path[:0] = [os.path.join(ROOT, 'pxproto'), ROOT]
+
+from dotenv import load_dotenv
+
+load_dotenv('.env')
+load_dotenv('.env.local', override=True)
+
+from sqlalchemy import func, insert, make_url, select
+from sqlalchemy.ext.asyncio import AsyncEngine, create_async_engine
+
+import api.accounts
+import database
+from dao import AccountDAO
+from logger import logger
+from models import Account, AccountBalanceShard, Base, Currency, User
+from proto_models import TransferByNumberModel
+from pxws.connection_ctx import ConnectionContext
+from pxws.error_with_data import ProtocolError
+from pxws.server import Server
+
+HOT_ACCOUNT_ID = 1
+HOT_NUMBER = '100001'
+PAYER_BALANCE = Decimal(1000)
+
+
+class _Connection:
+  remote_address = ('127.0.0.1', 0)
+  subprotocol = None
+
+  async def send(self, message, text=None):
+    pass
+
+
+class _DeadlockCounter(logging.Handler):
+  """Считает повторы и отказы retry_on_deadlock по его записям в лог"""
+
+  def __init__(self):
+    super().__init__(logging.WARNING)
+    self.retries = 0
+
+  def emit(self, record: logging.LogRecord):
+    if 'deadlock, retry' in record.getMessage():
+      self.retries += 1
+
+
+def _payer_number(user_id: int) -> str:
+  return str(100000 + user_id)
+
+
+async def prepare(engine: AsyncEngine, payers: int, shards: int):
+  """Пересоздает схему: владелец горячего счета (user 1, баланс 0) и плательщики (user 2.., по счету)"""
+  async with engine.begin() as conn:
+    await conn.run_sync(Base.metadata.drop_all)
+    await conn.run_sync(Base.metadata.create_all)
+    await conn.execute(insert(Currency), [{'id': 1, 'name': 'load', 'icon': 'load'}])
+    await conn.execute(insert(User), [{'id': i, 'username': f'user{i}', 'password': ''} for i in range(1, payers + 2)])
+    await conn.execute(insert(Account), [
+      {'id': i, 'user_id': i, 'currency_id': 1, 'name': 'load', 'account_number': _payer_number(i),
+       'balance': 0 if i == HOT_ACCOUNT_ID else PAYER_BALANCE}
+      for i in range(1, payers + 2)
+    ])
+
+  if shards:
+    async with database.SessionLocal() as session:
+      account = (await AccountDAO.lock_accounts(session, HOT_ACCOUNT_ID))[HOT_ACCOUNT_ID]
+      await AccountDAO.set_balance_shards(session, account, shards)
+      await session.commit()
+
+
+async def total_money() -> Decimal:
+  async with database.SessionLocal() as session:
+    balances = (await session.execute(select(func.sum(Account.balance)))).scalar_one()
+    shard_balances = (await session.execute(select(func.sum(AccountBalanceShard.balance)))).scalar_one()
+  return balances + (shard_balances or 0)
+
+
+async def run(server: Server, payers: int, transfers: int, debitors: int) -> dict:
+  latencies = []
+  failures = 0
+
+  def client(user_id: int) -> ConnectionContext:
+    ctx = ConnectionContext(server, _Connection())
+    ctx.set_metadata('user_id', user_id)
+    return ctx
+
+  async def one_transfer(ctx: ConnectionContext, from_account_id: int, to_number: str, amount: Decimal):
+    nonlocal failures
+    started = time.perf_counter()
+    try:
+      await api.accounts.transfer_between_by_number(ctx=ctx, data=TransferByNumberModel(
+        from_account_id=from_account_id, to_account_number=to_number, amount=amount
+      ))
+      latencies.append(time.perf_counter() - started)
+    except ProtocolError:
+      # Недостаточно средств на горячем счете или исчерпаны повторы после deadlock
+      failures += 1
+
+  async def payer(user_id: int):
+    ctx = client(user_id)
+    for _ in range(transfers):
+      await one_transfer(ctx, user_id, HOT_NUMBER, Decimal(1))
+
+  async def debitor(number: int):
+    ctx = client(HOT_ACCOUNT_ID)
+    payer_id = 2 + number % payers
+    for _ in range(transfers):
+      await one_transfer(ctx, HOT_ACCOUNT_ID, _payer_number(payer_id), Decimal(1))
+
+  started = time.perf_counter()
+  await asyncio.gather(*(payer(user_id) for user_id in range(2, payers + 2)),
+                       *(debitor(number) for number in range(debitors)))
+  elapsed = time.perf_counter() - started
+
+  latencies.sort()
+  return {
+    'elapsed': elapsed,
+    'ok': len(latencies),
+    'failed': failures,
+    'p50': statistics.median(latencies) if latencies else 0,
+    'p99': statistics.quantiles(latencies, n=100, method='inclusive')[98] if len(latencies) > 1 else 0,
+  }
+
+
+async def main():
+  parser = argparse.ArgumentParser()
+  parser.add_argument('--shards', default='0,8', help='значения balance_shards горячего счета через запятую')
+  parser.add_argument('--payers', type=int, default=50, help='одновременных плательщиков')
+  parser.add_argument('--transfers', type=int, default=20, help='переводов на плательщика и списывающего')
+  parser.add_argument('--debitors', type=int, default=2, help='одновременных списаний с горячего счета')
+  parser.add_argument('--database', default='pxdb_load', help='отдельная база, пересоздается')
+  parser.add_argument('--url', default=database.SQLALCHEMY_DATABASE_URL, help='сервер MySQL')
+  args = parser.parse_args()
+
+  url = make_url(args.url)
+  if args.database == url.database:
+    parser.error('нужна отдельная база: скрипт пересоздает таблицы')
+
+  server_engine = create_async_engine(url.set(database=None))
+  async with server_engine.begin() as conn:
+    await conn.exec_driver_sql(f'CREATE DATABASE IF NOT EXISTS `{args.database}`')
+  await server_engine.dispose()
+
+  concurrency = args.payers + args.debitors
+  engine = create_async_engine(url.set(database=args.database), pool_size=concurrency, max_overflow=0)
+  database.SessionLocal.configure(bind=engine)
+
+  counter = _DeadlockCounter()
+  logger.addHandler(counter)
+  server = Server()
+  consistent = True
+  try:
+    print(f'{args.payers} payers and {args.debitors} debitors, {args.transfers} transfers each')
+    print(f'{"shards":>6} {"tx/s":>8} {"ok":>6} {"failed":>7} {"retries":>8} {"p50, ms":>8} {"p99, ms":>8} {"money":>6}')
+    for shards in (int(value) for value in args.shards.split(',')):
+      await prepare(engine, args.payers, shards)
+      before = await total_money()
+      counter.retries = 0
+
+      r = await run(server, args.payers, args.transfers, args.debitors)
+
+      money_ok = await total_money() == before
+      consistent &= money_ok
+      print(f'{shards:>6} {r["ok"] / r["elapsed"]:>8.0f} {r["ok"]:>6} {r["failed"]:>7} {counter.retries:>8} '
+            f'{r["p50"] * 1e3:>8.1f} {r["p99"] * 1e3:>8.1f} {"ok" if money_ok else "LOST":>6}')
+  finally:
+    logger.removeHandler(counter)
+    await engine.dispose()
+
+  sys.exit(0 if consistent else 1)
+
+
+if __name__ == '__main__':
+  asyncio.run(main())
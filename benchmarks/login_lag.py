@@ -0,0 +1,97 @@
+"""
+Задержка event loop во время одновременных входов: bcrypt прямо в обработчике (как до passwords.py)
+против passwords.check_login_password (пул потоков и лимит одновременных входов).
+
+Пока идут входы, фоновая задача каждые --tick мс засыпает и замеряет, насколько позже проснулась:
+это время, на которое в воркере замирают все остальные соединения (переводы, подписки).
+БД не нужна.
+
+  python benchmarks/login_lag.py [--logins 20] [--tick 10]
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+
+# Модули приложения импортируются и как пакет pxproto, и из его каталога (как при запуске main.py)
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path[:0] = [os.path.join(ROOT, 'pxproto'), ROOT]
+
+from dotenv import load_dotenv
+
+load_dotenv('.env')
+load_dotenv('.env.local', override=True)
+
+import passwords
+from pxws.error_with_data import ProtocolError
+
+PASSWORD = 'benchmark-password'
+
+
+async def blocking_login(hashed: bytes) -> bool:
+  return passwords._check(PASSWORD, hashed)
+
+
+async def pooled_login(hashed: bytes) -> bool:
+  return await passwords.check_login_password(PASSWORD, hashed)
+
+
+async def run(login, hashed: bytes, logins: int, tick: float) -> dict:
+  lags = []
+  done = asyncio.Event()
+
+  async def ticker():
+    while not done.is_set():
+      started = time.perf_counter()
+      await asyncio.sleep(tick)
+      lags.append(time.perf_counter() - started - tick)
+
+  async def one_login():
+    try:
+      await login(hashed)
+      return True
+    except ProtocolError:
+      return False
+
+  ticker_task = asyncio.create_task(ticker())
+  # Тикер должен успеть запуститься до первого входа
+  await asyncio.sleep(tick)
+
+  started = time.perf_counter()
+  results = await asyncio.gather(*(one_login() for _ in range(logins)))
+  elapsed = time.perf_counter() - started
+
+  done.set()
+  await ticker_task
+
+  return {
+    'elapsed': elapsed,
+    'rejected': results.count(False),
+    'p50': statistics.median(lags),
+    'p99': statistics.quantiles(lags, n=100, method='inclusive')[98] if len(lags) > 1 else lags[0],
+    'max': max(lags),
+  }
+
+
+async def main():
+  parser = argparse.ArgumentParser()
+  parser.add_argument('--logins', type=int, default=20, help='одновременных входов')
+  parser.add_argument('--tick', type=float, default=10, help='период замера задержки, мс')
+  args = parser.parse_args()
+
+  hashed = await passwords.hash_password(PASSWORD)
+  tick = args.tick / 1000
+
+  print(f'{args.logins} concurrent logins, {passwords.PASSWORD_WORKERS} bcrypt workers, '
+        f'login concurrency {passwords.LOGIN_CONCURRENCY}')
+  print(f'{"mode":<9} {"total, s":>9} {"rejected":>9} {"lag p50, ms":>12} {"lag p99, ms":>12} {"lag max, ms":>12}')
+  for name, login in (('blocking', blocking_login), ('pooled', pooled_login)):
+    r = await run(login, hashed, args.logins, tick)
+    print(f'{name:<9} {r["elapsed"]:>9.2f} {r["rejected"]:>9} {r["p50"] * 1e3:>12.1f} '
+          f'{r["p99"] * 1e3:>12.1f} {r["max"] * 1e3:>12.1f}')
+
+
+if __name__ == '__main__':
+  asyncio.run(main())
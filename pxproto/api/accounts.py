@@ -1,17 +1,26 @@
+import datetime
 import decimal
 import random
+from itertools import repeat
+from typing import Iterable, Optional
 
 from sqlalchemy import func, or_
 from sqlalchemy import select, exists
 from sqlalchemy.ext.asyncio import AsyncSession
 
 import database
+import events
 import models
+import outbox
 from dao import AccountDAO, UserDAO
+from dao.idempotency import IdempotencyDAO
+from dao.ledger import LedgerDAO, owner_of
 from dao.org import OrganizationDAO
-from dao.push_service import PushService
+from dao.stats import AccountStatsDAO
+from dao.transaction import TransactionDAO
 from logger import logger
-from proto_models import TransferBetweenModel, TransferByNumberModel
+from principal import Principal, get_principal
+from proto_models import TransferBetweenModel, TransferByNumberModel, TransferBatchModel, AccountStatsModel
 from pxws.connection_ctx import ConnectionContext
 from pxws.error_with_data import ProtocolError
 from pxws.route import Route
@@ -19,7 +28,7 @@ from pxws.route import Route
 route = Route()
 
 
-async def can_access_account(sess: AsyncSession, user: models.User, account: models.Account) -> bool:
+async def can_access_account(sess: AsyncSession, user: Principal, account: models.Account) -> bool:
   if user.is_admin or (account.user_id == user.id and not account.is_deleted):
     return True
 
@@ -30,12 +39,35 @@ async def can_access_account(sess: AsyncSession, user: models.User, account: mod
   return False
 
 
+async def accounts_access(sess: AsyncSession, user: Principal, accounts: Iterable[models.Account]) -> dict[int, bool]:
+  """
+  То же, что can_access_account, но для набора счетов (например, страницы транзакций).
+  Роли во всех организациях счетов загружаются одним запросом.
+
+  :returns: ID счета -> есть ли доступ
+  """
+  accounts = list(accounts)
+  if user.is_admin:
+    return {account.id: True for account in accounts}
+
+  org_ids = {account.organization_id for account in accounts if account.organization_id is not None}
+  roles = await OrganizationDAO.get_roles(sess, org_ids, user.id) if org_ids else {}
+
+  return {
+    account.id: (
+      (account.user_id == user.id and not account.is_deleted)
+      or (account.organization_id is not None and roles[account.organization_id] is not None)
+    )
+    for account in accounts
+  }
+
+
 @route.on('accounts/fetch/user', require_auth=True)
 async def fetch(ctx: ConnectionContext, id: str):
   async with database.get_db() as sess:
     # Проверка прав доступа
     user_id: int = ctx.get_metadata('user_id', None)
-    is_admin = (await UserDAO.is_admin(sess, user_id)) if user_id else False
+    is_admin = (await get_principal(sess, ctx)).is_admin if user_id else False
 
     target_user_id = await UserDAO.get_id_by_name(sess, id)
     if not target_user_id:
@@ -59,12 +91,13 @@ async def fetch(ctx: ConnectionContext, id: str):
       )
     )
 
-    result = await sess.execute(stmt)
+    result = (await sess.execute(stmt)).scalars().all()
+    await AccountDAO.load_shard_balances(sess, result)
 
     # формирование ответа
     can_manage = target_user_id == user_id or is_admin
     accounts = []
-    for acc in result.scalars():
+    for acc in result:
       accounts.append(acc.to_dict() | {
         'can_manage': can_manage
       })
@@ -79,13 +112,14 @@ async def fetch(ctx: ConnectionContext, id: str):
 async def fetch_org(ctx: ConnectionContext, session: AsyncSession, id: int):
   # Проверка прав доступа
   user_id: int = ctx.get_metadata('user_id', None)
-  is_admin = (await UserDAO.is_admin(session, user_id)) if user_id else False
+  is_admin = (await get_principal(session, ctx)).is_admin if user_id else False
   role = (await OrganizationDAO.get_role_or_none(session, id, user_id)) if id and user_id else None
 
   if role or is_admin:
     result = await OrganizationDAO.get_accounts_for_user(session, id, user_id)
   else:
     result = await OrganizationDAO.get_public_accounts(session, id)
+  await AccountDAO.load_shard_balances(session, result)
 
   # формирование ответа
   can_manage = role or is_admin
@@ -104,8 +138,7 @@ async def fetch_org(ctx: ConnectionContext, session: AsyncSession, id: int):
 @database.connection
 async def create_user_account(session: AsyncSession, ctx: ConnectionContext, id: str, name: str,
                               currency_id: int):
-  user = await UserDAO.get_user(session, ctx.get_metadata('user_id'))
-  assert user
+  user = await get_principal(session, ctx)
 
   if user.username != id and not user.is_admin:
     raise ProtocolError('Шо творишь, ирод. Прав нет')
@@ -124,8 +157,7 @@ async def create_user_account(session: AsyncSession, ctx: ConnectionContext, id:
 @route.on('accounts/new/org', require_auth=True, ignore_params=['session'])
 @database.connection
 async def create_org_account(session: AsyncSession, ctx: ConnectionContext, id: int, name: str, currency_id: int):
-  user = await UserDAO.get_user(session, ctx.get_metadata('user_id'))
-  assert user
+  user = await get_principal(session, ctx)
 
   if not user.is_admin:
     role = await OrganizationDAO.get_role_or_none(session, id, user.id)
@@ -140,7 +172,7 @@ async def create_org_account(session: AsyncSession, ctx: ConnectionContext, id:
   return acc.to_dict() | {'can_manage': True}
 
 
-async def _check_account_limit(session: AsyncSession, user, owner_id: int, is_org: bool = False):
+async def _check_account_limit(session: AsyncSession, user: Principal, owner_id: int, is_org: bool = False):
   if user.is_admin:
     return
 
@@ -162,7 +194,7 @@ async def _check_account_limit(session: AsyncSession, user, owner_id: int, is_or
 @route.on('accounts/rename', require_auth=True, ignore_params=['session'])
 @database.connection
 async def rename(session: AsyncSession, ctx: ConnectionContext, account_id: int, new_name: str):
-  user = await UserDAO.get_user(session, ctx.get_metadata('user_id'))
+  user = await get_principal(session, ctx)
   account = await AccountDAO.get_account(session, account_id)
 
   if not account or not await can_access_account(session, user, account):
@@ -175,12 +207,15 @@ async def rename(session: AsyncSession, ctx: ConnectionContext, account_id: int,
 @route.on('accounts/delete', require_auth=True, ignore_params=['session'])
 @database.connection
 async def delete(session: AsyncSession, ctx: ConnectionContext, account_id: int):
-  user = await UserDAO.get_user(session, ctx.get_metadata('user_id'))
+  user = await get_principal(session, ctx)
   account = await AccountDAO.get_account(session, account_id)
 
   if not account or not await can_access_account(session, user, account):
     raise ProtocolError('Доступ к счёту запрещён')
 
+  if account.balance_shards:
+    await consolidate_balance(session, account, balance_shards=0)
+
   if account.balance != 0:
     raise ProtocolError('Нельзя закрыть счёт с ненулевым балансом')
 
@@ -191,7 +226,7 @@ async def delete(session: AsyncSession, ctx: ConnectionContext, account_id: int)
 @route.on('accounts/settings', require_auth=True, ignore_params=['session'])
 @database.connection
 async def settings(session: AsyncSession, ctx: ConnectionContext, account_id: int, is_public: bool):
-  user = await UserDAO.get_user(session, ctx.get_metadata('user_id'))
+  user = await get_principal(session, ctx)
   account = await AccountDAO.get_account(session, account_id, for_update=False)
 
   if not account or not await can_access_account(session, user, account):
@@ -201,19 +236,75 @@ async def settings(session: AsyncSession, ctx: ConnectionContext, account_id: in
   await session.commit()
 
 
+# Максимальный период accounts/stats
+STATS_MAX_DAYS = 731
+
+
+def _stats_point(day: datetime.date, inflow, outflow, count: int, closing_balance) -> dict:
+  return {
+    'date': day.isoformat(),
+    'inflow': float(inflow),
+    'outflow': float(outflow),
+    'count': count,
+    'closing_balance': float(closing_balance),
+  }
+
+
+@route.on('accounts/stats', require_auth=True, ignore_params=['session'])
+@database.connection
+async def account_stats(session: AsyncSession, ctx: ConnectionContext, req: AccountStatsModel):
+  """
+  Обороты и баланс счета по дням или месяцам из account_daily_stats.
+  Периоды без транзакций не возвращаются: баланс в них равен closing_balance предыдущей точки
+  (или opening_balance).
+  """
+  user = await get_principal(session, ctx)
+  account = await AccountDAO.get_account(session, req.account_id, for_update=False)
+
+  if not account or not await can_access_account(session, user, account):
+    raise ProtocolError('Доступ к счёту запрещён')
+
+  date_to = req.date_to or datetime.datetime.utcnow().date()
+  date_from = req.date_from or date_to - datetime.timedelta(days=29)
+  if date_from > date_to:
+    raise ProtocolError('Неверный период')
+  if (date_to - date_from).days >= STATS_MAX_DAYS:
+    raise ProtocolError('Слишком большой период')
+
+  opening_parts = await AccountStatsDAO.part_balances_before(session, account.id, date_from)
+  days = await AccountStatsDAO.get_days(session, account.id, date_from, date_to, opening_parts)
+  opening_balance = sum(opening_parts.values()) if opening_parts else None
+
+  if req.group == 'day':
+    points = [_stats_point(d.day, d.inflow, d.outflow, d.count, d.closing_balance) for d in days]
+  else:
+    months = {}
+    for d in days:
+      month = d.day.replace(day=1)
+      inflow, outflow, count, _ = months.get(month, (0, 0, 0, None))
+      months[month] = (inflow + d.inflow, outflow + d.outflow, count + d.count, d.closing_balance)
+    points = [_stats_point(month, *values) for month, values in months.items()]
+
+  return {
+    'opening_balance': float(opening_balance) if opening_balance is not None else None,
+    'points': points,
+  }
+
+
 async def transfer(session: AsyncSession, author_id: int, comment: str, from_account: models.Account,
                    to_account: models.Account,
-                   amount: float) -> models.Transaction:
+                   amount: decimal.Decimal) -> models.Transaction:
+  # У перевода две стороны в ledger_entry: на один и тот же счет их не различить
+  if from_account.id == to_account.id:
+    raise ProtocolError('Нельзя перевести на тот же счёт')
   if from_account.currency_id != to_account.currency_id:
     raise ProtocolError('У счетов разная валюта')
 
+  await prepare_debit(session, from_account, amount)
   if from_account.balance < amount:
     raise ProtocolError('Недостаточно средств')
 
-  amount = decimal.Decimal(amount)
-
-  from_account.balance -= amount
-  to_account.balance += amount
+  [credited_shard], _ = await apply_transfers(session, from_account, [(to_account, amount)])
 
   transaction = models.Transaction(
     sender_account_id=from_account.id,
@@ -224,40 +315,182 @@ async def transfer(session: AsyncSession, author_id: int, comment: str, from_acc
   )
   session.add(transaction)
   await session.flush()
+  LedgerDAO.record(session, transaction, from_account, to_account)
+  await AccountStatsDAO.record(session, transaction, from_account, to_account, credited_shard)
+  await TransactionDAO.increment_counters(session, [_counted_accounts(from_account, to_account, credited_shard)])
 
-  # Попытка уведомить получателя
-  if from_account.user_id != to_account.user_id:
-    await send_top_up_notification(
-      session,
-      to_account.user_id,
-      from_account,
-      to_account,
-      transaction
-    )
+  publish_transfer_events(session, transaction, from_account, to_account)
+
+  # Уведомление получателю уйдет после коммита, не удерживая блокировки счетов
+  if to_account.user_id is not None and from_account.user_id != to_account.user_id:
+    await outbox.enqueue(session, [_top_up_message(transaction, from_account, to_account)])
 
   return transaction
 
 
-async def validate_transfer_amount(amount: float):
+async def consolidate_balance(session: AsyncSession, account: models.Account, balance_shards: Optional[int] = None):
+  """
+  Переносит шарды баланса в account.balance и отмечает перенос в account_daily_stats.
+  Строка счета должна быть заблокирована.
+
+  :param balance_shards: заодно поменять число шардов (0 - выключить)
+  """
+  if balance_shards is None:
+    shards = await AccountDAO.consolidate(session, account)
+  else:
+    shards = await AccountDAO.set_balance_shards(session, account, balance_shards)
+  await AccountStatsDAO.record_consolidation(session, account, shards)
+
+
+async def prepare_debit(session: AsyncSession, account: models.Account, amount: decimal.Decimal):
+  """Списание идет с account.balance: если его не хватает, туда переносятся шарды"""
+  if account.balance < amount and account.balance_shards:
+    await consolidate_balance(session, account)
+
+
+def _credits_shard(from_account: models.Account, to_account: models.Account) -> bool:
+  return bool(to_account.balance_shards) and to_account.id != from_account.id
+
+
+async def apply_transfers(
+    session: AsyncSession,
+    from_account: models.Account,
+    credits: list[tuple[models.Account, decimal.Decimal]]
+) -> tuple[list[Optional[models.AccountBalanceShard]], list[tuple[decimal.Decimal, decimal.Decimal]]]:
+  """
+  Списывает суммы с from_account и зачисляет получателям. Получателю с шардами баланса сумма
+  зачисляется на случайный шард: строка шарда блокируется FOR UPDATE, а строка счета - только общей
+  блокировкой (lock_accounts shared), взятой раньше.
+
+  :returns: шард каждого зачисления (None - на account.balance) и полные балансы
+    (отправителя, получателя) после каждого перевода - для событий подписчикам
+  """
+  accounts = {from_account.id: from_account} | {account.id: account for account, _ in credits}
+  await AccountDAO.load_shard_balances(session, accounts.values())
+
+  sharded = [to_account for to_account, _ in credits if _credits_shard(from_account, to_account)]
+  locked_shards = iter(await AccountDAO.lock_shards(session, sharded) if sharded else ())
+
+  credited_shards = []
+  balances = []
+  for to_account, amount in credits:
+    from_account.balance -= amount
+
+    shard = None
+    if _credits_shard(from_account, to_account):
+      shard = next(locked_shards)
+      if shard is None:
+        raise ProtocolError(f'Счёт № {to_account.account_number} перенастраивается, повторите операцию')
+      shard.balance += amount
+      to_account.shard_balance += amount
+      # Перевод между счетами одного владельца учтен в его счетчике (см. _counted_accounts)
+      if owner_of(to_account) != owner_of(from_account):
+        shard.transaction_count += 1
+    else:
+      to_account.balance += amount
+
+    credited_shards.append(shard)
+    balances.append((from_account.total_balance, to_account.total_balance))
+  return credited_shards, balances
+
+
+def _counted_accounts(from_account: models.Account, to_account: models.Account,
+                      credited_shard: Optional[models.AccountBalanceShard]) -> tuple[models.Account, ...]:
+  """Счета для TransactionDAO.increment_counters: зачисление на шард учитывается в счетчике шарда"""
+  return (from_account,) if credited_shard is not None else (from_account, to_account)
+
+
+def _shared_recipients(from_account_id: int, recipients: Iterable[tuple[int, int]]) -> set[int]:
+  """Получатели (id, balance_shards) с шардами баланса: их строки блокируются общей блокировкой (lock_accounts shared)"""
+  return {account_id for account_id, shards in recipients if shards and account_id != from_account_id}
+
+
+def _owner_name(account: models.Account) -> str:
+  return account.user.username if account.user else account.organization.name
+
+
+def transfer_events(
+    transaction: models.Transaction,
+    from_account: models.Account,
+    to_account: models.Account,
+    balances: Optional[tuple[decimal.Decimal, decimal.Decimal]] = None
+) -> list:
+  """
+  Дельты для подписчиков счетов и организаций.
+
+  :param balances: балансы (отправителя, получателя) сразу после транзакции, по умолчанию текущие
+  """
+  if balances is None:
+    balances = (from_account.total_balance, to_account.total_balance)
+
+  transfer_events = []
+  for account, counterparty, sign, balance in ((from_account, to_account, -1, balances[0]),
+                                               (to_account, from_account, 1, balances[1])):
+    payload = {
+      'type': 'account/transaction',
+      'data': {
+        'account_id': account.id,
+        'balance': float(balance),
+        'transaction': {
+          'id': transaction.id,
+          'amount': sign * float(transaction.amount),
+          'counterparty_name': _owner_name(counterparty),
+          'timestamp': transaction.created_at.timestamp(),
+          'comment': transaction.comment,
+        }
+      }
+    }
+    transfer_events.append((events.account_topic(account.id), payload))
+    if account.organization_id is not None:
+      transfer_events.append((events.org_topic(account.organization_id), payload))
+  return transfer_events
+
+
+def publish_transfer_events(
+    session: AsyncSession,
+    transaction: models.Transaction,
+    from_account: models.Account,
+    to_account: models.Account
+):
+  """Дельты транзакции уходят после коммита"""
+  events.publish_on_commit(session, transfer_events(transaction, from_account, to_account))
+
+
+async def validate_transfer_amount(amount: decimal.Decimal):
   if amount <= 0:
     raise ProtocolError('Сумма должна быть больше нуля')
 
 
-async def get_current_user(session: AsyncSession, ctx: ConnectionContext) -> models.User:
-  user_id = ctx.get_metadata('user_id')
-  user = await UserDAO.get_user(session, user_id)
-  if not user:
-    raise ProtocolError('Пользователь не найден')
-  return user
+async def get_current_user(session: AsyncSession, ctx: ConnectionContext) -> Principal:
+  return await get_principal(session, ctx)
 
 
 async def validate_accounts_access(
     session: AsyncSession,
-    user: models.User,
+    user: Principal,
     *accounts: models.Account
 ) -> bool:
-  checks = [await can_access_account(session, user, acc) for acc in accounts]
-  return all(checks)
+  return all((await accounts_access(session, user, accounts)).values())
+
+
+async def claim_idempotency_key(
+    session: AsyncSession,
+    user: Principal,
+    key: Optional[str]
+) -> tuple[Optional[models.IdempotencyKey], Optional[dict]]:
+  """
+  Занимает ключ идемпотентности перевода до блокировки счетов.
+
+  :returns: (запись для ответа, None) или (None, сохраненный ответ), если перевод с этим ключом
+    уже выполнен. Без ключа - (None, None)
+  """
+  if key is None:
+    return None, None
+
+  entry, response = await IdempotencyDAO.claim(session, user.id, key)
+  if entry is None and response is None:
+    raise ProtocolError('Операция с этим ключом не завершена, повторите запрос')
+  return entry, response
 
 
 async def get_transaction_payload(
@@ -265,14 +498,24 @@ async def get_transaction_payload(
     transaction: models.Transaction,
     sender: models.Account,
     receiver: models.Account,
-    current_user: models.User
+    current_user: Principal
 ) -> dict:
-  from_account_id = sender.id if await can_access_account(session, current_user, sender) else None
-  to_account_id = receiver.id if await can_access_account(session, current_user, receiver) else None
+  access = await accounts_access(session, current_user, (sender, receiver))
+  return _transaction_dict(transaction, sender, receiver, access)
+
+
+def _transaction_dict(
+    transaction: models.Transaction,
+    sender: models.Account,
+    receiver: models.Account,
+    access: dict[int, bool]
+) -> dict:
+  from_account_id = sender.id if access[sender.id] else None
+  to_account_id = receiver.id if access[receiver.id] else None
 
   return transaction.to_dict(
-    sender_name=sender.user.username if sender.user else sender.organization.name,
-    receiver_name=receiver.user.username if receiver.user else receiver.organization.name,
+    sender_name=_owner_name(sender),
+    receiver_name=_owner_name(receiver),
     currency_id=sender.currency_id,
     from_account_id=from_account_id,
     to_account_id=to_account_id,
@@ -281,57 +524,182 @@ async def get_transaction_payload(
   )
 
 
-@route.on('accounts/transfer', require_auth=True, ignore_params=['session'])
+@route.on('accounts/transfer', require_auth=True, ignore_params=['session'], serial=True)
 @database.connection
+@database.retry_on_deadlock
 async def transfer_between(session: AsyncSession, ctx: ConnectionContext,
                            data: TransferBetweenModel):
   # logger.info(f'accounts/transfer ')
   await validate_transfer_amount(data.amount)
   user = await get_current_user(session, ctx)
 
-  from_account = await AccountDAO.get_account(session, data.from_account_id, get_user=True, get_org=True)
-  to_account = await AccountDAO.get_account(session, data.to_account_id, get_user=True, get_org=True)
+  idempotency_entry, replay = await claim_idempotency_key(session, user, data.idempotency_key)
+  if replay is not None:
+    return replay
+
+  shards = await AccountDAO.get_balance_shards(session, [data.to_account_id])
+  accounts = await AccountDAO.lock_accounts(
+    session, data.from_account_id, data.to_account_id,
+    shared=_shared_recipients(data.from_account_id, shards.items()),
+    get_user=True, get_org=True
+  )
+  from_account = accounts.get(data.from_account_id)
+  to_account = accounts.get(data.to_account_id)
 
   if not from_account or not to_account or not await validate_accounts_access(session, user, from_account, to_account):
     raise ProtocolError('Операция невозможна')
 
   transaction = await transfer(session, user.id, data.comment, from_account, to_account, data.amount)
+  payload = await get_transaction_payload(session, transaction, from_account, to_account, user)
+  if idempotency_entry is not None:
+    idempotency_entry.response = payload
+
   await session.commit()
 
-  return await get_transaction_payload(session, transaction, from_account, to_account, user)
+  return payload
 
 
-@route.on('accounts/transfer/by_number', require_auth=True, ignore_params=['session'])
+@route.on('accounts/transfer/by_number', require_auth=True, ignore_params=['session'], serial=True)
 @database.connection
+@database.retry_on_deadlock
 async def transfer_between_by_number(session: AsyncSession, ctx: ConnectionContext,
                                      data: TransferByNumberModel):
   await validate_transfer_amount(data.amount)
   user = await get_current_user(session, ctx)
 
-  from_account = await AccountDAO.get_account(session, data.from_account_id, get_user=True, get_org=True)
-  to_account = await AccountDAO.get_account(session, str(data.to_account_number), get_user=True, get_org=True)
+  idempotency_entry, replay = await claim_idempotency_key(session, user, data.idempotency_key)
+  if replay is not None:
+    return replay
+
+  # Номер счета не меняется, поэтому id можно узнать до блокировки
+  targets = await AccountDAO.resolve_numbers(session, [str(data.to_account_number)])
+  to_account_id, to_shards = targets.get(str(data.to_account_number), (None, 0))
+  accounts = await AccountDAO.lock_accounts(
+    session, data.from_account_id, to_account_id,
+    shared=_shared_recipients(data.from_account_id, [(to_account_id, to_shards)]),
+    get_user=True, get_org=True
+  )
+  from_account = accounts.get(data.from_account_id)
+  to_account = accounts.get(to_account_id)
 
   if not from_account or not to_account or not await can_access_account(session, user, from_account):
     raise ProtocolError('Операция невозможна')
 
   transaction = await transfer(session, user.id, data.comment, from_account, to_account, data.amount)
   payload = await get_transaction_payload(session, transaction, from_account, to_account, user)
+  if idempotency_entry is not None:
+    idempotency_entry.response = payload
 
   await session.commit()
 
   return payload
 
 
-async def send_top_up_notification(
-    session: AsyncSession,
-    target_user_id: int,
+@route.on('accounts/transfer/batch', require_auth=True, ignore_params=['session'], serial=True)
+@database.connection
+@database.retry_on_deadlock
+async def transfer_batch(session: AsyncSession, ctx: ConnectionContext, data: TransferBatchModel):
+  """
+  Пачка переводов с одного счета (выплаты): проходят все или ни один.
+
+  Счета блокируются в порядке id (получатели с шардами баланса - общей блокировкой),
+  баланс проверяется на всю сумму до изменений, транзакции вставляются одним INSERT.
+  Уведомления получателям уходят после коммита.
+  """
+  for item in data.transfers:
+    await validate_transfer_amount(item.amount)
+  user = await get_current_user(session, ctx)
+
+  idempotency_entry, replay = await claim_idempotency_key(session, user, data.idempotency_key)
+  if replay is not None:
+    return replay
+
+  # Номер счета не меняется, поэтому id можно узнать до блокировки
+  targets = await AccountDAO.resolve_numbers(session, (item.to_account_number for item in data.transfers))
+  ids = {number: account_id for number, (account_id, _) in targets.items()}
+  accounts = await AccountDAO.lock_accounts(
+    session, data.from_account_id, *ids.values(),
+    shared=_shared_recipients(data.from_account_id, targets.values()),
+    get_user=True, get_org=True
+  )
+  from_account = accounts.get(data.from_account_id)
+
+  if not from_account or not await can_access_account(session, user, from_account):
+    raise ProtocolError('Операция невозможна')
+
+  recipients = []
+  for item in data.transfers:
+    to_account = accounts.get(ids.get(item.to_account_number))
+    if not to_account:
+      raise ProtocolError(f'Счёт № {item.to_account_number} не найден')
+    if to_account.id == from_account.id:
+      raise ProtocolError('Нельзя перевести на тот же счёт')
+    if to_account.currency_id != from_account.currency_id:
+      raise ProtocolError(f'У счёта № {item.to_account_number} другая валюта')
+    recipients.append(to_account)
+
+  amounts = [item.amount for item in data.transfers]
+  await prepare_debit(session, from_account, sum(amounts))
+  if from_account.balance < sum(amounts):
+    raise ProtocolError('Недостаточно средств')
+
+  credited_shards, balances = await apply_transfers(session, from_account, list(zip(recipients, amounts)))
+
+  created_at = datetime.datetime.utcnow()
+  transactions = await TransactionDAO.insert_many(session, from_account.id, [
+    {
+      'sender_account_id': from_account.id,
+      'recipient_account_id': to_account.id,
+      'author_id': user.id,
+      'amount': amount,
+      'comment': item.comment,
+      'created_at': created_at,
+    }
+    for item, to_account, amount in zip(data.transfers, recipients, amounts)
+  ])
+  transfers = list(zip(transactions, repeat(from_account), recipients))
+
+  await LedgerDAO.record_many(session, transfers)
+  await AccountStatsDAO.record_many(session, transfers, credited_shards)
+  await TransactionDAO.increment_counters(session, (
+    _counted_accounts(sender, receiver, shard)
+    for (_, sender, receiver), shard in zip(transfers, credited_shards)
+  ))
+
+  events.publish_on_commit(session, [
+    event
+    for transfer_, transfer_balances in zip(transfers, balances)
+    for event in transfer_events(*transfer_, transfer_balances)
+  ])
+
+  notifications = [
+    _top_up_message(transaction, sender, receiver)
+    for transaction, sender, receiver in transfers
+    if receiver.user_id is not None and receiver.user_id != sender.user_id
+  ]
+  await outbox.enqueue(session, notifications)
+
+  access = await accounts_access(session, user, accounts.values())
+  response = {
+    'transactions': [_transaction_dict(*transfer_, access) for transfer_ in transfers],
+    'balance': float(from_account.total_balance),
+  }
+  if idempotency_entry is not None:
+    idempotency_entry.response = response
+
+  await session.commit()
+
+  return response
+
+
+def _top_up_message(
+    transaction: models.Transaction,
     from_account: models.Account,
-    to_account: models.Account,
-    transaction: models.Transaction
-):
-  await PushService.send_to_user(
-    session,
-    target_user_id,
+    to_account: models.Account
+) -> tuple[int, str, str]:
+  return (
+    to_account.user_id,
     f'Перевод на № {to_account.account_number}',
-    f'{from_account.user.username if from_account.user else from_account.organization.name} (№ {from_account.account_number}) перевел(а) вам {transaction.amount:.2f}'
+    f'{_owner_name(from_account)} (№ {from_account.account_number}) перевел(а) вам {transaction.amount:.2f}'
   )
+
@@ -1,7 +1,12 @@
 from sqlalchemy.ext.asyncio import AsyncSession
 
 import database
-from dao import UserDAO
+import passwords
+import push_delivery
+from api.accounts import consolidate_balance
+from config import ACCOUNT_MAX_BALANCE_SHARDS
+from dao import AccountDAO, UserDAO
+from principal import get_principal
 from pxws.connection_ctx import ConnectionContext
 from pxws.error_with_data import ProtocolError
 from pxws.route import Route
@@ -9,7 +14,7 @@ from pxws.route import Route
 route = Route()
 
 async def check_admin(session: AsyncSession, ctx: ConnectionContext):
-  if not await UserDAO.is_admin(session, ctx.get_metadata('user_id')):
+  if not (await get_principal(session, ctx)).is_admin:
     raise ProtocolError('Ты куда лезешь')
 
 @route.on('admin/new_user', require_auth=True, ignore_params=['session'])
@@ -32,3 +37,50 @@ async def change_password(
 
   await UserDAO.set_password(session, username, password)
   await session.commit()
+
+
+@route.on('admin/stats/db_pool', require_auth=True, ignore_params=['session'])
+@database.connection
+async def db_pool_stats(session: AsyncSession, ctx: ConnectionContext):
+  await check_admin(session, ctx)
+
+  return database.pool_stats()
+
+
+@route.on('admin/stats/passwords', require_auth=True, ignore_params=['session'])
+@database.connection
+async def password_stats(session: AsyncSession, ctx: ConnectionContext):
+  await check_admin(session, ctx)
+
+  return passwords.stats()
+
+
+@route.on('admin/stats/push', require_auth=True, ignore_params=['session'])
+@database.connection
+async def push_stats(session: AsyncSession, ctx: ConnectionContext):
+  await check_admin(session, ctx)
+
+  return push_delivery.stats()
+
+
+@route.on('admin/accounts/balance_shards', require_auth=True, ignore_params=['session'])
+@database.connection
+@database.retry_on_deadlock
+async def set_balance_shards(session: AsyncSession, ctx: ConnectionContext, account_id: int, shards: int):
+  """
+  Шарды баланса для счета, который получает много переводов (магазин): входящие переводы
+  блокируют строку случайного шарда, а не счета. 0 - выключить, баланс шардов переносится на счет.
+  """
+  await check_admin(session, ctx)
+
+  if not 0 <= shards <= ACCOUNT_MAX_BALANCE_SHARDS:
+    raise ProtocolError(f'Число шардов - от 0 до {ACCOUNT_MAX_BALANCE_SHARDS}')
+
+  account = (await AccountDAO.lock_accounts(session, account_id)).get(account_id)
+  if not account:
+    raise ProtocolError('Счёт не найден')
+
+  await consolidate_balance(session, account, balance_shards=shards)
+  await session.commit()
+
+  return account.to_dict()
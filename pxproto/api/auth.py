@@ -6,11 +6,16 @@ from jose import jwt, JWTError, ExpiredSignatureError
 from sqlalchemy import select
 
 import database
+import events
 import models
+import passwords
+from dao import UserDAO
 from dao.org import OrganizationDAO
+from principal import Principal, set_principal
 from pxws.connection_ctx import ConnectionContext
 from pxws.error_with_data import ErrorWithData, ProtocolError
 from pxws.route import Route
+from token_cache import token_cache
 from utils import send_toast
 
 JWT_SECRET: str = os.getenv("JWT_SECRET")
@@ -42,48 +47,41 @@ class TokenExpiredError(ErrorWithData):
     })
 
 def get_hashed_password(password: str):
+  """Синхронная версия, блокирует event loop. В обработчиках используйте passwords.hash_password"""
   return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt())
 
-def check_password(password: str, hashed_password):
-  return bcrypt.checkpw(password.encode('utf-8'), hashed_password.encode('utf-8'))
-
 @route.on('auth')
 async def auth(ctx: ConnectionContext, token: str):
   try:
-    payload = decode_jwt(token)
-    user_id = payload.get('user_id')
-
-    if not user_id:
-      raise ProtocolError("Invalid token: missing user_id")
+    cached = token_cache.get(token)
+    if cached:
+      payload, snapshot = cached
+    else:
+      since_epoch = token_cache.epoch()
+      payload, snapshot = await _verify_token(token)
+      token_cache.put(token, payload, snapshot, since_epoch)
 
-    async with database.get_db() as sess:
-      user = (await sess.execute(
-        select(models.User).where(models.User.id == user_id)
-      )).scalar_one_or_none()
+    ctx.set_authenticated({
+      'user_id': snapshot['user_id'],
+      'authenticated_at': datetime.utcnow().isoformat()
+    }, user_id=snapshot['user_id'])
 
-      if not user:
-        raise ProtocolError("User not found")
+    # Дополнительные метаданные
+    ctx.set_metadata('user_id', snapshot['user_id'])
+    ctx.set_metadata('username', snapshot['username'])
+    set_principal(ctx, Principal.from_snapshot(snapshot))
 
-      ctx.set_authenticated({
-        'user_id': user.id,
-        'authenticated_at': datetime.utcnow().isoformat()
-      })
+    # await send_toast(ctx, 'info', 'Вы вошли в систему!', None, 3000)
 
-      # Дополнительные метаданные
-      ctx.set_metadata('user_id', user.id)
-      ctx.set_metadata('username', user.username)
+    return {
+      'username': snapshot['username'],
+      'is_admin': snapshot['is_admin'],
 
-      # await send_toast(ctx, 'info', 'Вы вошли в систему!', None, 3000)
+      'organization_count': snapshot['organization_count'],
+      'organization_limit': snapshot['organization_limit'],
 
-      return {
-        'username': user.username,
-        'is_admin': user.is_admin,
-
-        'organization_count': await OrganizationDAO.owned_count(sess, user.id),
-        'organization_limit': user.organization_limit,
-
-        'exp': payload['exp']
-      }
+      'exp': payload['exp']
+    }
 
   except ExpiredSignatureError:
     raise TokenExpiredError()
@@ -91,6 +89,30 @@ async def auth(ctx: ConnectionContext, token: str):
     raise ProtocolError(f"Invalid token: {str(e)}")
 
 
+async def _verify_token(token: str) -> tuple[dict, dict]:
+  """Проверяет токен и загружает снимок пользователя для кеша"""
+  payload = decode_jwt(token)
+  user_id = payload.get('user_id')
+
+  if not user_id:
+    raise ProtocolError("Invalid token: missing user_id")
+
+  async with database.get_db() as sess:
+    user = await UserDAO.get_user(sess, user_id)
+
+    if not user:
+      raise ProtocolError("User not found")
+
+    return payload, {
+      'user_id': user.id,
+      'username': user.username,
+      'is_admin': user.is_admin,
+      'account_limit': user.account_limit,
+      'organization_count': await OrganizationDAO.owned_count(sess, user.id),
+      'organization_limit': user.organization_limit,
+    }
+
+
 def create_tokens(user_id: int) -> dict:
   """Генерация новой пары токенов"""
   access_payload = {
@@ -115,13 +137,15 @@ def create_tokens(user_id: int) -> dict:
 async def login(username: str, password: str):
   async with database.get_db() as sess:
     user = (await sess.execute(
-      select(models.User).where(models.User.username == username)
-    )).scalar_one_or_none()
+      select(models.User.id, models.User.password).where(models.User.username == username)
+    )).one_or_none()
+    # Соединение возвращается в пул до очереди входов и bcrypt: всплеск входов не занимает пул БД
+    await sess.commit()
 
-    if not user or not check_password(password, user.password):
-      raise ProtocolError("Неверные данные")
+  if not user or not await passwords.check_login_password(password, user.password):
+    raise ProtocolError("Неверные данные")
 
-    return create_tokens(user.id)
+  return create_tokens(user.id)
 
 
 @route.on('auth/refresh')
@@ -146,17 +170,16 @@ async def refresh(ctx: ConnectionContext, refresh_token: str):
 @route.require_auth
 async def update_password(ctx: ConnectionContext, old_password: str, new_password: str):
   async with database.get_db() as sess:
-    user = (await sess.execute(
-      select(models.User).where(models.User.id == ctx.get_metadata('user_id'))
-    )).scalar_one_or_none()
+    user = await UserDAO.get_user(sess, ctx.get_metadata('user_id'))
 
     if not user:
       raise ProtocolError("Пользователь не найден")
 
-    if not check_password(old_password, user.password):
+    if not await passwords.check_password(old_password, user.password):
       raise ProtocolError("Неверный пароль")
 
     check_new_password(new_password)
 
-    user.password = get_hashed_password(new_password)
+    user.password = await passwords.hash_password(new_password)
+    events.user_changed_on_commit(sess, user.id)
     await sess.commit()
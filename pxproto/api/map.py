@@ -1,5 +1,4 @@
 import asyncio
-import base64
 import os
 import time
 from pathlib import Path
@@ -57,5 +56,6 @@ async def map_chunk(ctx: ConnectionContext, x: int, y: int):
     async with aiofiles.open(chunk_path, "rb") as f:
       data = await f.read()
 
-  ctx.set_metadata('ttl', TTL_SECONDS / 2)
-  return base64.b64encode(data).decode('ascii')
+  ctx.set_response_ttl(TTL_SECONDS / 2)
+  # В JSON bytes уходят base64-строкой, в pxws.msgpack - как есть
+  return data
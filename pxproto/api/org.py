@@ -5,11 +5,13 @@ from pydantic import Field
 from sqlalchemy.ext.asyncio import AsyncSession
 
 import database
+import events
 import proto_models
 from dao import UserDAO
 from dao.org import OrganizationDAO
 from dao.push_service import PushService
 from models import Organization, OrganizationRole
+from principal import get_principal
 from pxws.connection_ctx import ConnectionContext
 from pxws.error_with_data import ProtocolError
 from pxws.route import Route
@@ -56,13 +58,15 @@ class CreateOrgRequest(proto_models.BaseModel):
 @database.connection
 async def org_create(ctx: ConnectionContext, session: AsyncSession, req: CreateOrgRequest):
   user_id = ctx.get_metadata("user_id")
-  user = await UserDAO.get_user(session, user_id)
+  user = await get_principal(session, ctx)
   owned_org_count = await OrganizationDAO.owned_count(session, user_id)
 
   if owned_org_count >= user.organization_limit:
     raise ProtocolError('Вы создали максимальное количество организаций')
 
   org = await OrganizationDAO.create(session, user_id, req.name)
+  # organization_count в кеше токенов
+  events.user_changed_on_commit(session, user_id)
   await session.commit()
 
   return (await org.to_dict()) | {'access_role': 'owner'}
@@ -122,14 +126,15 @@ async def org_kick(
   await OrganizationDAO.kick(session, org_id, target_id)
   await session.commit()
 
+  # Задача переживет запрос, поэтому все нужное из БД берем сейчас, в сессии запроса
+  org_name = await OrganizationDAO.get_org_field(session, org_id, 'name')
+
   async def notify_user():
-    async with database.get_db() as notify_session:
-      org_name = await OrganizationDAO.get_org_field(notify_session, org_id, 'name')
-      await PushService.send_to_user(
-        notify_session, target_id,
-        'Вас кикнули',
-        f'{ctx.get_metadata("username")} кикнул(а) вас из организации "{org_name}"'
-      )
+    await PushService.send_to_user(
+      target_id,
+      'Вас кикнули',
+      f'{ctx.get_metadata("username")} кикнул(а) вас из организации "{org_name}"'
+    )
 
   asyncio.create_task(notify_user())
 
@@ -188,9 +193,10 @@ async def org_add_user(
     raise ProtocolError('Вы не можете добавить себя')
   await assert_role_at_least(session, org_id, ctx.get_metadata('user_id'), OrganizationRole.ADMIN)
 
-  is_admin = not await UserDAO.is_admin(session, ctx.get_metadata('user_id'))
+  is_admin = not (await get_principal(session, ctx)).is_admin
   count, limit = await OrganizationDAO.member_count_and_limit(session, org_id)
 
+  target_ids = []
   for username in usernames:
     if count >= limit and not is_admin:
       raise ProtocolError('Превышен лимит пользователей')
@@ -204,15 +210,14 @@ async def org_add_user(
       raise ProtocolError('Пользователь уже в организации')
 
     await OrganizationDAO.add_user(session, org_id, target_id)
+    target_ids.append(target_id)
   await session.commit()
 
-  async def notify_user():
-    async with database.get_db() as notify_session:
-      org_name = await OrganizationDAO.get_org_field(notify_session, org_id, 'name')
-      await PushService.send_to_user(
-        notify_session, target_id,
-        'Вас добавили в организацию',
-        f'{ctx.get_metadata("username")} добавил(а) вас в организацию "{org_name}"'
-      )
+  # Задача переживет запрос, поэтому все нужное из БД берем сейчас, в сессии запроса
+  org_name = await OrganizationDAO.get_org_field(session, org_id, 'name')
 
-  asyncio.create_task(notify_user())
+  async def notify_users():
+    body = f'{ctx.get_metadata("username")} добавил(а) вас в организацию "{org_name}"'
+    await PushService.send_many([(target_id, 'Вас добавили в организацию', body) for target_id in target_ids])
+
+  asyncio.create_task(notify_users())
@@ -3,8 +3,10 @@ import os
 from sqlalchemy.ext.asyncio import AsyncSession
 
 import database
+import push_delivery
 from dao.push_service import PushService
 from pxws.connection_ctx import ConnectionContext
+from pxws.error_with_data import ProtocolError
 from pxws.route import Route
 
 PRIVATE = os.getenv("VAPID_PRIVATE_KEY")
@@ -21,12 +23,19 @@ def get_key():
 @route.on('push/subscribe', require_auth=True, ignore_params=['session'])
 @database.connection
 async def subscribe(ctx: ConnectionContext, endpoint: str, keys: any, *, session: AsyncSession):
+  # Недействительные ключи сломали бы шифрование каждого уведомления пользователю
+  try:
+    p256dh, auth = keys['p256dh'], keys['auth']
+    push_delivery.validate_subscription(endpoint, p256dh, auth)
+  except (TypeError, KeyError, ValueError):
+    raise ProtocolError('Недействительная подписка')
+
   sub = await PushService.subscribe(
     session,
     ctx.get_metadata('user_id'),
     endpoint,
-    keys['p256dh'],
-    keys['auth']
+    p256dh,
+    auth
   )
   return sub.id
 
@@ -0,0 +1,179 @@
+"""
+Подписки соединений на изменения счетов и организаций.
+
+Доступ проверяется при подписке и перепроверяется, когда он мог пропасть: по событиям
+org_roles_changed (кик, смена роли) и user_changed (снятие прав администратора).
+Подписки без доступа снимаются, клиент получает subscription/revoked.
+"""
+import asyncio
+from typing import Iterable, Optional
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from websockets import ConnectionClosed
+
+import database
+import events
+import models
+from api.accounts import can_access_account, get_current_user
+from dao import AccountDAO
+from dao.org import OrganizationDAO
+from logger import logger
+from principal import Principal
+from pxws.connection_ctx import ConnectionContext
+from pxws.error_with_data import ProtocolError
+from pxws.route import Route
+
+route = Route()
+
+MAX_SUBSCRIPTIONS = 64
+
+_recheck_tasks: set[asyncio.Task] = set()
+
+
+async def _accessible_account(session: AsyncSession, user: Principal, account_id: int) -> Optional[models.Account]:
+  account = await AccountDAO.get_account(session, account_id, for_update=False)
+  if not account or not await can_access_account(session, user, account):
+    return None
+  return account
+
+
+async def _can_access_org(session: AsyncSession, user: Principal, org_id: int) -> bool:
+  return user.is_admin or await OrganizationDAO.get_role_or_none(session, org_id, user.id) is not None
+
+
+async def _has_access(session: AsyncSession, user: Principal, topic: str) -> bool:
+  kind, _, target_id = topic.partition(':')
+  if kind == 'account':
+    return await _accessible_account(session, user, int(target_id)) is not None
+  if kind == 'org':
+    return await _can_access_org(session, user, int(target_id))
+  return True
+
+
+async def revoke_lost(connections: Iterable[ConnectionContext], topics: Optional[set[str]] = None):
+  """
+  Перепроверяет подписки соединений (только topics, если указаны) и снимает те, к которым нет доступа.
+  Сессия своя: проверка идет после коммита изменения прав и должна видеть его.
+  """
+  async with database.get_db() as session:
+    for ctx in connections:
+      # Соединение могло закрыться, пока шла проверка предыдущих
+      checked = [topic for topic in ctx.topics if topics is None or topic in topics]
+      if not checked:
+        continue
+
+      user = await get_current_user(session, ctx)
+      for topic in checked:
+        if await _has_access(session, user, topic):
+          continue
+
+        ctx.server.unsubscribe(ctx, topic)
+        try:
+          await ctx.send({'type': 'subscription/revoked', 'data': {'topic': topic}})
+        except ConnectionClosed:
+          pass
+
+
+async def _recheck_org(org_id: int):
+  """Подписки на организацию и ее счета"""
+  server = events.server()
+  async with database.get_db() as session:
+    result = await session.execute(select(models.Account.id).where(models.Account.organization_id == org_id))
+    topics = {events.org_topic(org_id)} | {events.account_topic(account_id) for account_id in result.scalars()}
+
+  connections = {ctx for topic in topics for ctx in server.subscribers(topic)}
+  if connections:
+    await revoke_lost(connections, topics)
+
+
+def _spawn_recheck(coro):
+  async def recheck():
+    try:
+      await coro
+    except Exception as e:
+      logger.error(f"Subscription recheck failed: {e}", exc_info=e)
+
+  task = asyncio.create_task(recheck())
+  _recheck_tasks.add(task)
+  task.add_done_callback(_recheck_tasks.discard)
+
+
+def _on_org_roles_changed(message: dict) -> None:
+  """Участника кикнули или сменили ему роль"""
+  if events.server() is not None:
+    _spawn_recheck(_recheck_org(message['org']))
+
+
+def _on_user_changed(message: dict) -> None:
+  """Права пользователя могли измениться (например, снят админ): перепроверяются все его подписки"""
+  user_id = message['user']
+  if not isinstance(user_id, int) or events.server() is None:
+    return
+
+  connections = events.server().connections_of(user_id)
+  if connections:
+    _spawn_recheck(revoke_lost(connections))
+
+
+def _on_bus_reconnected(message: dict) -> None:
+  """События за время разрыва шины потеряны: перепроверяются все подписки"""
+  if events.server() is None:
+    return
+
+  connections = [ctx for ctx in events.server().connections_it() if ctx.topics]
+  if connections:
+    _spawn_recheck(revoke_lost(connections))
+
+
+events.listen('org_roles_changed', _on_org_roles_changed)
+events.listen('user_changed', _on_user_changed)
+events.listen('bus_reconnected', _on_bus_reconnected)
+
+
+def _check_subscription_limit(ctx: ConnectionContext):
+  if len(ctx.topics) >= MAX_SUBSCRIPTIONS:
+    raise ProtocolError('Слишком много подписок')
+
+
+@route.on('subscribe/account', require_auth=True, ignore_params=['session'])
+@database.connection
+async def subscribe_account(session: AsyncSession, ctx: ConnectionContext, account_id: int):
+  """
+  Подписка на изменения счёта. После каждого перевода приходит сообщение account/transaction.
+  Возвращает текущее состояние счёта, к которому клиент применяет дельты.
+  """
+  user = await get_current_user(session, ctx)
+  account = await _accessible_account(session, user, account_id)
+
+  if not account:
+    raise ProtocolError('Доступ к счёту запрещён')
+
+  _check_subscription_limit(ctx)
+  ctx.server.subscribe(ctx, events.account_topic(account.id))
+
+  await AccountDAO.load_shard_balances(session, [account])
+  return account.to_dict()
+
+
+@route.on('subscribe/org', require_auth=True, ignore_params=['session'])
+@database.connection
+async def subscribe_org(session: AsyncSession, ctx: ConnectionContext, org_id: int):
+  """Подписка на изменения всех счетов организации"""
+  user = await get_current_user(session, ctx)
+
+  if not await _can_access_org(session, user, org_id):
+    raise ProtocolError('Нет прав')
+
+  _check_subscription_limit(ctx)
+  ctx.server.subscribe(ctx, events.org_topic(org_id))
+
+
+@route.on('unsubscribe/account', require_auth=True)
+async def unsubscribe_account(ctx: ConnectionContext, account_id: int):
+  ctx.server.unsubscribe(ctx, events.account_topic(account_id))
+
+
+@route.on('unsubscribe/org', require_auth=True)
+async def unsubscribe_org(ctx: ConnectionContext, org_id: int):
+  ctx.server.unsubscribe(ctx, events.org_topic(org_id))
@@ -1,14 +1,21 @@
-from typing import Any, Tuple
-
-from sqlalchemy import select, func, Select
+import base64
+import csv
+import functools
+import io
+from datetime import datetime, time, timedelta
+from typing import Any, Callable, Optional
+
+from sqlalchemy import Select
 from sqlalchemy.ext.asyncio import AsyncSession
 
 import database
-from api.accounts import can_access_account
+from api.accounts import accounts_access
 from dao import UserDAO
 from dao.org import OrganizationDAO
 from dao.transaction import TransactionDAO
 from models import Transaction, User
+from principal import Principal, get_principal
+from proto_models import ExportTransactionsModel
 from pxws.connection_ctx import ConnectionContext
 from pxws.error_with_data import ProtocolError
 from pxws.route import Route
@@ -16,27 +23,34 @@ from pxws.route import Route
 route = Route()
 
 
-async def prepare_transaction_response(
-    session: AsyncSession,
-    stmt: Select[tuple[Transaction, Any, Any, Any, Any]],
-    page: int,
-    current_user: User
-) -> Tuple[list, int, int, int]:
-  # Пагинация
-  per_page = 10
-  offset = (page - 1) * per_page
-
-  count_stmt = select(func.count()).select_from(stmt.subquery())
-  total = (await session.execute(count_stmt)).scalar_one()
-  total_pages = (total + per_page - 1) // per_page
-
-  result = await session.execute(stmt.limit(per_page).offset(offset))
-  rows = result.all()
+PER_PAGE = 10
+
+
+def encode_cursor(tx: Transaction) -> str:
+  """Курсор на позицию после транзакции: непрозрачная строка для клиента"""
+  raw = f'{tx.created_at.isoformat()}|{tx.id}'
+  return base64.urlsafe_b64encode(raw.encode('ascii')).decode('ascii')
+
+
+def decode_cursor(cursor: str) -> tuple[datetime, int]:
+  try:
+    created_at, tx_id = base64.urlsafe_b64decode(cursor.encode('ascii')).decode('ascii').split('|')
+    return datetime.fromisoformat(created_at), int(tx_id)
+  except (ValueError, UnicodeError):
+    raise ProtocolError('Неверный курсор')
+
+
+async def transactions_to_dicts(session: AsyncSession, rows, current_user: Principal) -> list[dict]:
+  """Строки TransactionDAO.get_*_transactions_stmt в ответ. Номера чужих счетов скрываются"""
+  access = await accounts_access(
+    session, current_user,
+    (account for _, sender_acc, recipient_acc, _, _ in rows for account in (sender_acc, recipient_acc))
+  )
 
   transactions = []
   for tx, sender_acc, recipient_acc, sender_name, recipient_name in rows:
-    from_access = await can_access_account(session, current_user, sender_acc)
-    to_access = await can_access_account(session, current_user, recipient_acc)
+    from_access = access[sender_acc.id]
+    to_access = access[recipient_acc.id]
 
     transactions.append(
       tx.to_dict(
@@ -49,44 +63,85 @@ async def prepare_transaction_response(
         to_account_number=recipient_acc.account_number if to_access else None,
       )
     )
-  return transactions, total_pages, total, per_page
+  return transactions
 
 
-@route.on('transactions/fetch/user', require_auth=True, ignore_params=['session'])
-@database.connection
-async def fetch_transactions(
+async def prepare_transaction_response(
     session: AsyncSession,
-    ctx: ConnectionContext,
-    username: str,
-    page: int = 1
-):
-  current_user_id = ctx.get_metadata('user_id')
-  current_user = await UserDAO.get_user(session, current_user_id)
-  is_admin = current_user.is_admin
+    build_stmt: Callable[..., Select[tuple[Transaction, Any, Any, Any, Any]]],
+    current_user: Principal,
+    total: Optional[int],
+    page: int = 1,
+    cursor: Optional[str] = None
+) -> dict:
+  """
+  Страница истории транзакций.
+
+  С cursor страница выбирается по (created_at, id) после курсора, иначе по номеру page (OFFSET).
+  total берется из счетчика транзакций, без COUNT(*) по всей выборке.
+
+  :param build_stmt: TransactionDAO.get_*_transactions_stmt с уже переданным владельцем
+  """
+  # Лишняя строка показывает, есть ли следующая страница
+  if cursor is not None:
+    stmt = build_stmt(PER_PAGE + 1, after=decode_cursor(cursor))
+  else:
+    stmt = build_stmt(PER_PAGE + 1, offset=(page - 1) * PER_PAGE)
+
+  result = await session.execute(stmt)
+  rows = result.all()
+  has_next = len(rows) > PER_PAGE
+  rows = rows[:PER_PAGE]
+
+  return {
+    'transactions': await transactions_to_dicts(session, rows, current_user),
+    'total_pages': (total + PER_PAGE - 1) // PER_PAGE if total is not None else None,
+    'total': total,
+    'per_page': PER_PAGE,
+    'next_cursor': encode_cursor(rows[-1][0]) if has_next else None,
+  }
 
+
+async def get_history_user(session: AsyncSession, current_user: Principal, username: str) -> User:
+  """Пользователь, чью историю запрашивают. Чужую историю видит только админ"""
   # Получаем целевого пользователя
   target_user = await UserDAO.get_user(session, username)
   if not target_user:
     raise ProtocolError('Пользователь не найден')
 
   # Проверка прав доступа
-  if target_user.id != current_user_id and not is_admin:
+  if target_user.id != current_user.id and not current_user.is_admin:
     raise ProtocolError('Доступ к транзакциям других пользователей запрещён')
+  return target_user
+
+
+async def check_org_history_access(session: AsyncSession, current_user: Principal, org_id: int):
+  role = await OrganizationDAO.get_role_or_none(session, org_id, current_user.id)
+
+  # Проверка прав доступа
+  if not (role or current_user.is_admin):
+    raise ProtocolError('Доступ к транзакциям других организаций запрещён')
+
+
+@route.on('transactions/fetch/user', require_auth=True, ignore_params=['session'])
+@database.connection
+async def fetch_transactions(
+    session: AsyncSession,
+    ctx: ConnectionContext,
+    username: str,
+    page: int = 1,
+    cursor: Optional[str] = None,
+    with_total: bool = True
+):
+  current_user = await get_principal(session, ctx)
+  target_user = await get_history_user(session, current_user, username)
 
   # Строим запрос
-  stmt = TransactionDAO.get_user_transactions_stmt(target_user.id)
+  build_stmt = functools.partial(TransactionDAO.get_user_transactions_stmt, target_user.id)
+  total = await TransactionDAO.get_user_transaction_count(session, target_user.id) if with_total else None
 
   # Получаем данные с пагинацией и проверкой доступа к аккаунтам
-  transactions, total_pages, total, per_page = await prepare_transaction_response(
-    session, stmt, page, current_user
-  )
-
-  return {
-    'transactions': transactions,
-    'total_pages': total_pages,
-    'total': total,
-    'per_page': per_page,
-  }
+  return await prepare_transaction_response(session, build_stmt, current_user, total, page, cursor)
 
 
 @route.on('transactions/fetch/org', require_auth=True, ignore_params=['session'])
@@ -95,28 +150,90 @@ async def fetch_org_transactions(
     session: AsyncSession,
     ctx: ConnectionContext,
     org_id: int,
-    page: int = 1
+    page: int = 1,
+    cursor: Optional[str] = None,
+    with_total: bool = True
 ):
-  current_user_id = ctx.get_metadata('user_id')
-  current_user = await UserDAO.get_user(session, current_user_id)
-  is_admin = current_user.is_admin
-  role = await OrganizationDAO.get_role_or_none(session, org_id, current_user_id)
-
-  # Проверка прав доступа
-  if not (role or is_admin):
-    raise ProtocolError('Доступ к транзакциям других организаций запрещён')
+  current_user = await get_principal(session, ctx)
+  await check_org_history_access(session, current_user, org_id)
 
   # Строим запрос
-  stmt = TransactionDAO.get_org_transactions_stmt(org_id)
+  build_stmt = functools.partial(TransactionDAO.get_org_transactions_stmt, org_id)
+  total = await TransactionDAO.get_org_transaction_count(session, org_id) if with_total else None
 
   # Получаем данные с пагинацией и проверкой доступа к аккаунтам
-  transactions, total_pages, total, per_page = await prepare_transaction_response(
-    session, stmt, page, current_user
+  return await prepare_transaction_response(session, build_stmt, current_user, total, page, cursor)
+
+
+# Транзакций в одной части выгрузки (и в одной порции серверного курсора)
+EXPORT_CHUNK_SIZE = 500
+EXPORT_MAX_DAYS = 366
+EXPORT_CSV_FIELDS = ('id', 'timestamp', 'amount', 'currency_id', 'sender_name', 'from_account_number',
+                     'receiver_name', 'to_account_number', 'comment')
+
+
+def _csv_chunk(transactions: list[dict], header: bool) -> str:
+  buffer = io.StringIO()
+  writer = csv.DictWriter(buffer, EXPORT_CSV_FIELDS, extrasaction='ignore')
+  if header:
+    writer.writeheader()
+  for tx in transactions:
+    writer.writerow(tx | {'timestamp': datetime.fromtimestamp(tx['timestamp']).isoformat()})
+  return buffer.getvalue()
+
+
+@route.on('transactions/export', require_auth=True, ignore_params=['session'])
+@database.connection
+async def export_transactions(session: AsyncSession, ctx: ConnectionContext, req: ExportTransactionsModel):
+  """
+  Выписка пользователя (username) или организации (org_id) за период.
+
+  Транзакции читаются серверным курсором порциями по EXPORT_CHUNK_SIZE и уходят частями ответа
+  (status: partial, data: {seq, rows} или {seq, csv}). В памяти одновременно не больше одной порции.
+  Итоговый ответ - количество транзакций и частей.
+  """
+  current_user = await get_principal(session, ctx)
+
+  if (req.username is None) == (req.org_id is None):
+    raise ProtocolError('Укажите username или org_id')
+
+  if req.username is not None:
+    target_user = await get_history_user(session, current_user, req.username)
+    build_stmt = functools.partial(TransactionDAO.get_user_transactions_stmt, target_user.id)
+  else:
+    await check_org_history_access(session, current_user, req.org_id)
+    build_stmt = functools.partial(TransactionDAO.get_org_transactions_stmt, req.org_id)
+
+  date_to = req.date_to or datetime.utcnow().date()
+  date_from = req.date_from or date_to - timedelta(days=EXPORT_MAX_DAYS - 1)
+  if date_from > date_to:
+    raise ProtocolError('Неверный период')
+  if (date_to - date_from).days >= EXPORT_MAX_DAYS:
+    raise ProtocolError('Слишком большой период')
+
+  # after=(конец периода, 0) - все транзакции строго раньше следующего дня
+  stmt = build_stmt(
+    None,
+    after=(datetime.combine(date_to + timedelta(days=1), time.min), 0),
+    since=datetime.combine(date_from, time.min)
   )
 
-  return {
-    'transactions': transactions,
-    'total_pages': total_pages,
-    'total': total,
-    'per_page': per_page,
-  }
+  rows_sent = 0
+  seq = 0
+  # Серверный курсор занимает соединение до конца чтения, поэтому у него своя сессия,
+  # а проверки доступа к счетам идут через сессию запроса
+  async with database.SessionLocal() as stream_session:
+    result = await stream_session.stream(stmt.execution_options(yield_per=EXPORT_CHUNK_SIZE))
+    async for rows in result.partitions():
+      transactions = await transactions_to_dicts(session, rows, current_user)
+
+      if req.format == 'csv':
+        chunk = {'seq': seq, 'csv': _csv_chunk(transactions, header=seq == 0)}
+      else:
+        chunk = {'seq': seq, 'rows': transactions}
+      await ctx.send_partial(chunk)
+
+      rows_sent += len(transactions)
+      seq += 1
+
+  return {'rows': rows_sent, 'chunks': seq}
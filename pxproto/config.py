@@ -1 +1,8 @@
-TRANSACTION_COMMENT_MAX_LENGTH = 256
\ No newline at end of file
+TRANSACTION_COMMENT_MAX_LENGTH = 256
+# Переводов в одном accounts/transfer/batch
+TRANSFER_BATCH_MAX_ITEMS = 100
+
+IDEMPOTENCY_KEY_MAX_LENGTH = 64
+
+# Максимум шардов баланса одного счета (admin/accounts/balance_shards)
+ACCOUNT_MAX_BALANCE_SHARDS = 64
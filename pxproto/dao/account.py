@@ -1,15 +1,17 @@
 # dao/account.py
 
+import decimal
+import itertools
 import random
-from typing import Optional, Literal
+from typing import Iterable, Optional, Literal
 
-from sqlalchemy import select, exists
+from sqlalchemy import select, exists, func, tuple_, update
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import joinedload
 
 import models
 from database import ensure_loaded
-from models import Account, Organization
+from models import Account, AccountBalanceShard, Organization, User
 from pxws.error_with_data import ProtocolError
 from .dao import BaseDAO
 from .org import OrganizationDAO
@@ -80,6 +82,174 @@ class AccountDAO(BaseDAO[Account]):
     result = await session.execute(stmt)
     return result.scalar_one_or_none()
 
+  @classmethod
+  async def resolve_numbers(cls, session: AsyncSession, account_numbers: Iterable[str]) -> dict[str, tuple[int, int]]:
+    """
+    Номер -> (id, balance_shards) одним запросом, без блокировки. Ненайденные номера отсутствуют.
+    По balance_shards получатель решает, как блокировать строку счета (см. lock_accounts).
+    """
+    stmt = (
+      select(cls.model.account_number, cls.model.id, cls.model.balance_shards)
+      .where(cls.model.account_number.in_(set(account_numbers)), cls.model.is_deleted == False)
+    )
+    result = await session.execute(stmt)
+    return {number: (account_id, shards) for number, account_id, shards in result.tuples()}
+
+  @classmethod
+  async def get_balance_shards(cls, session: AsyncSession, account_ids: Iterable[int]) -> dict[int, int]:
+    """id -> balance_shards одним запросом, без блокировки (как resolve_numbers, но по id)"""
+    stmt = (
+      select(cls.model.id, cls.model.balance_shards)
+      .where(cls.model.id.in_(set(account_ids)), cls.model.is_deleted == False)
+    )
+    result = await session.execute(stmt)
+    return dict(result.tuples().all())
+
+  @classmethod
+  async def lock_accounts(
+      cls,
+      session: AsyncSession,
+      *account_ids: Optional[int],
+      shared: Iterable[int] = (),
+      get_user: bool = False,
+      get_org: bool = False
+  ) -> dict[int, Account]:
+    """
+    Блокирует строки счетов в порядке возрастания id: FOR UPDATE, а счета shared - LOCK IN SHARE MODE.
+    Подряд идущие счета с одним видом блокировки блокируются одним запросом.
+
+    Все переводы блокируют строки account в одном порядке и раньше строк шардов (lock_shards, consolidate),
+    поэтому встречные переводы ждут друг друга, а не взаимно блокируются. Общая блокировка получателя
+    с шардами не мешает параллельным зачислениям, но списание и consolidate (FOR UPDATE счета,
+    затем шарды) ждут их завершения - как и проверки внешних ключей на счет при вставке транзакции.
+    Блокируются только строки account, не присоединенные user и organization.
+
+    :param shared: получатели с шардами баланса: зачисление меняет строку шарда, а не счета
+    :returns: id -> счет (удаленные и несуществующие счета отсутствуют)
+    """
+    shared = set(shared)
+
+    def accounts_stmt(ids: set[int]):
+      stmt = select(cls.model).where(cls.model.id.in_(ids), cls.model.is_deleted == False)
+      if get_user:
+        stmt = stmt.options(joinedload(cls.model.user, innerjoin=False))
+      if get_org:
+        stmt = stmt.options(joinedload(cls.model.organization, innerjoin=False))
+      return stmt
+
+    accounts = {}
+    ids = sorted({account_id for account_id in account_ids if account_id is not None} | shared)
+    for is_shared, run in itertools.groupby(ids, key=shared.__contains__):
+      run = list(run)
+      if is_shared:
+        # Без JOIN: LOCK IN SHARE MODE не ограничивается таблицей (OF) и заблокировал бы user и organization
+        await session.execute(
+          select(cls.model.id).where(cls.model.id.in_(run)).order_by(cls.model.id).with_for_update(read=True)
+        )
+      else:
+        result = await session.execute(
+          accounts_stmt(set(run)).order_by(cls.model.id).with_for_update(of=cls.model)
+        )
+        accounts.update((account.id, account) for account in result.scalars().all())
+
+    if shared:
+      # Строки уже заблокированы, данные читаются обычным запросом
+      result = await session.execute(accounts_stmt(shared))
+      accounts.update((account.id, account) for account in result.scalars().all())
+    return accounts
+
+  @classmethod
+  async def get_sharded_ids(cls, session: AsyncSession) -> list[int]:
+    result = await session.execute(select(cls.model.id).where(cls.model.balance_shards > 0))
+    return list(result.scalars().all())
+
+  @classmethod
+  async def load_shard_balances(cls, session: AsyncSession, accounts: Iterable[Account]):
+    """Заполняет account.shard_balance (для total_balance и to_dict). Запрос только при наличии шардов"""
+    sharded = {account.id: account for account in accounts if account.balance_shards}
+    if not sharded:
+      return
+
+    result = await session.execute(
+      select(AccountBalanceShard.account_id, func.sum(AccountBalanceShard.balance))
+      .where(AccountBalanceShard.account_id.in_(sharded))
+      .group_by(AccountBalanceShard.account_id)
+    )
+    for account_id, balance in result.tuples():
+      sharded[account_id].shard_balance = balance
+
+  @classmethod
+  async def lock_shards(cls, session: AsyncSession, accounts: list[Account]) -> list[Optional[AccountBalanceShard]]:
+    """
+    Случайный шард баланса для зачисления на каждый из accounts (счета с balance_shards > 0).
+    Шарды блокируются одним запросом в порядке (account_id, shard). Строки счетов к этому моменту
+    уже заблокированы lock_accounts (хотя бы общей блокировкой) - тот же порядок, что и в consolidate.
+
+    :returns: шард для каждого счета по порядку. None - шарды счета выключены после чтения balance_shards
+    """
+    keys = [(account.id, random.randint(1, account.balance_shards)) for account in accounts]
+
+    result = await session.execute(
+      select(AccountBalanceShard)
+      .where(tuple_(AccountBalanceShard.account_id, AccountBalanceShard.shard).in_(set(keys)))
+      .order_by(AccountBalanceShard.account_id, AccountBalanceShard.shard)
+      .with_for_update()
+    )
+    shards = {(shard.account_id, shard.shard): shard for shard in result.scalars().all()}
+    return [shards.get(key) for key in keys]
+
+  @classmethod
+  async def consolidate(cls, session: AsyncSession, account: Account) -> list[AccountBalanceShard]:
+    """
+    Переносит шарды баланса в account.balance. Строка счета должна быть заблокирована.
+
+    :returns: обнуленные шарды
+    """
+    result = await session.execute(
+      select(AccountBalanceShard)
+      .where(AccountBalanceShard.account_id == account.id)
+      .order_by(AccountBalanceShard.shard)
+      .with_for_update()
+    )
+    shards = list(result.scalars().all())
+    for shard in shards:
+      account.balance += shard.balance
+      shard.balance = 0
+    account.shard_balance = decimal.Decimal(0)
+    return shards
+
+  @classmethod
+  async def set_balance_shards(cls, session: AsyncSession, account: Account, count: int) -> list[AccountBalanceShard]:
+    """
+    Включает (count > 0), меняет или выключает (0) шарды баланса. Строка счета должна быть заблокирована.
+    Баланс шардов переносится в account.balance, счетчики транзакций удаляемых шардов - владельцу счета.
+
+    :returns: обнуленные шарды (для account_daily_stats)
+    """
+    shards = await cls.consolidate(session, account)
+
+    removed = [shard for shard in shards if shard.shard > count]
+    removed_count = sum(shard.transaction_count for shard in removed)
+    if removed_count:
+      owner = User if account.user_id is not None else Organization
+      owner_id = account.user_id if account.user_id is not None else account.organization_id
+      await session.execute(
+        update(owner)
+        .where(owner.id == owner_id)
+        .values(transaction_count=owner.transaction_count + removed_count)
+        .execution_options(synchronize_session=False)
+      )
+    for shard in removed:
+      await session.delete(shard)
+
+    existing = {shard.shard for shard in shards}
+    session.add_all(
+      AccountBalanceShard(account_id=account.id, shard=number)
+      for number in range(1, count + 1) if number not in existing
+    )
+    account.balance_shards = count
+    return shards
+
   @classmethod
   async def can_user_access(cls, session: AsyncSession, user: models.User, account: Account):
     if user.id == account.user_id:
@@ -0,0 +1,53 @@
+from datetime import datetime
+from typing import Optional
+
+from sqlalchemy import delete, select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from models import IdempotencyKey
+from .dao import BaseDAO
+
+
+class IdempotencyDAO(BaseDAO[IdempotencyKey]):
+  model = IdempotencyKey
+
+  @classmethod
+  async def get_response(cls, session: AsyncSession, user_id: int, key: str) -> Optional[dict]:
+    stmt = select(cls.model.response).where(cls.model.user_id == user_id, cls.model.key == key)
+    result = await session.execute(stmt)
+    return result.scalar_one_or_none()
+
+  @classmethod
+  async def claim(cls, session: AsyncSession, user_id: int, key: str) -> tuple[Optional[IdempotencyKey], Optional[dict]]:
+    """
+    Занимает ключ в текущей транзакции БД, до блокировки счетов.
+    Параллельный запрос с тем же ключом ждет на уникальном индексе, пока эта транзакция не завершится.
+
+    :returns: (запись, None), если ключ свободен - ответ записывается в нее перед коммитом;
+      (None, ответ), если запрос с этим ключом уже выполнен
+    """
+    response = await cls.get_response(session, user_id, key)
+    if response is not None:
+      return None, response
+
+    entry = cls.model(user_id=user_id, key=key)
+    session.add(entry)
+    try:
+      await session.flush()
+    except IntegrityError:
+      # Запрос с этим ключом закоммитился между проверкой и вставкой
+      await session.rollback()
+      return None, await cls.get_response(session, user_id, key)
+    return entry, None
+
+  @classmethod
+  async def purge(cls, session: AsyncSession, before: datetime, batch: int) -> int:
+    """Удаляет до batch ключей, созданных раньше before. :returns: количество удаленных"""
+    # MySQL не разрешает LIMIT в подзапросе IN, поэтому id читаются отдельно
+    result = await session.execute(select(cls.model.id).where(cls.model.created_at < before).limit(batch))
+    ids = result.scalars().all()
+    if not ids:
+      return 0
+    await session.execute(delete(cls.model).where(cls.model.id.in_(ids)))
+    return len(ids)
@@ -0,0 +1,120 @@
+from datetime import datetime
+from typing import Optional
+
+from sqlalchemy import and_, case, exists, func, insert, literal, or_, select, union_all
+from sqlalchemy.dialects import mysql
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from models import Account, LedgerEntry, LedgerOwner, Transaction
+from .dao import BaseDAO
+
+
+def owner_of(account: Account) -> tuple[LedgerOwner, int]:
+  if account.user_id is not None:
+    return LedgerOwner.USER, account.user_id
+  return LedgerOwner.ORG, account.organization_id
+
+
+class LedgerDAO(BaseDAO[LedgerEntry]):
+  model = LedgerEntry
+
+  @classmethod
+  def _rows(cls, transaction: Transaction, from_account: Account, to_account: Account) -> list[dict]:
+    rows = []
+    for account, amount in ((from_account, -transaction.amount), (to_account, transaction.amount)):
+      owner_type, owner_id = owner_of(account)
+      rows.append({
+        'owner_type': owner_type,
+        'owner_id': owner_id,
+        'account_id': account.id,
+        'transaction_id': transaction.id,
+        'amount': amount,
+        'created_at': transaction.created_at,
+      })
+    return rows
+
+  @classmethod
+  def record(cls, session: AsyncSession, transaction: Transaction, from_account: Account, to_account: Account):
+    """Записи обеих сторон транзакции. Вызывается после flush, когда у транзакции есть id и created_at"""
+    for row in cls._rows(transaction, from_account, to_account):
+      session.add(cls.model(**row))
+
+  @classmethod
+  async def record_many(cls, session: AsyncSession, transfers: list[tuple[Transaction, Account, Account]]):
+    """То же, что record, для пачки транзакций: один INSERT без чтения id записей"""
+    rows = [row for transfer in transfers for row in cls._rows(*transfer)]
+    if rows:
+      await session.execute(insert(cls.model), rows)
+
+  @classmethod
+  def page_ids(cls, owner_type: LedgerOwner, owner_id: int, limit: Optional[int],
+               after: Optional[tuple[datetime, int]] = None, since: Optional[datetime] = None):
+    """
+    ID транзакций владельца в порядке (created_at desc, id desc): один диапазон индекса (owner, created_at).
+    Перевод между счетами одного владельца дает две записи, DISTINCT оставляет одну.
+    """
+    stmt = (
+      select(cls.model.transaction_id.label('id'), cls.model.created_at)
+      .where(cls.model.owner_type == owner_type, cls.model.owner_id == owner_id)
+      .distinct()
+    )
+    if since is not None:
+      stmt = stmt.where(cls.model.created_at >= since)
+    if after is not None:
+      created_at, tx_id = after
+      stmt = stmt.where(
+        or_(
+          cls.model.created_at < created_at,
+          and_(cls.model.created_at == created_at, cls.model.transaction_id < tx_id),
+        )
+      )
+    return stmt.order_by(cls.model.created_at.desc(), cls.model.transaction_id.desc()).limit(limit)
+
+  @classmethod
+  async def max_transaction_id(cls, session: AsyncSession) -> int:
+    result = await session.execute(select(func.max(Transaction.id)))
+    return result.scalar_one() or 0
+
+  @classmethod
+  async def backfill_range(cls, session: AsyncSession, after_id: int, upto_id: int) -> int:
+    """
+    Заполняет записи для транзакций с id в (after_id, upto_id], у которых их еще нет.
+    Выполняется одним INSERT ... SELECT на стороне БД, строки не загружаются в процесс.
+    Записи, добавленные параллельным запуском, пропускаются по uq_ledger_entry_transaction_account.
+
+    :returns: количество добавленных записей
+    """
+    owner_type_type = cls.model.owner_type.type
+
+    def side(account_column, amount):
+      return (
+        select(
+          case(
+            (Account.user_id.is_not(None), literal(LedgerOwner.USER, owner_type_type)),
+            else_=literal(LedgerOwner.ORG, owner_type_type)
+          ),
+          func.coalesce(Account.user_id, Account.organization_id),
+          Account.id,
+          Transaction.id,
+          amount,
+          Transaction.created_at,
+        )
+        .join(Account, Account.id == account_column)
+        .where(
+          Transaction.id > after_id,
+          Transaction.id <= upto_id,
+          ~exists().where(cls.model.transaction_id == Transaction.id),
+        )
+      )
+
+    stmt = mysql.insert(cls.model).from_select(
+      ['owner_type', 'owner_id', 'account_id', 'transaction_id', 'amount', 'created_at'],
+      union_all(
+        side(Transaction.sender_account_id, -Transaction.amount),
+        side(Transaction.recipient_account_id, Transaction.amount),
+      )
+    )
+    # Существующая запись не меняется
+    stmt = stmt.on_duplicate_key_update(transaction_id=cls.model.transaction_id)
+    result = await session.execute(stmt)
+    return result.rowcount
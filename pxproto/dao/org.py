@@ -1,13 +1,24 @@
-from typing import Coroutine
+from typing import Coroutine, Iterable, Optional
 
-from sqlalchemy import or_, select, func, delete, insert, update
+from sqlalchemy import and_, or_, select, func, delete, insert, update, event
 from sqlalchemy.dialects.mysql import insert
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy.orm import aliased, joinedload, selectinload
+from sqlalchemy.orm import aliased, joinedload, selectinload, Session
 
+import events
 from models import Transaction, Account, User, Organization, OrganizationMember, OrganizationRole
+from role_cache import role_cache, MISSING
 from .dao import BaseDAO
 
+_ROLES_KEY = 'org_roles'
+_EPOCH_KEY = 'role_cache_epoch'
+
+
+@event.listens_for(Session, 'after_begin')
+def _remember_role_cache_epoch(session: Session, transaction, connection):
+  # Срабатывает до первого запроса транзакции, т.е. до того, как MySQL зафиксирует ее снимок
+  session.info[_EPOCH_KEY] = role_cache.epoch()
+
 
 class OrganizationDAO(BaseDAO[Organization]):
   model = Organization
@@ -21,6 +32,7 @@ class OrganizationDAO(BaseDAO[Organization]):
 
     session.add(org)
     await session.flush()
+    cls._roles_changed(session, org.id)
     return org
 
   @classmethod
@@ -46,6 +58,20 @@ class OrganizationDAO(BaseDAO[Organization]):
     result = await session.execute(stmt)
     return result.scalar_one() + 1 # + owner
 
+  @classmethod
+  async def member_ids(cls, session: AsyncSession, org_id: int) -> set[int]:
+    """ID всех участников организации, включая владельца"""
+    stmt = (
+      select(cls.model.owner_id)
+      .where(cls.model.id == org_id)
+      .union_all(
+        select(OrganizationMember.user_id)
+        .where(OrganizationMember.organization_id == org_id)
+      )
+    )
+    result = await session.execute(stmt)
+    return set(result.scalars().all())
+
   @classmethod
   async def get_one(cls, session: AsyncSession, org_id: int, /, *, members: bool = False) -> Organization:
     stmt = select(cls.model).where(cls.model.id == org_id)
@@ -99,26 +125,69 @@ class OrganizationDAO(BaseDAO[Organization]):
     return owner_list + member_list
 
   @classmethod
-  async def get_role_or_none(cls, session: AsyncSession, org_id: int, user_id: int):
-    # Сначала проверим, является ли пользователь владельцем организации
-    owner_stmt = select(cls.model.owner_id).where(cls.model.id == org_id)
-    owner_result = await session.execute(owner_stmt)
-    owner_id = owner_result.scalar_one_or_none()
+  async def get_role_or_none(cls, session: AsyncSession, org_id: int, user_id: int) -> Optional[OrganizationRole]:
+    """
+    Роль пользователя в организации или None.
+    Кешируется на время запроса (session.info) и в процессе (role_cache).
+    """
+    return (await cls.get_roles(session, (org_id,), user_id))[org_id]
 
-    if owner_id is not None and owner_id == user_id:
-      return OrganizationRole.OWNER
+  @classmethod
+  async def get_roles(cls, session: AsyncSession, org_ids: Iterable[int],
+                      user_id: int) -> dict[int, Optional[OrganizationRole]]:
+    """Роли пользователя сразу в нескольких организациях. Не найденные в кеше загружаются одним запросом"""
+    roles = session.info.setdefault(_ROLES_KEY, {})
+    result = {}
+    missing = []
+    for org_id in set(org_ids):
+      key = (org_id, user_id)
+      if key in roles:
+        result[org_id] = roles[key]
+        continue
+
+      role = role_cache.get(org_id, user_id)
+      if role is MISSING:
+        missing.append(org_id)
+      else:
+        result[org_id] = roles[key] = role
+
+    if missing:
+      loaded = await cls._load_roles(session, missing, user_id)
+      # Транзакция уже начата (самое позднее - запросом _load_roles)
+      since_epoch = session.info.get(_EPOCH_KEY)
+      for org_id in missing:
+        role = loaded.get(org_id)
+        role_cache.put(org_id, user_id, role, since_epoch)
+        result[org_id] = roles[(org_id, user_id)] = role
+
+    return result
 
-    # Если не владелец — ищем роль из OrganizationMember
+  @classmethod
+  async def _load_roles(cls, session: AsyncSession, org_ids: list[int],
+                        user_id: int) -> dict[int, Optional[OrganizationRole]]:
+    # Владелец и запись участника одним запросом
     stmt = (
-      select(OrganizationMember.role)
-      .where(
-        OrganizationMember.organization_id == org_id,
+      select(cls.model.id, cls.model.owner_id, OrganizationMember.role)
+      .select_from(cls.model)
+      .outerjoin(OrganizationMember, and_(
+        OrganizationMember.organization_id == cls.model.id,
         OrganizationMember.user_id == user_id
-      )
+      ))
+      .where(cls.model.id.in_(org_ids))
     )
+    return {
+      org_id: OrganizationRole.OWNER if owner_id == user_id else role
+      for org_id, owner_id, role in await session.execute(stmt)
+    }
 
-    result = await session.execute(stmt)
-    return result.scalar_one_or_none()
+  @classmethod
+  def _roles_changed(cls, session: AsyncSession, org_id: int):
+    """Сбрасывает кеш ролей организации: в запросе сразу, в процессах - после коммита"""
+    roles = session.info.get(_ROLES_KEY)
+    if roles:
+      for key in [key for key in roles if key[0] == org_id]:
+        del roles[key]
+    events.org_roles_changed_on_commit(session, org_id)
 
   @classmethod
   async def get_accounts_for_user(cls, session: AsyncSession, org_id: int, user_id: int):
@@ -174,6 +243,7 @@ class OrganizationDAO(BaseDAO[Organization]):
       OrganizationMember.user_id == target
     )
     await session.execute(stmt)
+    cls._roles_changed(session, org_id)
 
   @classmethod
   async def member_count_and_limit(cls, session: AsyncSession, org_id: int) -> tuple[int, int]:
@@ -207,6 +277,7 @@ class OrganizationDAO(BaseDAO[Organization]):
     ).on_duplicate_key_update(role=OrganizationMember.role)  # ничего не меняем, просто игнорируем
 
     await session.execute(stmt)
+    cls._roles_changed(session, org_id)
 
   @classmethod
   async def set_role(cls, session: AsyncSession, org_id: int, user_id: int, role: OrganizationRole):
@@ -218,4 +289,5 @@ class OrganizationDAO(BaseDAO[Organization]):
 
     result = await session.execute(stmt)
     if result.rowcount == 0:
-      raise ValueError("Пользователь не является участником организации.")
\ No newline at end of file
+      raise ValueError("Пользователь не является участником организации.")
+    cls._roles_changed(session, org_id)
\ No newline at end of file
@@ -0,0 +1,62 @@
+from datetime import datetime, timedelta
+from typing import Iterable
+
+from sqlalchemy import delete, insert, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from models import NotificationOutbox
+from .dao import BaseDAO
+
+
+class NotificationOutboxDAO(BaseDAO[NotificationOutbox]):
+  model = NotificationOutbox
+
+  @classmethod
+  async def add_many(cls, session: AsyncSession, messages: list[tuple[int, str, str]]):
+    """Записывает уведомления (user_id, title, body) одним INSERT в текущей транзакции"""
+    if messages:
+      await session.execute(insert(cls.model), [
+        {'user_id': user_id, 'title': title, 'body': body}
+        for user_id, title, body in messages
+      ])
+
+  @classmethod
+  async def claim(cls, session: AsyncSession, limit: int, retry_delay: float) -> list[NotificationOutbox]:
+    """
+    Берет до limit готовых к отправке сообщений. Строки, занятые другим воркером, пропускаются
+    (SKIP LOCKED). next_attempt_at сдвигается на retry_delay * 2^attempts: до этого момента
+    сообщение не возьмет никто, а если отправка не удалась - это задержка перед повтором.
+    Изменения нужно закоммитить до отправки.
+    """
+    now = datetime.utcnow()
+    result = await session.execute(
+      select(cls.model)
+      .where(cls.model.next_attempt_at <= now)
+      .order_by(cls.model.next_attempt_at)
+      .limit(limit)
+      .with_for_update(skip_locked=True)
+    )
+    messages = list(result.scalars().all())
+    for message in messages:
+      message.next_attempt_at = now + timedelta(seconds=retry_delay * 2 ** message.attempts)
+      message.attempts += 1
+    return messages
+
+  @classmethod
+  async def delete_many(cls, session: AsyncSession, ids: list[int]):
+    if ids:
+      await session.execute(delete(cls.model).where(cls.model.id.in_(ids)))
+
+  @classmethod
+  async def narrow(cls, session: AsyncSession, message: NotificationOutbox, subscription_ids: Iterable[int]):
+    """
+    Заменяет сообщение для всех подписок копиями для subscription_ids (остальные подписки его уже получили).
+    Попытки и время следующей попытки сохраняются.
+    """
+    await session.execute(insert(cls.model), [
+      {'user_id': message.user_id, 'subscription_id': subscription_id, 'title': message.title,
+       'body': message.body, 'attempts': message.attempts, 'next_attempt_at': message.next_attempt_at,
+       'created_at': message.created_at}
+      for subscription_id in subscription_ids
+    ])
+    await cls.delete_many(session, [message.id])
@@ -1,24 +1,17 @@
+import asyncio
 import json
-import os
+from typing import Iterable
 
-import aiohttp
-import webpush, webpush.types
-from webpush import WebPush
-from sqlalchemy import select
+from sqlalchemy import delete, or_, select
 from sqlalchemy.ext.asyncio import AsyncSession
 
 import database
+import push_delivery
+from logger import logger
+from push_delivery import Delivery
 from .dao import BaseDAO
 from models import WebPushSubscription
 
-VAPID_PRIVATE_CERT = os.getenv("VAPID_PRIVATE_CERT")
-VAPID_PUBLIC_CERT = os.getenv("VAPID_PUBLIC_CERT")
-
-wp = WebPush(
-  private_key=VAPID_PRIVATE_CERT.encode('utf-8'),
-  public_key=VAPID_PUBLIC_CERT.encode('utf-8'),
-  subscriber='me@pyxiion.ru'
-)
 
 class PushService(BaseDAO[WebPushSubscription]):
   model = WebPushSubscription
@@ -49,26 +42,84 @@ class PushService(BaseDAO[WebPushSubscription]):
     return bool(result.scalar_one_or_none())
 
   @classmethod
-  async def send_to_user(cls, session: AsyncSession, user_id: int, title: str, body: str):
-    stmt = select(cls.model).filter_by(user_id=user_id)
-    subs = await session.execute(stmt)
-
-    data = json.dumps({
-      'title': title,
-      'body': body
-    })
-
-    async with aiohttp.ClientSession() as client:
-      for sub in subs.scalars().all():
-        msg = wp.get(data, webpush.WebPushSubscription(
-          endpoint=sub.endpoint,
-          keys=webpush.types.WebPushKeys(
-            auth=sub.auth,
-            p256dh=sub.p256dh
-          )
-        ))
-        await client.post(
-          url=sub.endpoint,
-          data=msg.encrypted,
-          headers=msg.headers
-        )
\ No newline at end of file
+  async def get_many(cls, session: AsyncSession, user_ids: Iterable[int] = (),
+                     ids: Iterable[int] = ()) -> list[WebPushSubscription]:
+    """Все подписки пользователей user_ids и подписки с id из ids одним запросом"""
+    user_ids, ids = set(user_ids), set(ids)
+    conditions = []
+    if user_ids:
+      conditions.append(cls.model.user_id.in_(user_ids))
+    if ids:
+      conditions.append(cls.model.id.in_(ids))
+    if not conditions:
+      return []
+
+    result = await session.execute(select(cls.model).where(or_(*conditions)))
+    return list(result.scalars().all())
+
+  @classmethod
+  async def delete_many(cls, session: AsyncSession, ids: Iterable[int]):
+    ids = set(ids)
+    if ids:
+      await session.execute(delete(cls.model).where(cls.model.id.in_(ids)))
+
+  @staticmethod
+  async def deliver(sends: list[tuple[str, WebPushSubscription]]) -> list[Delivery]:
+    """
+    Отправляет (payload, подписка) параллельно через push_delivery. Сессия БД не нужна:
+    подписки читаются заранее, и соединение с БД не держится на время HTTP-запросов.
+    Исключение одной отправки не прерывает остальные и считается FAILED.
+    """
+    results = await asyncio.gather(*(
+      push_delivery.send(payload, sub.endpoint, sub.p256dh, sub.auth)
+      for payload, sub in sends
+    ), return_exceptions=True)
+
+    for index, result in enumerate(results):
+      if not isinstance(result, Delivery):
+        logger.error(f"Push to subscription {sends[index][1].id} failed: {result!r}")
+        results[index] = Delivery.FAILED
+    return results
+
+  @classmethod
+  async def send_to_user(cls, user_id: int, title: str, body: str):
+    await cls.send_many([(user_id, title, body)])
+
+  @classmethod
+  async def send_many(cls, messages: list[tuple[int, str, str]]) -> list[bool]:
+    """
+    Рассылает уведомления (user_id, title, body) на все подписки пользователей без повторов.
+    Подписки читаются одним запросом в своей сессии, недействительные удаляются после отправки.
+
+    :returns: доставлено ли каждое уведомление на все подписки (без подписок - считается доставленным)
+    """
+    user_ids = {user_id for user_id, _, _ in messages}
+    if not user_ids:
+      return []
+
+    async with database.SessionLocal() as session:
+      subs = {}
+      for sub in await cls.get_many(session, user_ids=user_ids):
+        subs.setdefault(sub.user_id, []).append(sub)
+
+    sends = [
+      (index, sub)
+      for index, (user_id, _, _) in enumerate(messages)
+      for sub in subs.get(user_id, ())
+    ]
+    payloads = [json.dumps({'title': title, 'body': body}) for _, title, body in messages]
+    results = await cls.deliver([(payloads[index], sub) for index, sub in sends])
+
+    delivered = [True] * len(messages)
+    expired = set()
+    for (index, sub), result in zip(sends, results):
+      if result is Delivery.FAILED:
+        delivered[index] = False
+      elif result is Delivery.EXPIRED:
+        expired.add(sub.id)
+
+    if expired:
+      async with database.SessionLocal() as session:
+        await cls.delete_many(session, expired)
+        await session.commit()
+    return delivered
@@ -0,0 +1,210 @@
+import decimal
+import itertools
+from datetime import date, datetime
+from typing import AsyncIterator, NamedTuple, Optional
+
+from sqlalchemy import Date, and_, delete, func, literal, select, union_all
+from sqlalchemy.dialects.mysql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from models import Account, AccountBalanceShard, AccountDailyStats, Transaction
+from .dao import BaseDAO
+
+
+class DayStats(NamedTuple):
+  """Обороты счета за день, все части сложены"""
+  day: date
+  inflow: decimal.Decimal
+  outflow: decimal.Decimal
+  count: int
+  closing_balance: decimal.Decimal
+
+
+class AccountStatsDAO(BaseDAO[AccountDailyStats]):
+  model = AccountDailyStats
+
+  @classmethod
+  async def record(cls, session: AsyncSession, transaction: Transaction, from_account: Account, to_account: Account,
+                   credited_shard: Optional[AccountBalanceShard] = None):
+    """
+    Добавляет транзакцию в обороты обоих счетов за день.
+    Вызывается после изменения балансов, пока строки счетов (или шард получателя) заблокированы.
+    """
+    await cls.record_many(session, [(transaction, from_account, to_account)], [credited_shard])
+
+  @classmethod
+  async def record_many(cls, session: AsyncSession, transfers: list[tuple[Transaction, Account, Account]],
+                        credited_shards: Optional[list[Optional[AccountBalanceShard]]] = None):
+    """
+    То же, что record, для пачки транзакций одним upsert.
+    Обороты сводятся по (счет, часть, день), закрывающий баланс - текущий баланс части после всех транзакций.
+
+    :param credited_shards: шард, на который зачислена каждая транзакция (None - на account.balance)
+    """
+    if credited_shards is None:
+      credited_shards = [None] * len(transfers)
+
+    days = {}
+    for (transaction, from_account, to_account), shard in zip(transfers, credited_shards):
+      day = transaction.created_at.date()
+      to_part = (shard.shard, shard) if shard is not None else (0, to_account)
+      for account, (part, holder), inflow, outflow in ((from_account, (0, from_account), 0, transaction.amount),
+                                                      (to_account, to_part, transaction.amount, 0)):
+        row = days.setdefault((account.id, part, day), {
+          'account_id': account.id, 'day': day, 'shard': part, 'inflow': 0, 'outflow': 0, 'count': 0,
+          'closing_balance': holder.balance,
+        })
+        row['inflow'] += inflow
+        row['outflow'] += outflow
+        row['count'] += 1
+
+    if days:
+      await cls.upsert(session, list(days.values()), accumulate=True)
+
+  @classmethod
+  async def record_consolidation(cls, session: AsyncSession, account: Account, shards: list[AccountBalanceShard]):
+    """
+    Шарды перенесены в account.balance (AccountDAO.consolidate): их части закрывают день нулем,
+    часть 0 - новым балансом. Переносы не считаются оборотами.
+    Строка части 0 пишется и без шардов (включение шардов): от нее считается баланс счета в get_days.
+    """
+    day = datetime.utcnow().date()
+    parts = [(0, account.balance)] + [(shard.shard, shard.balance) for shard in shards]
+    await cls.upsert(session, [
+      {'account_id': account.id, 'day': day, 'shard': part, 'inflow': 0, 'outflow': 0, 'count': 0,
+       'closing_balance': balance}
+      for part, balance in parts
+    ], accumulate=True)
+
+  @classmethod
+  async def upsert(cls, session: AsyncSession, rows: list[dict], *, accumulate: bool = False):
+    """
+    :param accumulate: прибавить обороты к существующей строке дня (иначе заменить ее)
+    """
+    stmt = insert(cls.model).values(rows)
+    if accumulate:
+      stmt = stmt.on_duplicate_key_update(
+        inflow=cls.model.inflow + stmt.inserted.inflow,
+        outflow=cls.model.outflow + stmt.inserted.outflow,
+        count=cls.model.count + stmt.inserted.count,
+        closing_balance=stmt.inserted.closing_balance,
+      )
+    else:
+      stmt = stmt.on_duplicate_key_update(
+        inflow=stmt.inserted.inflow,
+        outflow=stmt.inserted.outflow,
+        count=stmt.inserted.count,
+        closing_balance=stmt.inserted.closing_balance,
+      )
+    await session.execute(stmt)
+
+  @classmethod
+  async def get_days(cls, session: AsyncSession, account_id: int, date_from: date, date_to: date,
+                     opening_parts: dict[int, decimal.Decimal]) -> list[DayStats]:
+    """
+    Дни с оборотами в [date_from, date_to] по возрастанию. Дни без транзакций не хранятся.
+    Части счета складываются, баланс части без строки за день берется с ее последнего дня.
+
+    :param opening_parts: part_balances_before(date_from)
+    """
+    stmt = (
+      select(cls.model)
+      .where(cls.model.account_id == account_id, cls.model.day >= date_from, cls.model.day <= date_to)
+      .order_by(cls.model.day, cls.model.shard)
+    )
+    rows = (await session.execute(stmt)).scalars().all()
+    parts = dict(opening_parts)
+
+    days = []
+    for day, day_rows in itertools.groupby(rows, key=lambda row: row.day):
+      inflow = outflow = decimal.Decimal(0)
+      count = 0
+      for row in day_rows:
+        inflow += row.inflow
+        outflow += row.outflow
+        count += row.count
+        parts[row.shard] = row.closing_balance
+      days.append(DayStats(day, inflow, outflow, count, sum(parts.values(), decimal.Decimal(0))))
+    return days
+
+  @classmethod
+  async def part_balances_before(cls, session: AsyncSession, account_id: int, day: date) -> dict[int, decimal.Decimal]:
+    """Часть счета -> баланс на конец ее последнего дня до day"""
+    last_days = (
+      select(cls.model.shard, func.max(cls.model.day).label('day'))
+      .where(cls.model.account_id == account_id, cls.model.day < day)
+      .group_by(cls.model.shard)
+      .subquery()
+    )
+    stmt = (
+      select(cls.model.shard, cls.model.closing_balance)
+      .join(last_days, and_(cls.model.shard == last_days.c.shard, cls.model.day == last_days.c.day))
+      .where(cls.model.account_id == account_id)
+    )
+    result = await session.execute(stmt)
+    return dict(result.tuples().all())
+
+  @classmethod
+  async def delete_shard_parts(cls, session: AsyncSession) -> int:
+    """Удаляет строки шардов (shard > 0) всех счетов - перед пересчетом истории в часть 0"""
+    result = await session.execute(delete(cls.model).where(cls.model.shard > 0))
+    return result.rowcount
+
+  @classmethod
+  async def stream_history(cls, session: AsyncSession, batch_size: int) -> AsyncIterator[dict]:
+    """
+    Пересчет оборотов из transaction: группировка на стороне БД, результат читается потоком.
+    Дни каждого счета идут от последнего к первому, закрывающий баланс восстанавливается
+    от текущего баланса счета вычитанием оборотов.
+    """
+    sides = union_all(
+      select(
+        Transaction.sender_account_id.label('account_id'),
+        Transaction.created_at,
+        literal(0).label('inflow'),
+        Transaction.amount.label('outflow'),
+      ),
+      select(
+        Transaction.recipient_account_id.label('account_id'),
+        Transaction.created_at,
+        Transaction.amount.label('inflow'),
+        literal(0).label('outflow'),
+      ),
+    ).subquery()
+
+    day = func.date(sides.c.created_at, type_=Date).label('day')
+    stmt = (
+      select(
+        sides.c.account_id,
+        day,
+        func.sum(sides.c.inflow),
+        func.sum(sides.c.outflow),
+        func.count(),
+        Account.balance,
+      )
+      .join(Account, Account.id == sides.c.account_id)
+      .group_by(sides.c.account_id, day, Account.balance)
+      .order_by(sides.c.account_id, day.desc())
+      .execution_options(yield_per=batch_size)
+    )
+
+    account_id = None
+    closing = None
+    async for row_account_id, row_day, inflow, outflow, count, balance in await session.stream(stmt):
+      inflow = decimal.Decimal(str(inflow))
+      outflow = decimal.Decimal(str(outflow))
+      if row_account_id != account_id:
+        account_id = row_account_id
+        closing = decimal.Decimal(str(balance))
+
+      yield {
+        'account_id': row_account_id,
+        'day': row_day,
+        'shard': 0,
+        'inflow': inflow,
+        'outflow': outflow,
+        'count': count,
+        'closing_balance': closing,
+      }
+      # Баланс на конец предыдущего дня с оборотами
+      closing = closing - inflow + outflow
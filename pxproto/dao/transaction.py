@@ -1,26 +1,84 @@
-from sqlalchemy import or_, select, func
+import os
+from collections import Counter
+from datetime import datetime
+from typing import Iterable, Optional
+
+from sqlalchemy import and_, case, insert, or_, select, func, update
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import aliased
 
-from models import Transaction, Account, User
+from models import Transaction, Account, AccountBalanceShard, User, Organization, LedgerOwner
 from .dao import BaseDAO
+from .ledger import LedgerDAO
+
+# Читать историю из ledger_entry. Включать после ledger_backfill.py, иначе старые транзакции не видны
+HISTORY_FROM_LEDGER = os.getenv('HISTORY_FROM_LEDGER', 'false').lower() in ('1', 'true', 'yes')
 
 
 class TransactionDAO(BaseDAO[Transaction]):
     model = Transaction
 
     @classmethod
-    def _stmt_with_filter(cls, field_name: str, target_id: int):
+    def _branch(cls, account_column, owned_accounts, limit: Optional[int], after: Optional[tuple[datetime, int]],
+                since: Optional[datetime] = None):
+        """
+        Internal: ID транзакций по одной стороне (отправитель или получатель).
+        Читается по индексу (account_id, created_at) и сразу ограничивается limit.
         """
-        Internal: builds a select stmt for transactions where sender or recipient
+        stmt = (
+            select(cls.model.id, cls.model.created_at)
+            .where(account_column.in_(owned_accounts))
+        )
+        if since is not None:
+            stmt = stmt.where(cls.model.created_at >= since)
+        if after is not None:
+            created_at, tx_id = after
+            # Keyset-пагинация: строго после (created_at, id), без чтения пропущенных строк
+            stmt = stmt.where(
+                or_(
+                    cls.model.created_at < created_at,
+                    and_(cls.model.created_at == created_at, cls.model.id < tx_id),
+                )
+            )
+        return stmt.order_by(cls.model.created_at.desc(), cls.model.id.desc()).limit(limit)
+
+    @classmethod
+    def _stmt_with_filter(cls, field_name: str, target_id: int, limit: Optional[int], offset: int = 0,
+                          after: Optional[tuple[datetime, int]] = None, since: Optional[datetime] = None):
+        """
+        Internal: builds a select stmt for a page of transactions where sender or recipient
         account has field == target_id
+
+        OR по двум сторонам не использует индексы, поэтому ID выбираются UNION ALL двух веток,
+        каждая по своему индексу. Транзакции между счетами одного владельца попадают только
+        в ветку отправителя. При HISTORY_FROM_LEDGER ID берутся из ledger_entry одним диапазоном индекса.
+
+        :param limit: None - без ограничения (выгрузка потоком)
+        :param after: (created_at, id) последней транзакции предыдущей страницы
+        :param since: не раньше этого момента
         """
         SenderAcc = aliased(Account)
         RecAcc = aliased(Account)
         SenderUser = aliased(User)
         RecUser = aliased(User)
 
-        field_sender = getattr(SenderAcc, field_name)
-        field_recipient = getattr(RecAcc, field_name)
+        branch_limit = offset + limit if limit is not None else None
+
+        if HISTORY_FROM_LEDGER:
+            owner_type = LedgerOwner.USER if field_name == 'user_id' else LedgerOwner.ORG
+            page_ids = LedgerDAO.page_ids(owner_type, target_id, branch_limit, after, since).subquery()
+        else:
+            owned_accounts = select(Account.id).where(getattr(Account, field_name) == target_id)
+
+            # Каждая ветка обернута в подзапрос: скобки вокруг SELECT ... LIMIT в UNION поддерживают не все БД
+            sent = cls._branch(cls.model.sender_account_id, owned_accounts, branch_limit, after, since).subquery()
+            received = cls._branch(cls.model.recipient_account_id, owned_accounts, branch_limit, after, since) \
+                .where(cls.model.sender_account_id.not_in(owned_accounts)).subquery()
+            page_ids = (
+                select(sent.c.id)
+                .union_all(select(received.c.id))
+                .subquery()
+            )
 
         return (
             select(
@@ -33,29 +91,97 @@ class TransactionDAO(BaseDAO[Transaction]):
                 func.coalesce(RecUser.username, RecAcc.account_number)
                     .label('recipient_name'),
             )
+            .join(page_ids, page_ids.c.id == cls.model.id)
             .join(SenderAcc, cls.model.sender_account_id == SenderAcc.id)
             .outerjoin(SenderUser, SenderAcc.user_id == SenderUser.id)
             .join(RecAcc, cls.model.recipient_account_id == RecAcc.id)
             .outerjoin(RecUser, RecAcc.user_id == RecUser.id)
-            .where(
-                or_(
-                    field_sender == target_id,
-                    field_recipient == target_id,
-                )
-            )
-            .order_by(cls.model.created_at.desc())
+            .order_by(cls.model.created_at.desc(), cls.model.id.desc())
+            .limit(limit)
+            .offset(offset)
         )
 
     @classmethod
-    def get_user_transactions_stmt(cls, user_id: int):
+    def get_user_transactions_stmt(cls, user_id: int, limit: Optional[int], offset: int = 0,
+                                   after: Optional[tuple[datetime, int]] = None, since: Optional[datetime] = None):
         """
-        Returns stmt of transactions for given user_id on account.user_id
+        Returns stmt of a page of transactions for given user_id on account.user_id
         """
-        return cls._stmt_with_filter('user_id', user_id)
+        return cls._stmt_with_filter('user_id', user_id, limit, offset, after, since)
 
     @classmethod
-    def get_org_transactions_stmt(cls, org_id: int):
+    def get_org_transactions_stmt(cls, org_id: int, limit: Optional[int], offset: int = 0,
+                                  after: Optional[tuple[datetime, int]] = None, since: Optional[datetime] = None):
         """
-        Returns stmt of transactions for given org_id on account.organization_id
+        Returns stmt of a page of transactions for given org_id on account.organization_id
         """
-        return cls._stmt_with_filter('organization_id', org_id)
+        return cls._stmt_with_filter('organization_id', org_id, limit, offset, after, since)
+
+    @classmethod
+    def _shard_count(cls, field_name: str, target_id: int):
+        """Internal: транзакции, зачисленные на шарды балансов счетов владельца (не вошли в его счетчик)"""
+        return (
+            select(func.coalesce(func.sum(AccountBalanceShard.transaction_count), 0))
+            .join(Account, Account.id == AccountBalanceShard.account_id)
+            .where(getattr(Account, field_name) == target_id)
+            .scalar_subquery()
+        )
+
+    @classmethod
+    async def get_user_transaction_count(cls, session: AsyncSession, user_id: int) -> Optional[int]:
+        """Число транзакций пользователя: счетчик user.transaction_count и счетчики шардов его счетов"""
+        result = await session.execute(
+            select(User.transaction_count + cls._shard_count('user_id', user_id)).where(User.id == user_id)
+        )
+        return result.scalar_one_or_none()
+
+    @classmethod
+    async def get_org_transaction_count(cls, session: AsyncSession, org_id: int) -> Optional[int]:
+        """Число транзакций организации: счетчик organization.transaction_count и счетчики шардов ее счетов"""
+        result = await session.execute(
+            select(Organization.transaction_count + cls._shard_count('organization_id', org_id))
+            .where(Organization.id == org_id)
+        )
+        return result.scalar_one_or_none()
+
+    @classmethod
+    async def insert_many(cls, session: AsyncSession, sender_account_id: int, rows: list[dict]) -> list[Transaction]:
+        """
+        Вставляет переводы с одного счета одним INSERT и возвращает их в порядке rows.
+        Счет отправителя должен быть заблокирован: новые строки отбираются по нему и id после
+        текущего максимума, а автоинкремент внутри одного INSERT возрастает в порядке строк.
+        """
+        last_id = (await session.execute(select(func.max(cls.model.id)))).scalar_one() or 0
+        await session.execute(insert(cls.model), rows)
+
+        result = await session.execute(
+            select(cls.model)
+            .where(cls.model.sender_account_id == sender_account_id, cls.model.id > last_id)
+            .order_by(cls.model.id)
+        )
+        return list(result.scalars().all())
+
+    @classmethod
+    async def increment_counters(cls, session: AsyncSession, transfers: Iterable[tuple[Account, Account]]):
+        """
+        Увеличивает счетчики транзакций владельцев счетов, по одному UPDATE на таблицу.
+        Транзакция между счетами одного владельца считается один раз, как и в _stmt_with_filter.
+
+        :param transfers: счета каждой транзакции: (отправитель, получатель) или только (отправитель,),
+            если транзакция учтена в счетчике шарда получателя
+        """
+        user_counts = Counter()
+        org_counts = Counter()
+        for accounts in transfers:
+            user_counts.update({account.user_id for account in accounts if account.user_id is not None})
+            org_counts.update({account.organization_id for account in accounts if account.organization_id is not None})
+
+        for model, counts in ((User, user_counts), (Organization, org_counts)):
+            if not counts:
+                continue
+            await session.execute(
+                update(model)
+                .where(model.id.in_(list(counts)))
+                .values(transaction_count=model.transaction_count + case(counts, value=model.id, else_=0))
+                .execution_options(synchronize_session=False)
+            )
@@ -3,6 +3,8 @@ from typing import Union, Optional, Sequence
 from sqlalchemy import select, and_, update
 from sqlalchemy.ext.asyncio import AsyncSession
 
+import events
+import passwords
 from models import User, Account
 from .dao import BaseDAO
 
@@ -11,8 +13,7 @@ class UserDAO(BaseDAO[User]):
 
   @classmethod
   async def create(cls, session: AsyncSession, username: str, password: str):
-    from api.auth import get_hashed_password
-    hashed_password = get_hashed_password(password)
+    hashed_password = await passwords.hash_password(password)
 
     user = User(
       username=username,
@@ -24,17 +25,18 @@ class UserDAO(BaseDAO[User]):
 
   @classmethod
   async def set_password(cls, session: AsyncSession, id: str|int, new_password: str):
-    from api.auth import get_hashed_password
-    hashed_password = get_hashed_password(new_password)
+    hashed_password = await passwords.hash_password(new_password)
 
-    stmt = update(cls.model)
+    # Событие user_changed рассылается по ID
     if isinstance(id, str):
-      stmt = stmt.where(cls.model.username == id)
-    else:
-      stmt = stmt.where(cls.model.id == id)
-    stmt = stmt.values(password=hashed_password)
+      id = await cls.get_id_by_name(session, id)
+      if id is None:
+        return
+
+    stmt = update(cls.model).where(cls.model.id == id).values(password=hashed_password)
 
     await session.execute(stmt)
+    events.user_changed_on_commit(session, id)
 
   @classmethod
   async def get_name_by_id(cls, session: AsyncSession, user_id: int) -> Optional[str]:
@@ -57,11 +59,12 @@ class UserDAO(BaseDAO[User]):
     """Проверяет, является ли пользователь администратором"""
     if isinstance(user, str):
       stmt = select(cls.model.is_admin).where(cls.model.username == user)
+      result = await session.execute(stmt)
+      is_admin_flag = result.scalar_one_or_none()
     else:
-      stmt = select(cls.model.is_admin).where(cls.model.id == user)
-
-    result = await session.execute(stmt)
-    is_admin_flag = result.scalar_one_or_none()
+      # По ID берем через identity map: если пользователь уже загружен в этом запросе, запроса не будет
+      row = await session.get(cls.model, user)
+      is_admin_flag = row.is_admin if row else None
     return is_admin_flag is True
 
   @classmethod
@@ -71,8 +74,7 @@ class UserDAO(BaseDAO[User]):
       result = await session.execute(
         select(cls.model).where(cls.model.username == user_identifier))
     else:
-      result = await session.execute(
-        select(cls.model).where(cls.model.id == user_identifier))
+      return await session.get(cls.model, user_identifier)
     return result.scalar_one_or_none()
 
   @classmethod
@@ -0,0 +1,109 @@
+"""
+События для клиентов: подписки на топики (см. api/subscriptions.py) и сообщения пользователям.
+Идут через шину событий, поэтому доходят до соединений в любом процессе-воркере.
+"""
+import typing
+from typing import Any, Optional, Iterable, Callable, Union
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+import database
+from pxws.bus import EventBus, InMemoryBus
+
+if typing.TYPE_CHECKING:
+  from pxws.server import Server
+
+_server: Optional["Server"] = None
+_bus: EventBus = InMemoryBus()
+# kind -> обработчики служебных событий (сброс кешей и т.п.)
+_listeners: dict[str, list[Callable[[dict], Any]]] = {}
+
+
+def attach(server: "Server", bus: Optional[EventBus] = None) -> None:
+  """Привязывает сервер, которому доставляются события, и шину между процессами"""
+  global _server, _bus
+  _server = server
+  _bus = bus or InMemoryBus()
+
+
+def server() -> Optional["Server"]:
+  """Сервер, к которому привязаны события (None, пока не вызван attach)"""
+  return _server
+
+
+async def start() -> None:
+  """Начинает принимать события из шины"""
+  await _bus.start(_deliver, _on_reconnect)
+
+
+def listen(kind: str, callback: Callable[[dict], Any]) -> None:
+  """Подписывает callback на служебные события вида kind из всех процессов"""
+  _listeners.setdefault(kind, []).append(callback)
+
+
+async def _deliver(message: dict) -> None:
+  """Доставка события соединениям этого процесса"""
+  for callback in _listeners.get(message['kind'], ()):
+    callback(message)
+
+  if _server is None:
+    return
+
+  if message['kind'] == 'topic':
+    await _server.publish(message['topic'], message['payload'])
+  elif message['kind'] == 'users':
+    await _server.send_to_users(message['user_ids'], message['payload'])
+
+
+async def _on_reconnect() -> None:
+  """
+  Соединение с шиной восстановлено: события за время разрыва потеряны.
+  Слушатели bus_reconnected сбрасывают все, что сбрасывалось бы по этим событиям
+  """
+  for callback in _listeners.get('bus_reconnected', ()):
+    callback({'kind': 'bus_reconnected'})
+
+
+def account_topic(account_id: int) -> str:
+  return f'account:{account_id}'
+
+
+def org_topic(org_id: int) -> str:
+  return f'org:{org_id}'
+
+
+async def publish(topic: str, payload: Any) -> None:
+  """Рассылает сообщение подписчикам топика во всех процессах"""
+  await _bus.publish({'kind': 'topic', 'topic': topic, 'payload': payload})
+
+
+async def send_to_users(user_ids: Iterable[int], payload: Any) -> None:
+  """Рассылает сообщение всем соединениям пользователей во всех процессах"""
+  await _bus.publish({'kind': 'users', 'user_ids': list(user_ids), 'payload': payload})
+
+
+def publish_on_commit(session: AsyncSession, events: list[tuple[str, Any]]) -> None:
+  """Публикует события (топик, сообщение) после коммита сессии"""
+  async def send():
+    for topic, payload in events:
+      await publish(topic, payload)
+
+  database.on_commit(session, send)
+
+
+async def user_changed(user: Union[int, str]) -> None:
+  """Пользователь (по ID или имени) изменился: пароль, права, лимиты"""
+  await _bus.publish({'kind': 'user_changed', 'user': user})
+
+
+def user_changed_on_commit(session: AsyncSession, user: Union[int, str]) -> None:
+  database.on_commit(session, lambda: user_changed(user))
+
+
+async def org_roles_changed(org_id: int) -> None:
+  """Состав или роли участников организации изменились"""
+  await _bus.publish({'kind': 'org_roles_changed', 'org': org_id})
+
+
+def org_roles_changed_on_commit(session: AsyncSession, org_id: int) -> None:
+  database.on_commit(session, lambda: org_roles_changed(org_id))
@@ -0,0 +1,43 @@
+"""
+Ключи идемпотентности переводов (models.IdempotencyKey).
+
+Клиент передает idempotency_key и при обрыве соединения повторяет запрос с тем же ключом:
+выполненный перевод не повторяется, возвращается его сохраненный ответ.
+Ключи старше IDEMPOTENCY_KEY_TTL удаляются фоновой задачей в каждом воркере.
+"""
+import asyncio
+import os
+from datetime import datetime, timedelta
+
+import database
+from dao.idempotency import IdempotencyDAO
+from logger import logger
+
+IDEMPOTENCY_KEY_TTL = float(os.getenv('IDEMPOTENCY_KEY_TTL', 24 * 3600))
+IDEMPOTENCY_PURGE_INTERVAL = float(os.getenv('IDEMPOTENCY_PURGE_INTERVAL', 600))
+# Ключей в одном DELETE: не держать долгие блокировки на таблице
+IDEMPOTENCY_PURGE_BATCH = 1000
+
+
+async def purge_expired() -> int:
+  """Удаляет ключи старше IDEMPOTENCY_KEY_TTL порциями в отдельных транзакциях"""
+  before = datetime.utcnow() - timedelta(seconds=IDEMPOTENCY_KEY_TTL)
+  total = 0
+  while True:
+    async with database.SessionLocal() as session:
+      deleted = await IdempotencyDAO.purge(session, before, IDEMPOTENCY_PURGE_BATCH)
+      await session.commit()
+    total += deleted
+    if deleted < IDEMPOTENCY_PURGE_BATCH:
+      return total
+
+
+async def purge_loop():
+  while True:
+    try:
+      deleted = await purge_expired()
+      if deleted:
+        logger.info(f"Purged {deleted} expired idempotency keys")
+    except Exception as e:
+      logger.error(f"Error purging idempotency keys: {e}", exc_info=e)
+    await asyncio.sleep(IDEMPOTENCY_PURGE_INTERVAL)
@@ -0,0 +1,53 @@
+"""
+Заполнение ledger_entry для транзакций, созданных до появления таблицы.
+
+Транзакции обрабатываются диапазонами id, каждый диапазон - отдельная короткая транзакция БД,
+поэтому задание можно прервать и запустить снова: уже заполненные транзакции пропускаются.
+Новые транзакции пишут записи сами (api.accounts.transfer).
+
+  python ledger_backfill.py [--batch 5000]
+"""
+import argparse
+import asyncio
+
+from dotenv import load_dotenv
+
+load_dotenv('.env')
+load_dotenv('.env.local', override=True)
+
+import database
+from dao.ledger import LedgerDAO
+from logger import logger
+
+
+async def backfill(batch_size: int):
+  async with database.get_db() as session:
+    upto_id = await LedgerDAO.max_transaction_id(session)
+
+  logger.info(f"Ledger backfill: transactions up to id {upto_id}, batch {batch_size}")
+
+  after_id = 0
+  total = 0
+  while after_id < upto_id:
+    batch_end = min(after_id + batch_size, upto_id)
+    async with database.get_db() as session:
+      total += await LedgerDAO.backfill_range(session, after_id, batch_end)
+      await session.commit()
+
+    after_id = batch_end
+    logger.info(f"Ledger backfill: {after_id}/{upto_id}, {total} entries added")
+
+
+async def main(batch_size: int):
+  try:
+    await backfill(batch_size)
+  finally:
+    await database.engine.dispose()
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description='Заполнение ledger_entry по существующим транзакциям')
+  parser.add_argument('--batch', type=int, default=5000, help='транзакций за один INSERT ... SELECT')
+  args = parser.parse_args()
+
+  asyncio.run(main(args.batch))
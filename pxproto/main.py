@@ -1,22 +1,118 @@
 import asyncio
+import multiprocessing
+import os
+
 from dotenv import load_dotenv
 
 load_dotenv('.env')
 load_dotenv('.env.local', override=True)
 
-import api.auth, api.transactions, api.currencies, api.accounts, api.push, api.admin, api.search, api.map, api.org
+import database
+import events
+import idempotency
+import outbox
+import push_delivery
+import api.auth, api.transactions, api.currencies, api.accounts, api.push, api.admin, api.search, api.map, api.org, \
+  api.subscriptions
+from logger import logger
+from pxws.bus import create_bus, LocalBroker
+from pxws.codec import get_codec
 from pxws.server import Server
 
-server = Server()
+HOST = os.getenv('PXWS_HOST', 'localhost')
+PORT = int(os.getenv('PXWS_PORT', 4000))
+# Количество процессов-воркеров. Больше одного - слушают порт через SO_REUSEPORT
+WORKERS = int(os.getenv('PXWS_WORKERS', 1))
+# Шина событий между воркерами: memory (один процесс), local (Unix-сокет) или redis
+EVENT_BUS = os.getenv('PXWS_EVENT_BUS', 'memory')
+EVENT_BUS_URL = os.getenv('PXWS_EVENT_BUS_URL', '/tmp/pxws-bus.sock')
+
+
+def create_server() -> Server:
+  server = Server(
+    max_in_flight=int(os.getenv('PXWS_MAX_IN_FLIGHT', 1)),
+    codec=get_codec(os.getenv('PXWS_CODEC', 'json'))
+  )
+  server.set_request_scope(database.request_scope)
+
+  # Дополнительные подпротоколы, которые клиент может запросить через Sec-WebSocket-Protocol
+  for codec_name in filter(None, map(str.strip, os.getenv('PXWS_SUBPROTOCOLS', '').split(','))):
+    server.add_subprotocol(f'pxws.{codec_name}', get_codec(codec_name))
+
+  server.add_route(api.auth.route)
+  server.add_route(api.transactions.route)
+  server.add_route(api.currencies.route)
+  server.add_route(api.accounts.route)
+  server.add_route(api.push.route)
+  server.add_route(api.admin.route)
+  server.add_route(api.search.route)
+  server.add_route(api.map.route)
+  server.add_route(api.org.route)
+  server.add_route(api.subscriptions.route)
+  return server
+
+
+async def run_worker():
+  server = create_server()
+  events.attach(server, create_bus(EVENT_BUS, EVENT_BUS_URL))
+  await events.start()
+  # Фоновые задачи воркера: чистка ключей идемпотентности, доставка уведомлений из outbox
+  background = [
+    asyncio.create_task(idempotency.purge_loop()),
+    asyncio.create_task(outbox.dispatch_loop()),
+  ]
+
+  try:
+    await server.serve_forever(HOST, PORT, reuse_port=WORKERS > 1)
+  finally:
+    for task in background:
+      task.cancel()
+    await push_delivery.close()
+
+
+def worker_main():
+  asyncio.run(run_worker())
+
+
+async def run_broker(processes: list[multiprocessing.process.BaseProcess]):
+  if os.path.exists(EVENT_BUS_URL):
+    os.unlink(EVENT_BUS_URL)
+  broker = LocalBroker(EVENT_BUS_URL)
+  await broker.start()
+
+  for process in processes:
+    process.start()
+
+  await broker.serve_forever()
+
+
+def main():
+  if WORKERS <= 1:
+    worker_main()
+    return
+
+  if EVENT_BUS == 'memory':
+    raise RuntimeError('PXWS_EVENT_BUS=memory does not work with several workers, use local or redis')
+
+  # spawn, а не fork: брокер запускает воркеров из работающего event loop
+  mp = multiprocessing.get_context('spawn')
+  processes = [mp.Process(target=worker_main, name=f'pxws-worker-{i}') for i in range(WORKERS)]
+  logger.info(f"Starting {WORKERS} workers on {HOST}:{PORT}, event bus: {EVENT_BUS}")
+
+  try:
+    if EVENT_BUS == 'local':
+      # Брокер живет в главном процессе, воркеры подключаются к нему после его запуска
+      asyncio.run(run_broker(processes))
+    else:
+      for process in processes:
+        process.start()
+      for process in processes:
+        process.join()
+  finally:
+    for process in processes:
+      if process.is_alive():
+        process.terminate()
 
-server.add_route(api.auth.route)
-server.add_route(api.transactions.route)
-server.add_route(api.currencies.route)
-server.add_route(api.accounts.route)
-server.add_route(api.push.route)
-server.add_route(api.admin.route)
-server.add_route(api.search.route)
-server.add_route(api.map.route)
-server.add_route(api.org.route)
 
-asyncio.run(server.serve_forever('localhost', 4000))
+if __name__ == '__main__':
+  main()
@@ -1,3 +1,7 @@
-from .general import User, Currency, Transaction, Account, Base
+from .general import User, Currency, Transaction, Account, AccountBalanceShard, Base
 from .web_push import WebPushSubscription
-from .org import Organization, OrganizationMember, OrganizationRole
\ No newline at end of file
+from .org import Organization, OrganizationMember, OrganizationRole
+from .ledger import LedgerEntry, LedgerOwner
+from .stats import AccountDailyStats
+from .idempotency import IdempotencyKey
+from .outbox import NotificationOutbox
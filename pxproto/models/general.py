@@ -1,7 +1,7 @@
 import decimal
 from datetime import datetime
 
-from sqlalchemy import Column, Integer, String, ForeignKey, DateTime, Boolean, DECIMAL, VARCHAR
+from sqlalchemy import Column, Integer, String, ForeignKey, DateTime, Boolean, DECIMAL, VARCHAR, Index
 from sqlalchemy.orm import relationship
 
 from config import TRANSACTION_COMMENT_MAX_LENGTH
@@ -20,6 +20,9 @@ class User(Base):
   account_limit = Column(Integer, server_default='3')
   organization_limit = Column(Integer, server_default='0')
 
+  # Счетчик транзакций со счетами пользователя (для total в истории без COUNT(*))
+  transaction_count = Column(Integer, nullable=False, default=0, server_default='0')
+
   joined_at = Column(DateTime, default=datetime.utcnow)
   updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
@@ -51,6 +54,11 @@ class Account(Base):
   account_number = Column(VARCHAR(6), index=True, unique=True)
 
   balance: decimal.Decimal = Column(DECIMAL(19, 2), default=0.0)
+  # Входящие переводы зачисляются на случайный из balance_shards шардов (AccountBalanceShard),
+  # а не в balance - строка счета не блокируется каждым плательщиком. 0 - шарды выключены
+  balance_shards = Column(Integer, nullable=False, default=0, server_default='0')
+  # Сумма шардов: не колонка, заполняется AccountDAO.load_shard_balances
+  shard_balance: decimal.Decimal = decimal.Decimal(0)
 
   is_public = Column(Boolean, server_default='0', default=False)
 
@@ -60,6 +68,10 @@ class Account(Base):
 
   user = relationship("User", backref="accounts")
 
+  @property
+  def total_balance(self) -> decimal.Decimal:
+    return self.balance + self.shard_balance
+
   def to_dict(self, *, include_private_data: bool = True):
     r = {
       'name': self.name,
@@ -70,26 +82,47 @@ class Account(Base):
       r |= {
         'id': self.id,
         'order_id': self.list_order,
-        'balance': float(self.balance),
+        'balance': float(self.total_balance),
         'is_public': self.is_public
       }
     return r
 
 
+class AccountBalanceShard(Base):
+  """
+  Часть баланса счета с balance_shards > 0. Сливается в account.balance при нехватке средств на списание.
+  Номера шардов 1..balance_shards: часть 0 в account_daily_stats - сам account.balance.
+  """
+  __tablename__ = "account_balance_shard"
+
+  account_id = Column(ForeignKey("account.id"), primary_key=True)
+  shard = Column(Integer, primary_key=True, autoincrement=False)
+
+  balance: decimal.Decimal = Column(DECIMAL(19, 2), nullable=False, default=0, server_default='0')
+  # Транзакции, зачисленные на шард: не попадают в счетчик владельца, чтобы не блокировать его строку
+  transaction_count = Column(Integer, nullable=False, default=0, server_default='0')
+
+
 class Transaction(Base):
   __tablename__ = "transaction"
 
   id = Column(Integer, primary_key=True, index=True, autoincrement=True)
   author_id = Column(ForeignKey("user.id"), index=True)
 
-  sender_account_id = Column(ForeignKey("account.id"), index=True)
-  recipient_account_id = Column(ForeignKey("account.id"), index=True)
+  sender_account_id = Column(ForeignKey("account.id"))
+  recipient_account_id = Column(ForeignKey("account.id"))
 
   amount = Column(DECIMAL(19, 2))
   comment = Column(VARCHAR(TRANSACTION_COMMENT_MAX_LENGTH))
 
   created_at = Column(DateTime, default=datetime.utcnow)
 
+  # История счета читается по каждой стороне отдельно (см. TransactionDAO._stmt_with_filter)
+  __table_args__ = (
+    Index('ix_transaction_sender_created', 'sender_account_id', 'created_at'),
+    Index('ix_transaction_recipient_created', 'recipient_account_id', 'created_at'),
+  )
+
   def to_dict(self, *,
               sender_name: str,
               receiver_name: str,
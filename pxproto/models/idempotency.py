@@ -0,0 +1,27 @@
+from datetime import datetime
+
+from sqlalchemy import Column, Integer, ForeignKey, DateTime, VARCHAR, JSON, UniqueConstraint
+
+from config import IDEMPOTENCY_KEY_MAX_LENGTH
+from pxproto.database import Base
+
+
+class IdempotencyKey(Base):
+  """
+  Ключ идемпотентности перевода и его ответ. Повтор запроса с тем же ключом возвращает
+  сохраненный ответ. Старые ключи удаляются задачей idempotency.purge_loop.
+  """
+  __tablename__ = "idempotency_key"
+
+  id = Column(Integer, primary_key=True, autoincrement=True)
+  user_id = Column(ForeignKey("user.id"), nullable=False)
+  key = Column(VARCHAR(IDEMPOTENCY_KEY_MAX_LENGTH), nullable=False)
+
+  # Ответ операции, записывается в той же транзакции БД, что и перевод
+  response = Column(JSON)
+
+  created_at = Column(DateTime, default=datetime.utcnow, nullable=False, index=True)
+
+  __table_args__ = (
+    UniqueConstraint('user_id', 'key', name='uq_idempotency_key_user_key'),
+  )
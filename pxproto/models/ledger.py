@@ -0,0 +1,38 @@
+from datetime import datetime
+from enum import Enum
+
+import sqlalchemy
+from sqlalchemy import Column, Integer, ForeignKey, DateTime, DECIMAL, Index, UniqueConstraint
+
+from pxproto.database import Base
+
+
+class LedgerOwner(Enum):
+  USER = 'user'
+  ORG = 'org'
+
+
+class LedgerEntry(Base):
+  """
+  Сторона транзакции для владельца счета: по две записи на транзакцию (отправитель и получатель).
+  Денормализует Transaction -> Account, чтобы история владельца читалась одним диапазоном индекса.
+  """
+  __tablename__ = "ledger_entry"
+
+  id = Column(Integer, primary_key=True, autoincrement=True)
+
+  owner_type = Column(sqlalchemy.Enum(LedgerOwner), nullable=False)
+  owner_id = Column(Integer, nullable=False)
+  account_id = Column(ForeignKey("account.id"), nullable=False, index=True)
+  transaction_id = Column(ForeignKey("transaction.id"), nullable=False)
+
+  # Со знаком: списание отрицательное, зачисление положительное
+  amount = Column(DECIMAL(19, 2), nullable=False)
+  # Копия transaction.created_at
+  created_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+
+  __table_args__ = (
+    Index('ix_ledger_entry_owner_created', 'owner_type', 'owner_id', 'created_at', 'transaction_id'),
+    # Одна запись на сторону транзакции: повторный или параллельный ledger_backfill.py не создаст дублей
+    UniqueConstraint('transaction_id', 'account_id', 'owner_type', name='uq_ledger_entry_transaction_account'),
+  )
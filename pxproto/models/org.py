@@ -21,6 +21,9 @@ class Organization(Base):
   account_limit = Column(Integer, default=3, server_default='3', nullable=False)
   member_limit = Column(Integer, default=3, server_default='3', nullable=False)
 
+  # Счетчик транзакций со счетами организации (для total в истории без COUNT(*))
+  transaction_count = Column(Integer, default=0, server_default='0', nullable=False)
+
   created_at = Column(DateTime, default=datetime.now)
   deleted_at = Column(DateTime, default=None)
 
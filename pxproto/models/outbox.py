@@ -0,0 +1,28 @@
+from datetime import datetime
+
+from sqlalchemy import Column, Integer, ForeignKey, DateTime, String, Text
+
+from pxproto.database import Base
+
+
+class NotificationOutbox(Base):
+  """
+  Push-уведомление, записанное в транзакции операции. Доставляется после коммита
+  фоновой задачей outbox.dispatch_loop и удаляется.
+  """
+  __tablename__ = "notification_outbox"
+
+  id = Column(Integer, primary_key=True, autoincrement=True)
+  user_id = Column(ForeignKey("user.id"), nullable=False)
+  # Только эта подписка пользователя (повтор после частичной доставки), NULL - все подписки
+  subscription_id = Column(ForeignKey("webpush_subscription.id", ondelete='CASCADE'), nullable=True)
+
+  title = Column(String(128), nullable=False)
+  body = Column(Text, nullable=False)
+
+  # Попыток доставки. Раньше next_attempt_at сообщение не берется: это и аренда на время
+  # отправки, и задержка перед повтором
+  attempts = Column(Integer, nullable=False, default=0, server_default='0')
+  next_attempt_at = Column(DateTime, nullable=False, default=datetime.utcnow, index=True)
+
+  created_at = Column(DateTime, default=datetime.utcnow)
@@ -0,0 +1,31 @@
+from sqlalchemy import Column, Integer, ForeignKey, Date, DECIMAL, Index
+
+from pxproto.database import Base
+
+
+class AccountDailyStats(Base):
+  """
+  Обороты счета за день (UTC). Поддерживается в api.accounts.transfer,
+  пересчитывается из истории скриптом stats_rebuild.py.
+
+  Для счетов с шардами баланса у каждого шарда свои строки (shard), а shard 0 - account.balance:
+  зачисление на шард не блокирует общую строку дня. Баланс счета на конец дня - сумма
+  последних closing_balance всех частей (см. AccountStatsDAO.get_days).
+  """
+  __tablename__ = "account_daily_stats"
+
+  account_id = Column(ForeignKey("account.id"), primary_key=True)
+  day = Column(Date, primary_key=True)
+  shard = Column(Integer, primary_key=True, autoincrement=False, default=0, server_default='0')
+
+  inflow = Column(DECIMAL(19, 2), nullable=False, default=0, server_default='0')
+  outflow = Column(DECIMAL(19, 2), nullable=False, default=0, server_default='0')
+  # Сколько раз счет участвовал в транзакциях за день
+  count = Column(Integer, nullable=False, default=0, server_default='0')
+  # Баланс части счета после последней транзакции дня
+  closing_balance = Column(DECIMAL(19, 2), nullable=False)
+
+  # Последний день каждой части до даты (AccountStatsDAO.part_balances_before)
+  __table_args__ = (
+    Index('ix_account_daily_stats_account_shard_day', 'account_id', 'shard', 'day'),
+  )
@@ -0,0 +1,120 @@
+"""
+Outbox push-уведомлений (models.NotificationOutbox).
+
+Операция записывает уведомления в своей транзакции (enqueue), а отправляет их фоновая задача
+после коммита: HTTP-запросы к push-сервисам не держат блокировки строк и не задерживают ответ.
+После коммита задача этого воркера будится сразу, остальные подбирают сообщения по таймеру
+(в т.ч. оставшиеся после падения процесса).
+"""
+import asyncio
+import json
+import os
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+import database
+from dao.outbox import NotificationOutboxDAO
+from dao.push_service import PushService
+from push_delivery import Delivery
+from logger import logger
+
+NOTIFY_OUTBOX_BATCH = int(os.getenv('NOTIFY_OUTBOX_BATCH', 100))
+NOTIFY_OUTBOX_POLL_INTERVAL = float(os.getenv('NOTIFY_OUTBOX_POLL_INTERVAL', 5))
+NOTIFY_RETRY_DELAY = float(os.getenv('NOTIFY_RETRY_DELAY', 30))
+NOTIFY_MAX_ATTEMPTS = int(os.getenv('NOTIFY_MAX_ATTEMPTS', 5))
+
+_wakeup = asyncio.Event()
+
+
+async def enqueue(session: AsyncSession, messages: list[tuple[int, str, str]]):
+  """Уведомления (user_id, title, body) уйдут после коммита session; при откате - не уйдут"""
+  if not messages:
+    return
+  await NotificationOutboxDAO.add_many(session, messages)
+  database.on_commit(session, _wake)
+
+
+async def _wake():
+  _wakeup.set()
+
+
+async def dispatch_pending() -> int:
+  """
+  Отправляет одну порцию сообщений. Соединение с БД не держится на время отправки:
+  сообщения и подписки читаются до нее, а результаты записываются после в новой транзакции.
+  Доставленные сообщения удаляются; частично доставленное заменяется копиями для подписок,
+  на которые отправить не удалось; после NOTIFY_MAX_ATTEMPTS попыток сообщение отбрасывается.
+
+  :returns: сколько сообщений было взято
+  """
+  async with database.SessionLocal() as session:
+    messages = await NotificationOutboxDAO.claim(session, NOTIFY_OUTBOX_BATCH, NOTIFY_RETRY_DELAY)
+    subs = await PushService.get_many(
+      session,
+      user_ids=(message.user_id for message in messages if message.subscription_id is None),
+      ids=(message.subscription_id for message in messages if message.subscription_id is not None)
+    )
+    await session.commit()
+  if not messages:
+    return 0
+
+  by_user, by_id = {}, {}
+  for sub in subs:
+    by_user.setdefault(sub.user_id, []).append(sub)
+    by_id[sub.id] = sub
+
+  sends = []
+  for message in messages:
+    if message.subscription_id is None:
+      targets = by_user.get(message.user_id, ())
+    else:
+      # Подписки уже нет - сообщение считается доставленным
+      targets = [by_id[message.subscription_id]] if message.subscription_id in by_id else ()
+    payload = json.dumps({'title': message.title, 'body': message.body})
+    sends.extend((message, payload, sub) for sub in targets)
+
+  results = await PushService.deliver([(payload, sub) for _, payload, sub in sends])
+
+  failed = {message.id: [] for message in messages}
+  sent = {message.id: 0 for message in messages}
+  expired = set()
+  for (message, _, sub), result in zip(sends, results):
+    if result is Delivery.FAILED:
+      failed[message.id].append(sub.id)
+    else:
+      sent[message.id] += 1
+      if result is Delivery.EXPIRED:
+        expired.add(sub.id)
+
+  async with database.SessionLocal() as session:
+    done = []
+    for message in messages:
+      if not failed[message.id]:
+        done.append(message.id)
+      elif message.attempts >= NOTIFY_MAX_ATTEMPTS:
+        logger.error(f"Dropping notification {message.id} for user {message.user_id} "
+                     f"after {message.attempts} attempts")
+        done.append(message.id)
+      elif sent[message.id]:
+        # Повторять только на подписки, на которые отправить не удалось
+        await NotificationOutboxDAO.narrow(session, message, failed[message.id])
+
+    await NotificationOutboxDAO.delete_many(session, done)
+    await PushService.delete_many(session, expired)
+    await session.commit()
+  return len(messages)
+
+
+async def dispatch_loop():
+  while True:
+    _wakeup.clear()
+    try:
+      while await dispatch_pending() >= NOTIFY_OUTBOX_BATCH:
+        pass
+    except Exception as e:
+      logger.error(f"Error dispatching notifications: {e}", exc_info=e)
+
+    try:
+      await asyncio.wait_for(_wakeup.wait(), NOTIFY_OUTBOX_POLL_INTERVAL)
+    except asyncio.TimeoutError:
+      pass
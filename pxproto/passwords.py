@@ -0,0 +1,89 @@
+"""
+Хеширование и проверка паролей bcrypt вне event loop.
+
+bcrypt специально медленный (~250 мс), поэтому выполняется в отдельном пуле потоков
+(bcrypt отпускает GIL), а количество одновременных входов ограничено.
+"""
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import bcrypt
+
+from pxws.error_with_data import ProtocolError
+
+PASSWORD_WORKERS = int(os.getenv('PASSWORD_WORKERS', 2))
+# Сколько входов одновременно проверяют пароль и сколько могут ждать своей очереди
+LOGIN_CONCURRENCY = int(os.getenv('LOGIN_CONCURRENCY', 4))
+LOGIN_QUEUE_LIMIT = int(os.getenv('LOGIN_QUEUE_LIMIT', 64))
+
+_executor = ThreadPoolExecutor(max_workers=PASSWORD_WORKERS, thread_name_prefix='bcrypt')
+_login_slots = asyncio.Semaphore(LOGIN_CONCURRENCY)
+
+# Обновляются только в event loop: потоки пула счетчики не трогают
+_stats = {
+  # Отправлено в пул и еще не дождались результата (в очереди пула или выполняется)
+  'in_pool': 0,
+  'completed': 0,
+  'login_waiting': 0,
+  'login_rejected': 0,
+}
+
+
+def _hash(password: str) -> bytes:
+  return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt())
+
+
+def _check(password: str, hashed_password: str | bytes) -> bool:
+  if isinstance(hashed_password, str):
+    hashed_password = hashed_password.encode('utf-8')
+  return bcrypt.checkpw(password.encode('utf-8'), hashed_password)
+
+
+async def _run(func, *args):
+  _stats['in_pool'] += 1
+  try:
+    return await asyncio.get_running_loop().run_in_executor(_executor, func, *args)
+  finally:
+    # И при отмене ожидающей корутины
+    _stats['in_pool'] -= 1
+    _stats['completed'] += 1
+
+
+async def hash_password(password: str) -> bytes:
+  return await _run(_hash, password)
+
+
+async def check_password(password: str, hashed_password: str | bytes) -> bool:
+  return await _run(_check, password, hashed_password)
+
+
+async def check_login_password(password: str, hashed_password: str | bytes) -> bool:
+  """Проверка пароля при входе: не больше LOGIN_CONCURRENCY одновременно, лишние сразу отклоняются"""
+  if _stats['login_waiting'] >= LOGIN_QUEUE_LIMIT:
+    _stats['login_rejected'] += 1
+    raise ProtocolError('Слишком много попыток входа, попробуйте позже')
+
+  _stats['login_waiting'] += 1
+  try:
+    await _login_slots.acquire()
+  finally:
+    _stats['login_waiting'] -= 1
+
+  try:
+    return await check_password(password, hashed_password)
+  finally:
+    _login_slots.release()
+
+
+def stats() -> dict:
+  """Состояние пула: глубина очереди, выполняемые и выполненные задачи"""
+  running = min(_stats['in_pool'], PASSWORD_WORKERS)
+  return {
+    'workers': PASSWORD_WORKERS,
+    'queued': _stats['in_pool'] - running,
+    'running': running,
+    'completed': _stats['completed'],
+    'login_waiting': _stats['login_waiting'],
+    'login_rejected': _stats['login_rejected'],
+  }
@@ -0,0 +1,92 @@
+"""
+Аутентифицированный пользователь соединения.
+
+Загружается при auth и хранится в ConnectionContext, чтобы обработчики не перечитывали
+строку user на каждый запрос. Версия пользователя увеличивается по событию user_changed
+(во всех воркерах), и устаревший Principal перезагружается при следующем обращении.
+"""
+import typing
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+import events
+import models
+from dao import UserDAO
+from pxws.connection_ctx import ConnectionContext
+from pxws.error_with_data import ProtocolError
+
+_PRINCIPAL_KEY = 'principal'
+
+# user_id -> версия. Нет записи - версия _base_version
+_versions: dict[int, int] = {}
+_base_version = 0
+
+
+class Principal(typing.NamedTuple):
+  id: int
+  username: str
+  is_admin: bool
+  account_limit: int
+  organization_limit: int
+  version: int
+
+  @classmethod
+  def from_user(cls, user: models.User) -> "Principal":
+    return cls.from_snapshot({
+      'user_id': user.id,
+      'username': user.username,
+      'is_admin': user.is_admin,
+      'account_limit': user.account_limit,
+      'organization_limit': user.organization_limit,
+    })
+
+  @classmethod
+  def from_snapshot(cls, snapshot: dict) -> "Principal":
+    return cls(
+      id=snapshot['user_id'],
+      username=snapshot['username'],
+      is_admin=bool(snapshot['is_admin']),
+      account_limit=snapshot['account_limit'],
+      organization_limit=snapshot['organization_limit'],
+      version=_versions.get(snapshot['user_id'], _base_version),
+    )
+
+  @property
+  def is_stale(self) -> bool:
+    return self.version != _versions.get(self.id, _base_version)
+
+
+def set_principal(ctx: ConnectionContext, principal: Principal) -> None:
+  ctx.set_metadata(_PRINCIPAL_KEY, principal)
+
+
+async def get_principal(session: AsyncSession, ctx: ConnectionContext) -> Principal:
+  """Текущий пользователь соединения. Запрос в БД только если Principal еще не загружен или устарел"""
+  principal: typing.Optional[Principal] = ctx.get_metadata(_PRINCIPAL_KEY)
+  if principal is not None and not principal.is_stale:
+    return principal
+
+  user = await UserDAO.get_user(session, ctx.get_metadata('user_id'))
+  if not user:
+    raise ProtocolError('Пользователь не найден')
+
+  principal = Principal.from_user(user)
+  set_principal(ctx, principal)
+  return principal
+
+
+def _on_user_changed(message: dict) -> None:
+  user_id = message['user']
+  if isinstance(user_id, int):
+    _versions[user_id] = _versions.get(user_id, _base_version) + 1
+
+
+def _on_bus_reconnected(message: dict) -> None:
+  """Устаревают все Principal: новая версия больше любой выданной"""
+  global _base_version
+  _base_version = max(_versions.values(), default=_base_version) + 1
+  _versions.clear()
+
+
+events.listen('user_changed', _on_user_changed)
+events.listen('bus_reconnected', _on_bus_reconnected)
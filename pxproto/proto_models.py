@@ -1,22 +1,55 @@
-from typing import Optional
+from datetime import date
+from typing import Literal, Optional
 from typing import TYPE_CHECKING
 
-from pydantic import BaseModel, constr
+from pydantic import BaseModel, condecimal, conlist, constr
 
-from config import TRANSACTION_COMMENT_MAX_LENGTH
+from config import TRANSACTION_COMMENT_MAX_LENGTH, TRANSFER_BATCH_MAX_ITEMS, IDEMPOTENCY_KEY_MAX_LENGTH
 
 if TYPE_CHECKING:
   pass
 
+# Сумма перевода: Decimal из строки числа, без артефактов float. Точность - как у DECIMAL(19, 2) в БД
+Amount = condecimal(max_digits=19, decimal_places=2)
+
 
 class TransferBaseModel(BaseModel):
   from_account_id: int
 
-  amount: float
+  amount: Amount
   comment: Optional[constr(max_length=TRANSACTION_COMMENT_MAX_LENGTH)] = None
+  # Повтор запроса с тем же ключом возвращает ответ первого, не выполняя перевод снова
+  idempotency_key: Optional[constr(min_length=1, max_length=IDEMPOTENCY_KEY_MAX_LENGTH)] = None
 
 class TransferByNumberModel(TransferBaseModel):
   to_account_number: str
 
 class TransferBetweenModel(TransferBaseModel):
-  to_account_id: int
\ No newline at end of file
+  to_account_id: int
+
+class TransferBatchItemModel(BaseModel):
+  to_account_number: str
+  amount: Amount
+  comment: Optional[constr(max_length=TRANSACTION_COMMENT_MAX_LENGTH)] = None
+
+class TransferBatchModel(BaseModel):
+  from_account_id: int
+  transfers: conlist(TransferBatchItemModel, min_length=1, max_length=TRANSFER_BATCH_MAX_ITEMS)
+  idempotency_key: Optional[constr(min_length=1, max_length=IDEMPOTENCY_KEY_MAX_LENGTH)] = None
+
+class AccountStatsModel(BaseModel):
+  account_id: int
+  # По умолчанию - последние 30 дней
+  date_from: Optional[date] = None
+  date_to: Optional[date] = None
+  group: Literal['day', 'month'] = 'day'
+
+
+class ExportTransactionsModel(BaseModel):
+  # Ровно одно из двух
+  username: Optional[str] = None
+  org_id: Optional[int] = None
+  format: Literal['json', 'csv'] = 'json'
+  # По умолчанию - последний год
+  date_from: Optional[date] = None
+  date_to: Optional[date] = None
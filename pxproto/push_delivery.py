@@ -0,0 +1,149 @@
+"""
+Доставка Web Push.
+
+Шифрование сообщения (ECDH + AES-GCM в WebPush.get) выполняется в пуле потоков, а не в event loop.
+Запросы к push-сервисам идут через один долгоживущий HTTP-клиент с пулом соединений:
+всего не больше PUSH_CONCURRENCY одновременных запросов, к одному сервису - PUSH_HOST_CONCURRENCY.
+"""
+import asyncio
+import base64
+import enum
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+import aiohttp
+import webpush
+from cryptography.hazmat.primitives.asymmetric import ec
+import webpush.types
+from webpush import WebPush
+
+from logger import logger
+
+VAPID_PRIVATE_CERT = os.getenv("VAPID_PRIVATE_CERT")
+VAPID_PUBLIC_CERT = os.getenv("VAPID_PUBLIC_CERT")
+
+PUSH_ENCRYPT_WORKERS = int(os.getenv('PUSH_ENCRYPT_WORKERS', 2))
+PUSH_CONCURRENCY = int(os.getenv('PUSH_CONCURRENCY', 100))
+PUSH_HOST_CONCURRENCY = int(os.getenv('PUSH_HOST_CONCURRENCY', 10))
+PUSH_TIMEOUT = float(os.getenv('PUSH_TIMEOUT', 10))
+
+wp = WebPush(
+  private_key=VAPID_PRIVATE_CERT.encode('utf-8'),
+  public_key=VAPID_PUBLIC_CERT.encode('utf-8'),
+  subscriber='me@pyxiion.ru'
+)
+
+_executor = ThreadPoolExecutor(max_workers=PUSH_ENCRYPT_WORKERS, thread_name_prefix='webpush')
+_client: Optional[aiohttp.ClientSession] = None
+_started_at = time.monotonic()
+
+_stats = {
+  'encrypt_queued': 0,
+  'in_flight': 0,
+  'sent': 0,
+  'failed': 0,
+  'expired': 0,
+}
+
+
+class Delivery(enum.Enum):
+  SENT = 'sent'
+  FAILED = 'failed'
+  # Подписка больше не действует (404/410), ее нужно удалить
+  EXPIRED = 'expired'
+
+
+def _client_session() -> aiohttp.ClientSession:
+  """Общий клиент создается в event loop воркера при первой отправке"""
+  global _client
+  if _client is None or _client.closed:
+    _client = aiohttp.ClientSession(
+      connector=aiohttp.TCPConnector(limit=PUSH_CONCURRENCY, limit_per_host=PUSH_HOST_CONCURRENCY),
+      timeout=aiohttp.ClientTimeout(total=PUSH_TIMEOUT),
+    )
+  return _client
+
+
+def _decode_key(key: str) -> bytes:
+  if not isinstance(key, str):
+    raise ValueError('key must be a string')
+  return base64.urlsafe_b64decode(key + '=' * (-len(key) % 4))
+
+
+def validate_subscription(endpoint: str, p256dh: str, auth: str):
+  """
+  Проверяет подписку от клиента: endpoint - http(s) URL, p256dh - точка кривой P-256,
+  auth - 16 байт (RFC 8291), ключи в base64url. Иначе ValueError
+  """
+  webpush.WebPushSubscription(endpoint=endpoint, keys=webpush.types.WebPushKeys(auth=auth, p256dh=p256dh))
+  ec.EllipticCurvePublicKey.from_encoded_point(ec.SECP256R1(), _decode_key(p256dh))
+  if len(_decode_key(auth)) != 16:
+    raise ValueError('auth secret must be 16 bytes')
+
+
+def _encrypt(data: str, endpoint: str, p256dh: str, auth: str):
+  return wp.get(data, webpush.WebPushSubscription(
+    endpoint=endpoint,
+    keys=webpush.types.WebPushKeys(
+      auth=auth,
+      p256dh=p256dh
+    )
+  ))
+
+
+async def send(data: str, endpoint: str, p256dh: str, auth: str) -> Delivery:
+  """Не бросает исключений: любая ошибка отправки - FAILED, недействительные ключи подписки - EXPIRED"""
+  result = await _send(data, endpoint, p256dh, auth)
+  _stats[result.value] += 1
+  return result
+
+
+async def _send(data: str, endpoint: str, p256dh: str, auth: str) -> Delivery:
+  _stats['encrypt_queued'] += 1
+  try:
+    msg = await asyncio.get_running_loop().run_in_executor(_executor, _encrypt, data, endpoint, p256dh, auth)
+  except ValueError as e:
+    # Ключи или endpoint не разбираются (в т.ч. ошибки base64 и pydantic): повтор не поможет
+    logger.warning(f"Push subscription {endpoint} is invalid: {e!r}")
+    return Delivery.EXPIRED
+  except Exception as e:
+    logger.error(f"Push to {endpoint} failed to encrypt: {e!r}", exc_info=e)
+    return Delivery.FAILED
+  finally:
+    _stats['encrypt_queued'] -= 1
+
+  _stats['in_flight'] += 1
+  try:
+    async with _client_session().post(endpoint, data=msg.encrypted, headers=msg.headers) as response:
+      if response.status in (404, 410):
+        return Delivery.EXPIRED
+      if response.status >= 400:
+        logger.warning(f"Push to {response.url.host} rejected: HTTP {response.status}")
+        return Delivery.FAILED
+      return Delivery.SENT
+  except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+    logger.warning(f"Push to {endpoint} failed: {e!r}")
+    return Delivery.FAILED
+  except Exception as e:
+    logger.error(f"Push to {endpoint} failed: {e!r}", exc_info=e)
+    return Delivery.FAILED
+  finally:
+    _stats['in_flight'] -= 1
+
+
+async def close():
+  if _client is not None:
+    await _client.close()
+
+
+def stats() -> dict:
+  """Очередь шифрования, запросы в полете и итоги отправки с запуска воркера"""
+  uptime = time.monotonic() - _started_at
+  return {
+    'encrypt_workers': PUSH_ENCRYPT_WORKERS,
+    'host_concurrency': PUSH_HOST_CONCURRENCY,
+    'uptime': uptime,
+    'sent_per_second': _stats['sent'] / uptime if uptime else 0.0,
+  } | _stats
@@ -0,0 +1,216 @@
+import asyncio
+import typing
+from typing import Any, Optional
+
+from .codec import JsonCodec
+from .logger import logger
+
+BusHandler = typing.Callable[[Any], typing.Awaitable[Any]]
+ReconnectHandler = typing.Callable[[], typing.Awaitable[Any]]
+
+_codec = JsonCodec()
+
+
+class EventBus:
+  """
+  Шина событий между процессами-воркерами.
+  Сообщение получают все подписанные процессы, включая отправителя.
+  """
+
+  async def start(self, handler: BusHandler, on_reconnect: Optional[ReconnectHandler] = None) -> None:
+    """
+    Начинает получать сообщения и передавать их в handler.
+
+    :param on_reconnect: вызывается после восстановления соединения с шиной:
+      сообщения, отправленные за время разрыва, потеряны
+    """
+    raise NotImplementedError
+
+  async def publish(self, message: Any) -> None:
+    raise NotImplementedError
+
+  async def close(self) -> None:
+    pass
+
+
+class InMemoryBus(EventBus):
+  """Для одного процесса: сообщение сразу уходит в обработчик"""
+
+  def __init__(self):
+    self._handler: Optional[BusHandler] = None
+
+  async def start(self, handler: BusHandler, on_reconnect: Optional[ReconnectHandler] = None) -> None:
+    self._handler = handler
+
+  async def publish(self, message: Any) -> None:
+    if self._handler is not None:
+      await self._handler(message)
+
+
+class LocalBroker:
+  """
+  Брокер на Unix-сокете: пересылает каждую строку всем подключенным процессам.
+  Заменяет Redis, когда воркеры живут на одной машине, и в тестах.
+  """
+
+  def __init__(self, path: str):
+    self.path = path
+    self._clients: set[asyncio.StreamWriter] = set()
+    self._server: Optional[asyncio.AbstractServer] = None
+
+  async def start(self) -> None:
+    self._server = await asyncio.start_unix_server(self._on_client, self.path)
+
+  async def serve_forever(self) -> None:
+    if self._server is None:
+      await self.start()
+    await self._server.serve_forever()
+
+  async def _on_client(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+    self._clients.add(writer)
+    try:
+      while line := await reader.readline():
+        for client in list(self._clients):
+          try:
+            client.write(line)
+          except (ConnectionError, RuntimeError):
+            self._clients.discard(client)
+        await asyncio.gather(*(client.drain() for client in self._clients), return_exceptions=True)
+    finally:
+      self._clients.discard(writer)
+      writer.close()
+
+
+class LocalSocketBus(EventBus):
+  """Клиент LocalBroker. После разрыва переподключается с экспоненциальной задержкой"""
+
+  def __init__(self, path: str, reconnect_delay: float = 0.1, max_reconnect_delay: float = 5):
+    self.path = path
+    self.reconnect_delay = reconnect_delay
+    self.max_reconnect_delay = max_reconnect_delay
+    self._writer: Optional[asyncio.StreamWriter] = None
+    self._reader_task: Optional[asyncio.Task] = None
+
+  async def start(self, handler: BusHandler, on_reconnect: Optional[ReconnectHandler] = None) -> None:
+    reader, self._writer = await asyncio.open_unix_connection(self.path)
+    self._reader_task = asyncio.create_task(self._read(reader, handler, on_reconnect))
+
+  async def _connect(self) -> asyncio.StreamReader:
+    delay = self.reconnect_delay
+    while True:
+      try:
+        reader, self._writer = await asyncio.open_unix_connection(self.path)
+        return reader
+      except OSError as e:
+        logger.warning(f"Event bus unavailable: {e!r}, retry in {delay:.1f}s")
+        await asyncio.sleep(delay)
+        delay = min(delay * 2, self.max_reconnect_delay)
+
+  async def _read(self, reader: asyncio.StreamReader, handler: BusHandler,
+                  on_reconnect: Optional[ReconnectHandler]):
+    while True:
+      try:
+        while line := await reader.readline():
+          try:
+            await handler(_codec.loads(line))
+          except Exception as e:
+            logger.error(f"Error handling bus message: {e}", exc_info=e)
+      except (ConnectionError, ValueError) as e:
+        logger.error(f"Event bus read failed: {e!r}")
+
+      logger.error("Event bus connection closed, reconnecting")
+      self._writer.close()
+      reader = await self._connect()
+      logger.info("Event bus reconnected")
+      if on_reconnect is not None:
+        try:
+          await on_reconnect()
+        except Exception as e:
+          logger.error(f"Error handling bus reconnect: {e}", exc_info=e)
+
+  async def publish(self, message: Any) -> None:
+    self._writer.write(_codec.dumps(message).encode('utf-8') + b'\n')
+    await self._writer.drain()
+
+  async def close(self) -> None:
+    if self._reader_task is not None:
+      self._reader_task.cancel()
+    if self._writer is not None:
+      self._writer.close()
+
+
+class RedisBus(EventBus):
+  """Redis pub/sub. Требует пакет redis. После разрыва переподписывается с экспоненциальной задержкой"""
+
+  def __init__(self, url: str, channel: str = 'pxws', reconnect_delay: float = 0.1, max_reconnect_delay: float = 5):
+    import redis.asyncio
+    self._redis = redis.asyncio.from_url(url)
+    self._channel = channel
+    self.reconnect_delay = reconnect_delay
+    self.max_reconnect_delay = max_reconnect_delay
+    self._pubsub = None
+    self._reader_task: Optional[asyncio.Task] = None
+
+  async def start(self, handler: BusHandler, on_reconnect: Optional[ReconnectHandler] = None) -> None:
+    self._pubsub = self._redis.pubsub()
+    await self._pubsub.subscribe(self._channel)
+    self._reader_task = asyncio.create_task(self._read(handler, on_reconnect))
+
+  async def _resubscribe(self) -> None:
+    import redis.exceptions
+    delay = self.reconnect_delay
+    while True:
+      try:
+        # Команда заново открывает соединение pubsub
+        await self._pubsub.subscribe(self._channel)
+        return
+      except (redis.exceptions.ConnectionError, OSError) as e:
+        logger.warning(f"Event bus unavailable: {e!r}, retry in {delay:.1f}s")
+        await asyncio.sleep(delay)
+        delay = min(delay * 2, self.max_reconnect_delay)
+
+  async def _read(self, handler: BusHandler, on_reconnect: Optional[ReconnectHandler]):
+    import redis.exceptions
+    while True:
+      try:
+        async for message in self._pubsub.listen():
+          if message['type'] != 'message':
+            continue
+          try:
+            await handler(_codec.loads(message['data']))
+          except Exception as e:
+            logger.error(f"Error handling bus message: {e}", exc_info=e)
+      except (redis.exceptions.ConnectionError, OSError) as e:
+        logger.error(f"Event bus connection lost: {e!r}, reconnecting")
+
+      await self._resubscribe()
+      logger.info("Event bus reconnected")
+      if on_reconnect is not None:
+        try:
+          await on_reconnect()
+        except Exception as e:
+          logger.error(f"Error handling bus reconnect: {e}", exc_info=e)
+
+  async def publish(self, message: Any) -> None:
+    await self._redis.publish(self._channel, _codec.dumps(message))
+
+  async def close(self) -> None:
+    if self._reader_task is not None:
+      self._reader_task.cancel()
+    if self._pubsub is not None:
+      await self._pubsub.aclose()
+    await self._redis.aclose()
+
+
+def create_bus(kind: str, url: Optional[str] = None) -> EventBus:
+  """
+  :param kind: memory, local (Unix-сокет LocalBroker) или redis
+  :param url: путь к сокету или URL Redis
+  """
+  if kind == 'memory':
+    return InMemoryBus()
+  if kind == 'local':
+    return LocalSocketBus(url)
+  if kind == 'redis':
+    return RedisBus(url)
+  raise ValueError(f"Unknown event bus '{kind}'")
@@ -0,0 +1,205 @@
+import base64
+import datetime
+import decimal
+import enum
+import json
+import typing
+from typing import Any, Optional
+
+from pydantic import BaseModel
+
+from .error_with_data import ProtocolError
+
+
+class RequestEnvelope(typing.NamedTuple):
+  """Конверт запроса. То же, что base_models.Request, но без валидации pydantic"""
+  type: str
+  id: str
+  data: Optional[Any] = None
+
+
+class EnvelopeError(ProtocolError):
+  def __init__(self):
+    ProtocolError.__init__(self, 'JSON validation error')
+
+
+def _default(obj):
+  """Сериализация типов, которые JSON не поддерживает напрямую (как это делал pydantic)"""
+  if isinstance(obj, BaseModel):
+    return obj.model_dump(mode='json')
+  if isinstance(obj, decimal.Decimal):
+    return str(obj)
+  if isinstance(obj, enum.Enum):
+    return obj.value
+  if isinstance(obj, (datetime.datetime, datetime.date, datetime.time)):
+    return obj.isoformat()
+  if isinstance(obj, (bytes, bytearray, memoryview)):
+    return base64.b64encode(obj).decode('ascii')
+  if isinstance(obj, (set, frozenset, tuple)):
+    return list(obj)
+  raise TypeError(f'Object of type {type(obj).__name__} is not serializable')
+
+
+def _envelope_from_dict(request_data) -> RequestEnvelope:
+  if not isinstance(request_data, dict):
+    raise EnvelopeError()
+
+  type_ = request_data.get('type')
+  id_ = request_data.get('id')
+  if not isinstance(type_, str) or not isinstance(id_, str):
+    raise EnvelopeError()
+
+  return RequestEnvelope(type_, id_, request_data.get('data'))
+
+
+class Codec:
+  """
+  Кодек протокола pxws.
+  Разбирает входящие кадры прямо в RequestEnvelope и кодирует ответы без промежуточных моделей pydantic.
+  """
+  name: str = ''
+  # Отправлять ли закодированные кадры текстовыми фреймами
+  text: bool = True
+  # Исключения loads для некорректного кадра: клиенту уходит EnvelopeError
+  decode_errors: tuple[type[Exception], ...] = (ValueError,)
+
+  def loads(self, message: str | bytes) -> Any:
+    raise NotImplementedError
+
+  def dumps(self, obj: Any) -> str | bytes:
+    raise NotImplementedError
+
+  def decode_request(self, message: str | bytes) -> RequestEnvelope:
+    try:
+      request_data = self.loads(message)
+    except self.decode_errors:
+      raise EnvelopeError()
+    return _envelope_from_dict(request_data)
+
+  def encode_success(self, request_id: str, data: Any, ttl: Optional[float] = None) -> str | bytes:
+    response = {'status': 'ok'}
+    if data is not None:
+      response['data'] = data
+    response['id'] = request_id
+    if ttl is not None:
+      response['ttl'] = ttl
+    return self.dumps(response)
+
+  def encode_partial(self, request_id: str, data: Any) -> str | bytes:
+    """Часть ответа: обработчик может отправить их несколько до итогового ok/error"""
+    return self.dumps({'status': 'partial', 'data': data, 'id': request_id})
+
+  def encode_error(self, request_id: str, error: str, data: Optional[dict] = None) -> str | bytes:
+    response = {'status': 'error', 'error': error, 'id': request_id}
+    if data is not None:
+      response['data'] = data
+    return self.dumps(response)
+
+
+class JsonCodec(Codec):
+  """Стандартный json"""
+  name = 'json'
+
+  def __init__(self):
+    self._decoder = json.JSONDecoder()
+    self._encoder = json.JSONEncoder(ensure_ascii=False, separators=(',', ':'), default=_default)
+
+  def loads(self, message: str | bytes) -> Any:
+    if isinstance(message, (bytes, bytearray)):
+      message = message.decode('utf-8')
+    return self._decoder.decode(message)
+
+  def dumps(self, obj: Any) -> str:
+    return self._encoder.encode(obj)
+
+
+class OrjsonCodec(Codec):
+  """orjson. Возвращает bytes, которые отправляются текстовым фреймом без декодирования"""
+  name = 'orjson'
+
+  def __init__(self):
+    import orjson
+    self._orjson = orjson
+    self._options = orjson.OPT_NON_STR_KEYS
+
+  def loads(self, message: str | bytes) -> Any:
+    return self._orjson.loads(message)
+
+  def dumps(self, obj: Any) -> bytes:
+    return self._orjson.dumps(obj, default=_default, option=self._options)
+
+
+class MsgspecCodec(Codec):
+  """msgspec.json. Конверт запроса разбирается сразу в структуру, без промежуточного dict"""
+  name = 'msgspec'
+
+  def __init__(self):
+    import msgspec
+
+    class _Request(msgspec.Struct):
+      type: str
+      id: str
+      data: Any = None
+
+    self._msgspec = msgspec
+    self.decode_errors = (ValueError, msgspec.DecodeError)
+    self._request_decoder = msgspec.json.Decoder(_Request)
+    self._decoder = msgspec.json.Decoder()
+    self._encoder = msgspec.json.Encoder(enc_hook=_default)
+
+  def loads(self, message: str | bytes) -> Any:
+    return self._decoder.decode(message)
+
+  def dumps(self, obj: Any) -> bytes:
+    return self._encoder.encode(obj)
+
+  def decode_request(self, message: str | bytes) -> RequestEnvelope:
+    try:
+      request = self._request_decoder.decode(message)
+    except (self._msgspec.DecodeError, self._msgspec.ValidationError):
+      raise EnvelopeError()
+    return RequestEnvelope(request.type, request.id, request.data)
+
+
+class MsgpackCodec(Codec):
+  """
+  MessagePack для бинарного подпротокола pxws.msgpack.
+  Конверты те же, что и в JSON, но bytes передаются как есть, без base64.
+  """
+  name = 'msgpack'
+  text = False
+
+  def __init__(self):
+    import msgpack
+    self._msgpack = msgpack
+    # Обрезанный кадр (OutOfData в чистой Python-реализации), неизвестный формат,
+    # а TypeError - ключ map, который нельзя положить в dict (например, массив)
+    self.decode_errors = (ValueError, TypeError, msgpack.UnpackException)
+    self._packer = msgpack.Packer(default=_default, use_bin_type=True)
+
+  def loads(self, message: str | bytes) -> Any:
+    if isinstance(message, str):
+      raise ValueError('Text frame in binary subprotocol')
+    return self._msgpack.unpackb(message, raw=False, strict_map_key=False)
+
+  def dumps(self, obj: Any) -> bytes:
+    return self._packer.pack(obj)
+
+
+_CODECS: dict[str, type[Codec]] = {
+  JsonCodec.name: JsonCodec,
+  OrjsonCodec.name: OrjsonCodec,
+  MsgspecCodec.name: MsgspecCodec,
+  MsgpackCodec.name: MsgpackCodec,
+}
+
+
+def get_codec(name: str) -> Codec:
+  """Создает кодек по имени. orjson, msgspec и msgpack - необязательные зависимости"""
+  if name not in _CODECS:
+    raise ValueError(f"Unknown codec '{name}', expected one of {list(_CODECS)}")
+
+  try:
+    return _CODECS[name]()
+  except ImportError as e:
+    raise RuntimeError(f"Codec '{name}' requires package '{e.name}' to be installed") from e
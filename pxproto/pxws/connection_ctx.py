@@ -1,4 +1,6 @@
+import asyncio
 import typing
+from contextvars import ContextVar
 from typing import Any, Optional, Dict
 
 from websockets import ServerConnection
@@ -6,6 +8,11 @@ from websockets import ServerConnection
 if typing.TYPE_CHECKING:
   from .server import Server
 
+# TTL ответа на текущий запрос. Живет в контексте задачи, поэтому параллельные запросы не мешают друг другу
+response_ttl: ContextVar[Optional[float]] = ContextVar('response_ttl', default=None)
+# ID обрабатываемого запроса, для частичных ответов
+current_request_id: ContextVar[Optional[str]] = ContextVar('current_request_id', default=None)
+
 
 class ConnectionContext:
   """Контекст соединения для хранения метаданных, включая аутентификацию"""
@@ -13,9 +20,15 @@ class ConnectionContext:
   def __init__(self, server: "Server", connection: ServerConnection):
     self.server = server
     self.connection = connection
+    self.codec = server.codec_for(connection.subprotocol)
     self._authenticated = False
     self._auth_data: Optional[Any] = None
     self._metadata: Dict[str, Any] = {}
+    self._user_id: Optional[Any] = None
+    # Топики, на которые подписано соединение (см. Server.subscribe)
+    self.topics: set[str] = set()
+    # Очередь для обработчиков с serial=True
+    self.serial_lock = asyncio.Lock()
 
   @property
   def is_authenticated(self) -> bool:
@@ -27,15 +40,25 @@ class ConnectionContext:
     """Возвращает данные аутентификации"""
     return self._auth_data
 
-  def set_authenticated(self, auth_data: Any = None) -> None:
-    """Помечает соединение как аутентифицированное"""
+  @property
+  def user_id(self) -> Optional[Any]:
+    """Пользователь, к которому привязано соединение"""
+    return self._user_id
+
+  def set_authenticated(self, auth_data: Any = None, *, user_id: Optional[Any] = None) -> None:
+    """
+    Помечает соединение как аутентифицированное.
+    Если указан user_id, соединение попадает в индекс сервера для рассылок пользователю.
+    """
     self._authenticated = True
     self._auth_data = auth_data
+    self.server._bind_user(self, user_id)
 
   def set_unauthenticated(self) -> None:
     """Помечает соединение как неаутентифицированное"""
     self._authenticated = False
     self._auth_data = None
+    self.server._bind_user(self, None)
 
   def set_metadata(self, key: str, value: Any) -> None:
     """Устанавливает метаданные соединения"""
@@ -45,5 +68,27 @@ class ConnectionContext:
     """Получает метаданные соединения"""
     return self._metadata.get(key, default)
 
+  async def send(self, payload: Any) -> None:
+    """Отправляет серверное сообщение (не ответ на запрос), кодируя его кодеком сервера"""
+    await self.send_frame(self.codec.dumps(payload))
+
+  async def send_frame(self, frame: str | bytes) -> None:
+    """Отправляет уже закодированный кадр"""
+    await self.connection.send(frame, text=self.codec.text)
+
+  async def send_partial(self, data: Any) -> None:
+    """
+    Отправляет часть ответа на обрабатываемый запрос (status: partial, тот же id).
+    Итоговый ответ обработчика завершает поток частей.
+    """
+    request_id = current_request_id.get()
+    if request_id is None:
+      raise RuntimeError('send_partial called outside of a request handler')
+    await self.send_frame(self.codec.encode_partial(request_id, data))
+
+  def set_response_ttl(self, ttl: Optional[float]) -> None:
+    """Устанавливает TTL ответа на обрабатываемый запрос"""
+    response_ttl.set(ttl)
+
   def __str__(self):
     return f'[ConnectionContext, is_authenticated:{self.is_authenticated}, meta: {self._metadata}]'
\ No newline at end of file
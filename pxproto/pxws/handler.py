@@ -1,11 +1,144 @@
 import inspect
 import typing
 from functools import wraps
+from typing import get_origin
 
 from pydantic import BaseModel
 
 from pxws.logger import logger
 
+ResponseSerializer = typing.Callable[[typing.Any], typing.Any]
+
+
+def _is_pydantic_model(type_) -> bool:
+  """Проверяет, является ли тип моделью Pydantic"""
+  try:
+    return isinstance(type_, type) and issubclass(type_, BaseModel)
+  except TypeError:
+    return False
+
+
+def _identity(result):
+  return result
+
+
+def compile_serializer(response_model) -> ResponseSerializer:
+  """
+  Строит функцию подготовки данных ответа по аннотации возвращаемого типа.
+  Разбор типа выполняется один раз при регистрации, а не на каждый запрос.
+  """
+  # Если модель ответа не указана, возвращаем как есть
+  if response_model is None:
+    return _identity
+
+  origin_type = get_origin(response_model) or response_model
+
+  # Optional[Type]
+  if origin_type is typing.Union:
+    args = typing.get_args(response_model)
+    if type(None) in args:  # Это Optional
+      actual_type = next(arg for arg in args if arg is not type(None))
+      inner = compile_serializer(actual_type)
+      if inner is _identity:
+        return _identity
+      return lambda result: None if result is None else inner(result)
+
+  # list[Type]
+  if origin_type in (list, typing.List):
+    item_type = typing.get_args(response_model)[0] if get_origin(response_model) else None
+
+    if item_type and _is_pydantic_model(item_type):
+      item = compile_serializer(item_type)
+      return lambda result: [item(x) for x in result]
+    return _identity
+
+  # dict[K, V]
+  if origin_type in (dict, typing.Dict):
+    key_type, val_type = typing.get_args(response_model) or (None, None)
+    if _is_pydantic_model(val_type):
+      value = compile_serializer(val_type)
+      return lambda result: {k: value(v) for k, v in result.items()}
+    return _identity
+
+  # Pydantic
+  if _is_pydantic_model(response_model):
+    def serialize_model(result):
+      if isinstance(result, list):
+        return result
+      if isinstance(result, response_model):
+        return result.model_dump(exclude_none=True)
+      try:
+        return response_model(**result).model_dump()
+      except Exception as e:
+        raise ValueError(f"Failed to convert result to {response_model}: {str(e)}")
+
+    return serialize_model
+
+  # Простые типы
+  return _identity
+
+
+class DispatchPlan(typing.NamedTuple):
+  """
+  Заранее подготовленный план вызова обработчика.
+
+  Всё, что раньше вычислялось рефлексией на каждое сообщение
+  (сигнатура, типы параметров, форма ответа), собирается один раз в `register_handler`.
+  """
+  func: typing.Callable
+  pass_ctx: bool
+  # (имя параметра, модель pydantic или None, значение по умолчанию или inspect.Parameter.empty)
+  params: tuple[tuple[str, typing.Optional[type[BaseModel]], typing.Any], ...]
+  # Единственный параметр получает data целиком (с валидацией, если это модель)
+  is_single: bool
+  serialize: ResponseSerializer
+
+  def bind(self, ctx, data: typing.Any) -> dict[str, typing.Any]:
+    """Собирает аргументы обработчика из data запроса"""
+    kwargs = {'ctx': ctx} if self.pass_ctx else {}
+
+    if data is None:
+      data = {}
+
+    if self.is_single:
+      # Случай 2: Один параметр-модель
+      # Ожидаем data как значение этого параметра
+      name, model, _ = self.params[0]
+      kwargs[name] = data if model is None else model.model_validate(data)
+      return kwargs
+
+    # Случай 1: Есть несколько параметров или один простой
+    # Ожидаем data в формате {param1: value1, param2: value2}
+    for name, model, default in self.params:
+      if name not in data:
+        # Необязательные параметры (с значением по умолчанию) можно не передавать
+        if default is not inspect.Parameter.empty:
+          continue
+        raise ValueError(f"Missing parameter '{name}' in request data", self.func)
+
+      kwargs[name] = data[name] if model is None else model.model_validate(data[name])
+
+    return kwargs
+
+
+def compile_plan(func: typing.Callable, expected_params: dict[str, inspect.Parameter],
+                 type_hints: dict[str, typing.Any], pass_ctx: bool) -> DispatchPlan:
+  """Компилирует обработчик в DispatchPlan"""
+  params = tuple(
+    (name, type_hints.get(name) if _is_pydantic_model(type_hints.get(name)) else None, param.default)
+    for name, param in expected_params.items()
+  )
+
+  has_pydantic_params = any(_is_pydantic_model(type_) for type_ in type_hints.values())
+
+  return DispatchPlan(
+    func=func,
+    pass_ctx=pass_ctx,
+    params=params,
+    is_single=len(params) == 1 and has_pydantic_params,
+    serialize=compile_serializer(type_hints.get('return')),
+  )
+
 
 class HandlerInfo(typing.TypedDict):
   handler: typing.Callable
@@ -15,6 +148,8 @@ class HandlerInfo(typing.TypedDict):
   has_pydantic_params: bool
   is_single_param: bool
   require_auth: bool
+  serial: bool
+  plan: DispatchPlan
 
 
 def register_handler(
@@ -22,7 +157,8 @@ def register_handler(
   type_name: str,
   func: typing.Callable,
   require_auth: bool = False,
-  ignore_params: list[str] = None
+  ignore_params: list[str] = None,
+  serial: bool = False
 ) -> typing.Callable:
   """Общая функция для регистрации обработчиков"""
 
@@ -43,7 +179,7 @@ def register_handler(
   }
 
   has_pydantic_params = any(
-    isinstance(type_, type) and issubclass(type_, BaseModel)
+    _is_pydantic_model(type_)
     for type_ in type_hints.values()
   )
 
@@ -56,6 +192,8 @@ def register_handler(
     'has_pydantic_params': has_pydantic_params,
     'is_single_param': len(expected_params) == 1,
     'require_auth': require_auth,
+    'serial': serial,
+    'plan': compile_plan(func, expected_params, type_hints, 'ctx' in parameters),
   }
 
   logger.info(f"Registered handler for '{type_name}' with params: {expected_params}")
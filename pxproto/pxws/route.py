@@ -13,12 +13,17 @@ class Route:
       self, type_name: str,
       *,
       require_auth: bool = False,
-      ignore_params: list[str] = None
+      ignore_params: list[str] = None,
+      serial: bool = False
   ):
-    """Декоратор для регистрации обработчиков"""
+    """
+    Декоратор для регистрации обработчиков
+
+    :param serial: запросы к обработчику в рамках одного соединения выполняются строго по очереди
+    """
 
     def decorator(func):
-      return register_handler(self._handlers, type_name, func, require_auth, ignore_params)
+      return register_handler(self._handlers, type_name, func, require_auth, ignore_params, serial)
 
     return decorator
 
@@ -1,47 +1,93 @@
 import asyncio
+import contextlib
 import inspect
-import json
 import logging
 import typing
 from functools import wraps
-from typing import Dict, Any, get_type_hints, get_origin, Optional, Union
+from typing import Dict, Any, Optional
 
-from pydantic import BaseModel, ValidationError
+from pydantic import ValidationError
 from websockets import ConnectionClosed
 from websockets.asyncio.server import serve
 from websockets.server import ServerConnection
 
-from .base_models import Request, ErrorResponse, SuccessResponse
-from .connection_ctx import ConnectionContext
+from .codec import Codec, JsonCodec
+from .connection_ctx import ConnectionContext, response_ttl, current_request_id
 from .error_with_data import ErrorWithData, ProtocolError
-from .handler import HandlerInfo, register_handler
+from .handler import DispatchPlan, HandlerInfo, register_handler
 from .logger import logger
 from .route import Route
 
 ConnectionHandlerType = typing.Callable[[ConnectionContext], typing.Coroutine[Any, Any, Any]]
+RequestScopeFactory = typing.Callable[[], typing.AsyncContextManager]
 
 
 class Server:
-  def __init__(self):
+  def __init__(self, max_in_flight: int = 1, codec: Optional[Codec] = None):
+    """
+    :param max_in_flight: сколько запросов одного соединения обрабатываются одновременно.
+      1 - строго последовательно, как раньше.
+    :param codec: кодек кадров, по умолчанию стандартный json
+    """
     self._ws_server = None
+    self.codec: Codec = codec or JsonCodec()
+    # Sec-WebSocket-Protocol -> кодек. Без согласованного подпротокола используется self.codec
+    self._subprotocol_codecs: Dict[str, Codec] = {}
+    self._max_in_flight = max(1, max_in_flight)
     self._connections: Dict[ServerConnection, ConnectionContext] = {}
+    # user_id -> живые соединения пользователя (вкладки, устройства)
+    self._user_connections: Dict[Any, set[ConnectionContext]] = {}
+    # топик -> подписанные соединения
+    self._topics: Dict[str, set[ConnectionContext]] = {}
     self._handlers: Dict[str, HandlerInfo] = {}
     self._connection_handler: ConnectionHandlerType | None = None
     self._auth_validator: Optional[typing.Callable[[Any], typing.Coroutine[Any, Any, bool]]] = None
-
-  async def serve_forever(self, host: str, port: int):
-    self._ws_server = await serve(self._on_connection, host, port)
+    self._request_scope: RequestScopeFactory = contextlib.nullcontext
+
+  async def serve_forever(self, host: str, port: int, **serve_kwargs):
+    """
+    :param serve_kwargs: передаются в websockets.serve,
+      например reuse_port=True, чтобы несколько процессов слушали один порт
+    """
+    self._ws_server = await serve(
+      self._on_connection, host, port,
+      subprotocols=list(self._subprotocol_codecs) or None,
+      select_subprotocol=self._select_subprotocol,
+      **serve_kwargs
+    )
     await self._ws_server.serve_forever()
 
+  def set_request_scope(self, factory: RequestScopeFactory) -> None:
+    """
+    Устанавливает фабрику асинхронного контекстного менеджера, в котором выполняется каждый обработчик.
+    Например, единая сессия БД на запрос.
+    """
+    self._request_scope = factory
+
+  def add_subprotocol(self, name: str, codec: Codec) -> None:
+    """Регистрирует подпротокол (например, pxws.msgpack), который клиент может запросить при подключении"""
+    self._subprotocol_codecs[name] = codec
+
+  def codec_for(self, subprotocol: Optional[str]) -> Codec:
+    """Возвращает кодек для согласованного подпротокола"""
+    return self._subprotocol_codecs.get(subprotocol, self.codec) if subprotocol else self.codec
+
+  def _select_subprotocol(self, connection: ServerConnection, subprotocols: typing.Sequence[str]) -> Optional[str]:
+    # Первый из предложенных клиентом, который мы знаем. Иначе - без подпротокола, т.е. JSON
+    for subprotocol in subprotocols:
+      if subprotocol in self._subprotocol_codecs:
+        return subprotocol
+    return None
+
   def set_auth_validator(self, validator: typing.Callable[[Any], typing.Coroutine[Any, Any, bool]]):
     """Устанавливает функцию для проверки аутентификации"""
     self._auth_validator = validator
 
-  def on(self, type_name: str, require_auth: bool = False):
+  def on(self, type_name: str, require_auth: bool = False, serial: bool = False):
     """Декоратор для регистрации обработчиков"""
 
     def decorator(func):
-      return register_handler(self._handlers, type_name, func, require_auth)
+      return register_handler(self._handlers, type_name, func, require_auth, serial=serial)
 
     return decorator
 
@@ -71,155 +117,195 @@ class Server:
       if self._connection_handler:
         await self._connection_handler(ctx)
 
-      async for message in connection:
-        await self._on_message(ctx, message)
+      if self._max_in_flight > 1:
+        await self._read_concurrently(ctx)
+      else:
+        async for message in connection:
+          await self._on_message(ctx, message)
     except ConnectionClosed:
       logger.info("Connection closed")
     finally:
-      self._connections.pop(connection, None)
+      self._forget(ctx)
       logger.info(f"Connection removed, total: {len(self._connections)}")
 
+  async def _read_concurrently(self, ctx: ConnectionContext):
+    """
+    Читает сообщения соединения и обрабатывает их отдельными задачами,
+    не больше max_in_flight одновременно. Ответы сопоставляются клиентом по Request.id.
+    """
+    slots = asyncio.Semaphore(self._max_in_flight)
+    in_flight: set[asyncio.Task] = set()
+
+    async def process(message):
+      try:
+        await self._on_message(ctx, message)
+      except ConnectionClosed:
+        pass
+      finally:
+        slots.release()
+
+    try:
+      async for message in ctx.connection:
+        # Пока все слоты заняты, сокет не читаем
+        await slots.acquire()
+        task = asyncio.create_task(process(message))
+        in_flight.add(task)
+        task.add_done_callback(in_flight.discard)
+    finally:
+      # Начатые запросы (например, переводы) доводим до конца
+      if in_flight:
+        await asyncio.gather(*in_flight, return_exceptions=True)
+
+  async def _invoke(self, plan: DispatchPlan, kwargs: dict) -> Any:
+    async with self._request_scope():
+      result = plan.func(**kwargs)
+      if inspect.isawaitable(result):
+        result = await result
+    return result
+
   async def _on_message(self, ctx: ConnectionContext, message: str):
+    response_ttl_token = response_ttl.set(None)
+    request_id_token = None
     try:
-      request_data = json.loads(message)
-      request = Request(**request_data)
+      request = ctx.codec.decode_request(message)
+      request_id_token = current_request_id.set(request.id)
 
       logger.info(f"\"{request.type}\" from {ctx.connection.remote_address[0]} with id {request.id}")
       # logger.debug(f"")
 
-      if request.type not in self._handlers:
+      handler_info = self._handlers.get(request.type)
+      if handler_info is None:
         raise ValueError(f"No handler for type '{request.type}'")
 
-      handler_info = self._handlers[request.type]
-      handler = handler_info['original_func']  # Используем оригинальную функцию, а не обертку
-
       # Проверка аутентификации если требуется
       if handler_info['require_auth'] and not ctx.is_authenticated:
         raise ProtocolError("Требуется авторизация")
 
-      # Подготовка аргументов для обработчика
-      kwargs = {}
-      if request.data is None:
-        request.data = {}
-
-      # Проверяем, ожидает ли обработчик контекст
-      sig = inspect.signature(handler)
-      if 'ctx' in sig.parameters:
-        kwargs['ctx'] = ctx
-
-      if not handler_info['is_single_param'] or not handler_info['has_pydantic_params']:
-        # Случай 1: Есть несколько параметров или один простой
-        # Ожидаем data в формате {param1: value1, param2: value2}
-        for param_name in handler_info['expected_params']:
-          if param_name not in request.data:
-            raise ValueError(f"Missing parameter '{param_name}' in request data", handler)
-
-          param_type = handler_info['type_hints'].get(param_name)
-          if self._is_pydantic_model(param_type):
-            kwargs[param_name] = param_type(**request.data[param_name])
-          else:
-            kwargs[param_name] = request.data[param_name]
-      elif handler_info['has_pydantic_params']:
-        # Случай 2: Один параметр-модель
-        # Ожидаем data как значение этого параметра
-        param_name = next(iter(handler_info['expected_params']))
-        param_type = handler_info['type_hints'].get(param_name)
-        if self._is_pydantic_model(param_type):
-          kwargs[param_name] = param_type(**request.data)
-        else:
-          kwargs[param_name] = request.data
-
-      # Вызов обработчика
-      result = handler(**kwargs)
-
-      if inspect.isawaitable(result):
-        result = await result
+      # Аргументы и форма ответа подготовлены заранее в register_handler
+      plan = handler_info['plan']
+      kwargs = plan.bind(ctx, request.data)
 
-      # Подготовка ответа
-      response_model = handler_info['type_hints'].get('return')
-      if response_model:
-        response_data = self._prepare_response_data(result, response_model)
+      if handler_info['serial']:
+        # Обработчики, требующие последовательного выполнения, идут по одному в порядке поступления
+        async with ctx.serial_lock:
+          result = await self._invoke(plan, kwargs)
       else:
-        response_data = result
+        result = await self._invoke(plan, kwargs)
 
-      response = SuccessResponse(data=response_data, id=request.id)
-
-      if ttl := ctx.get_metadata('ttl'):
-        response.ttl = ttl
-        ctx.set_metadata('ttl', None)
+      response = ctx.codec.encode_success(request.id, plan.serialize(result), response_ttl.get() or None)
 
     except ErrorWithData as e:
       error_id = request.id if 'request' in locals() else 'unknown'
-      response = ErrorResponse(error=e.message, id=error_id, data=e.data)
+      response = ctx.codec.encode_error(error_id, e.message, e.data)
     except ProtocolError as e:
       error_id = request.id if 'request' in locals() else 'unknown'
-      response = ErrorResponse(error=e.message, id=error_id)
+      response = ctx.codec.encode_error(error_id, e.message)
     except ValidationError as e:
       error_id = request.id if 'request' in locals() else 'unknown'
-      response = ErrorResponse(error='JSON validation error', id=error_id)
+      response = ctx.codec.encode_error(error_id, 'JSON validation error')
       logger.error(f"Validation error: {e}", exc_info=e)
     except Exception as e:
       error_id = request.id if 'request' in locals() else 'unknown'
-      response = ErrorResponse(error='unknown error', id=error_id)
+      response = ctx.codec.encode_error(error_id, 'unknown error')
       logger.error(f"Error processing message: {e}", exc_info=e)
+    finally:
+      response_ttl.reset(response_ttl_token)
+      if request_id_token is not None:
+        current_request_id.reset(request_id_token)
 
-    await ctx.connection.send(response.json(exclude_none=True))
+    await ctx.send_frame(response)
 
   async def disconnect_connection(self, ctx: ConnectionContext) -> None:
     """Отключает соединение"""
     await ctx.connection.close()
-    self._connections.pop(ctx.connection, None)
-
-  def _prepare_response_data(self, result, response_model):
-    """Подготавливает данные ответа с учетом сложных типов"""
-    # Если модель ответа не указана, возвращаем как есть
-    if response_model is None:
-      return result
-
-    origin_type = get_origin(response_model) or response_model
-
-    # Optional[Type]
-    if origin_type is typing.Union:
-      args = typing.get_args(response_model)
-      if type(None) in args:  # Это Optional
-        if result is None:
-          return None
-        actual_type = next(arg for arg in args if arg is not type(None))
-        return self._prepare_response_data(result, actual_type)
-
-    # list[Type]
-    if origin_type in (list, typing.List) or isinstance(result, list):
-      item_type = typing.get_args(response_model)[0] if get_origin(response_model) else None
-
-      if item_type and self._is_pydantic_model(item_type):
-        return [self._prepare_response_data(item, item_type) for item in result]
-      return result
-
-    # dict[K, V]
-    if origin_type in (dict, Dict):
-      key_type, val_type = typing.get_args(response_model)
-      if self._is_pydantic_model(val_type):
-        return {k: self._prepare_response_data(v, val_type) for k, v in result.items()}
-      return result
-
-    # Pydantic
-    if self._is_pydantic_model(response_model):
-      if isinstance(result, response_model):
-        return result.dict(exclude_none=True)
-      try:
-        return response_model(**result).dict()
-      except Exception as e:
-        raise ValueError(f"Failed to convert result to {response_model}: {str(e)}")
+    self._forget(ctx)
 
-    # Простые типы
-    return result
-
-  def _is_pydantic_model(self, type_) -> bool:
-    """Проверяет, является ли тип моделью Pydantic"""
-    try:
-      return isinstance(type_, type) and issubclass(type_, BaseModel)
-    except TypeError:
-      return False
+  def _forget(self, ctx: ConnectionContext) -> None:
+    """Убирает соединение из всех индексов сервера"""
+    self._connections.pop(ctx.connection, None)
+    self._bind_user(ctx, None)
+    for topic in list(ctx.topics):
+      self.unsubscribe(ctx, topic)
+
+  def _bind_user(self, ctx: ConnectionContext, user_id: Optional[Any]) -> None:
+    """Перепривязывает соединение в индексе user_id -> соединения"""
+    if ctx._user_id is not None:
+      user_connections = self._user_connections.get(ctx._user_id)
+      if user_connections is not None:
+        user_connections.discard(ctx)
+        if not user_connections:
+          del self._user_connections[ctx._user_id]
+
+    ctx._user_id = user_id
+    if user_id is not None:
+      self._user_connections.setdefault(user_id, set()).add(ctx)
+
+  def connections_of(self, user_id: Any) -> frozenset[ConnectionContext]:
+    """Живые соединения пользователя"""
+    return frozenset(self._user_connections.get(user_id, ()))
+
+  def is_online(self, user_id: Any) -> bool:
+    return user_id in self._user_connections
+
+  async def send_to_users(self, user_ids: typing.Iterable[Any], payload: Any) -> int:
+    """
+    Рассылает сообщение всем соединениям указанных пользователей.
+
+    :returns: количество соединений, которым было отправлено сообщение
+    """
+    return await self._broadcast(
+      [ctx for user_id in set(user_ids) for ctx in self._user_connections.get(user_id, ())],
+      payload
+    )
+
+  async def send_to_user(self, user_id: Any, payload: Any) -> int:
+    """Рассылает сообщение всем соединениям пользователя"""
+    return await self.send_to_users((user_id,), payload)
+
+  def subscribe(self, ctx: ConnectionContext, topic: str) -> None:
+    """Подписывает соединение на топик"""
+    self._topics.setdefault(topic, set()).add(ctx)
+    ctx.topics.add(topic)
+
+  def subscribers(self, topic: str) -> frozenset[ConnectionContext]:
+    """Соединения, подписанные на топик"""
+    return frozenset(self._topics.get(topic, ()))
+
+  def unsubscribe(self, ctx: ConnectionContext, topic: str) -> None:
+    """Отписывает соединение от топика"""
+    ctx.topics.discard(topic)
+    subscribers = self._topics.get(topic)
+    if subscribers is not None:
+      subscribers.discard(ctx)
+      if not subscribers:
+        del self._topics[topic]
+
+  async def publish(self, topic: str, payload: Any) -> int:
+    """
+    Рассылает сообщение всем подписчикам топика
+
+    :returns: количество соединений, которым было отправлено сообщение
+    """
+    return await self._broadcast(list(self._topics.get(topic, ())), payload)
+
+  async def _broadcast(self, targets: list[ConnectionContext], payload: Any) -> int:
+    """Отправляет сообщение соединениям, кодируя его один раз на кодек, а не на каждое соединение"""
+    if not targets:
+      return 0
+
+    frames: Dict[int, str | bytes] = {}
+    sends = []
+    for ctx in targets:
+      frame = frames.get(id(ctx.codec))
+      if frame is None:
+        frame = frames[id(ctx.codec)] = ctx.codec.dumps(payload)
+      sends.append(ctx.send_frame(frame))
+
+    results = await asyncio.gather(*sends, return_exceptions=True)
+    for result in results:
+      if isinstance(result, Exception) and not isinstance(result, ConnectionClosed):
+        logger.error(f"Error sending to connection: {result}", exc_info=result)
+    return len(targets)
 
   @property
   def connections_it(self):
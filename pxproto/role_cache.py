@@ -0,0 +1,100 @@
+"""
+Кеш ролей пользователей в организациях: (org_id, user_id) -> OrganizationRole или None.
+
+Роль проверяется почти в каждом обработчике организаций и счетов, а меняется редко.
+Записи организации сбрасываются по событию org_roles_changed (add_user, kick, set_role),
+в т.ч. в других воркерах. TTL страхует от пропущенных событий.
+
+Роль, прочитанная в транзакции БД, кешируется, только если организацию не сбрасывали после
+начала этой транзакции: снимок REPEATABLE READ может быть старше изменения, о котором уже пришло событие.
+"""
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Optional
+
+import events
+from models import OrganizationRole
+
+ROLE_CACHE_SIZE = int(os.getenv('ROLE_CACHE_SIZE', 50000))
+ROLE_CACHE_TTL = float(os.getenv('ROLE_CACHE_TTL', 60))
+
+# Отличает закешированное "нет роли" от отсутствия записи
+MISSING = object()
+
+
+class RoleCache:
+  """LRU с TTL. Хранит и отрицательные ответы (пользователь не участник)"""
+
+  def __init__(self, max_size: int, ttl: float):
+    self.max_size = max_size
+    self.ttl = ttl
+    # (org_id, user_id) -> (expires_at, role)
+    self._entries: OrderedDict[tuple[int, int], tuple[float, Optional[OrganizationRole]]] = OrderedDict()
+    # Номер последней инвалидации в процессе и org_id -> номер его последней инвалидации.
+    # Не дают записать роль, прочитанную до инвалидации
+    self._epoch = 0
+    self._invalidated: dict[int, int] = {}
+    self._cleared = 0
+
+  def epoch(self) -> int:
+    return self._epoch
+
+  def get(self, org_id: int, user_id: int):
+    """:returns: роль, None (не участник) или MISSING"""
+    key = (org_id, user_id)
+    entry = self._entries.get(key)
+    if entry is None:
+      return MISSING
+
+    expires_at, role = entry
+    if expires_at <= time.monotonic():
+      del self._entries[key]
+      return MISSING
+
+    self._entries.move_to_end(key)
+    return role
+
+  def put(self, org_id: int, user_id: int, role: Optional[OrganizationRole], since_epoch: Optional[int]) -> None:
+    """:param since_epoch: значение epoch() на начало транзакции, в которой прочитана роль"""
+    if self.max_size <= 0 or since_epoch is None:
+      return
+    if max(self._invalidated.get(org_id, 0), self._cleared) > since_epoch:
+      return
+
+    key = (org_id, user_id)
+    self._entries[key] = (time.monotonic() + self.ttl, role)
+    self._entries.move_to_end(key)
+    while len(self._entries) > self.max_size:
+      self._entries.popitem(last=False)
+
+  def invalidate_org(self, org_id: int) -> None:
+    self._epoch += 1
+    self._invalidated[org_id] = self._epoch
+    stale = [key for key in self._entries if key[0] == org_id]
+    for key in stale:
+      del self._entries[key]
+
+  def clear(self) -> None:
+    self._epoch += 1
+    self._cleared = self._epoch
+    self._entries.clear()
+    self._invalidated.clear()
+
+  def __len__(self):
+    return len(self._entries)
+
+
+role_cache = RoleCache(ROLE_CACHE_SIZE, ROLE_CACHE_TTL)
+
+
+def _on_org_roles_changed(message: dict[str, Any]) -> None:
+  role_cache.invalidate_org(message['org'])
+
+
+def _on_bus_reconnected(message: dict[str, Any]) -> None:
+  role_cache.clear()
+
+
+events.listen('org_roles_changed', _on_org_roles_changed)
+events.listen('bus_reconnected', _on_bus_reconnected)
@@ -1,10 +1,14 @@
+from sqlalchemy.ext.asyncio import AsyncSession
+
+import events
+from dao.org import OrganizationDAO
 from pxws.server import Server
 
 
 async def get_connection_to_user(server: Server, user_id: int):
-  for connection in server.connections_it:
-    if connection.get_metadata('user_id') == user_id:
+  return next(iter(server.connections_of(user_id)), None)
 
-      return connection
 
-  return None
\ No newline at end of file
+async def send_to_org(session: AsyncSession, org_id: int, payload):
+  """Рассылает сообщение всем живым соединениям участников организации (включая владельца)"""
+  await events.send_to_users(await OrganizationDAO.member_ids(session, org_id), payload)
@@ -0,0 +1,81 @@
+"""
+Пересчет account_daily_stats из истории транзакций.
+
+Обороты группируются на стороне БД и читаются потоком, запись идет пачками,
+каждая пачка - отдельная транзакция БД. Существующие дни перезаписываются.
+Закрывающие балансы считаются от текущих, поэтому запускать лучше при низкой нагрузке
+(переводы во время пересчета исправит повторный запуск).
+Шарды балансов сначала переносятся в account.balance, и вся история пишется в часть 0.
+
+  python stats_rebuild.py [--batch 1000]
+"""
+import argparse
+import asyncio
+
+from dotenv import load_dotenv
+
+load_dotenv('.env')
+load_dotenv('.env.local', override=True)
+
+import database
+from dao import AccountDAO
+from dao.stats import AccountStatsDAO
+from logger import logger
+
+
+async def consolidate_shards():
+  """Переносит шарды балансов в account.balance, каждый счет - отдельной транзакцией"""
+  async with database.get_db() as session:
+    account_ids = await AccountDAO.get_sharded_ids(session)
+
+  for account_id in account_ids:
+    async with database.get_db() as session:
+      account = (await AccountDAO.lock_accounts(session, account_id)).get(account_id)
+      if account is not None:
+        await AccountDAO.consolidate(session, account)
+        await session.commit()
+
+  async with database.get_db() as session:
+    deleted = await AccountStatsDAO.delete_shard_parts(session)
+    await session.commit()
+  logger.info(f"Stats rebuild: {len(account_ids)} sharded accounts consolidated, {deleted} shard rows deleted")
+
+
+async def rebuild(batch_size: int):
+  await consolidate_shards()
+
+  total = 0
+  batch = []
+
+  async def flush():
+    nonlocal total
+    async with database.get_db() as write_session:
+      await AccountStatsDAO.upsert(write_session, batch)
+      await write_session.commit()
+    total += len(batch)
+    batch.clear()
+    logger.info(f"Stats rebuild: {total} account-days written")
+
+  async with database.get_db() as read_session:
+    async for row in AccountStatsDAO.stream_history(read_session, batch_size):
+      batch.append(row)
+      if len(batch) >= batch_size:
+        await flush()
+
+  if batch:
+    await flush()
+
+
+async def main(batch_size: int):
+  try:
+    await rebuild(batch_size)
+  finally:
+    await database.engine.dispose()
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description='Пересчет account_daily_stats из истории транзакций')
+  parser.add_argument('--batch', type=int, default=1000, help='дней счетов в одной пачке записи')
+  args = parser.parse_args()
+
+  asyncio.run(main(args.batch))
@@ -0,0 +1,99 @@
+"""
+Кеш проверенных токенов для обработчика auth.
+
+Клиенты переавторизуются при каждом переподключении, поэтому после деплоя приходит
+шквал одинаковых auth. Кеш хранит проверенные claims и снимок пользователя до exp токена.
+Снимок сбрасывается при изменении пользователя (events.user_changed), в т.ч. в других воркерах.
+Снимок, загрузка которого началась до такого сброса, не кешируется (см. RoleCache).
+"""
+import hashlib
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Optional, Union
+
+import events
+
+TOKEN_CACHE_SIZE = int(os.getenv('TOKEN_CACHE_SIZE', 10000))
+
+
+class TokenCache:
+  """LRU с TTL до exp токена"""
+
+  def __init__(self, max_size: int):
+    self.max_size = max_size
+    # sha256(token) -> (exp, claims, snapshot)
+    self._entries: OrderedDict[bytes, tuple[float, dict, dict]] = OrderedDict()
+    # Номер последней инвалидации в процессе и ID/имя пользователя -> номер его последней инвалидации.
+    # Не дают записать снимок, загруженный до инвалидации
+    self._epoch = 0
+    self._invalidated: dict[Union[int, str], int] = {}
+    self._cleared = 0
+
+  def epoch(self) -> int:
+    return self._epoch
+
+  @staticmethod
+  def _key(token: str) -> bytes:
+    return hashlib.sha256(token.encode('utf-8')).digest()
+
+  def get(self, token: str) -> Optional[tuple[dict, dict]]:
+    """:returns: (claims, snapshot) или None, если токена нет или он истек"""
+    key = self._key(token)
+    entry = self._entries.get(key)
+    if entry is None:
+      return None
+
+    exp, claims, snapshot = entry
+    if exp <= time.time():
+      del self._entries[key]
+      return None
+
+    self._entries.move_to_end(key)
+    return claims, snapshot
+
+  def put(self, token: str, claims: dict, snapshot: dict, since_epoch: int) -> None:
+    """:param since_epoch: значение epoch() до начала загрузки снимка"""
+    if self.max_size <= 0:
+      return
+    invalidated = max(self._invalidated.get(snapshot['user_id'], 0),
+                      self._invalidated.get(snapshot['username'], 0), self._cleared)
+    if invalidated > since_epoch:
+      return
+
+    self._entries[self._key(token)] = (float(claims['exp']), claims, snapshot)
+    self._entries.move_to_end(self._key(token))
+    while len(self._entries) > self.max_size:
+      self._entries.popitem(last=False)
+
+  def invalidate_user(self, user: Union[int, str]) -> None:
+    """Сбрасывает все токены пользователя (по ID или имени)"""
+    self._epoch += 1
+    self._invalidated[user] = self._epoch
+    field = 'username' if isinstance(user, str) else 'user_id'
+    stale = [key for key, (_, _, snapshot) in self._entries.items() if snapshot[field] == user]
+    for key in stale:
+      del self._entries[key]
+
+  def clear(self) -> None:
+    self._epoch += 1
+    self._cleared = self._epoch
+    self._entries.clear()
+
+  def __len__(self):
+    return len(self._entries)
+
+
+token_cache = TokenCache(TOKEN_CACHE_SIZE)
+
+
+def _on_user_changed(message: dict[str, Any]) -> None:
+  token_cache.invalidate_user(message['user'])
+
+
+def _on_bus_reconnected(message: dict[str, Any]) -> None:
+  token_cache.clear()
+
+
+events.listen('user_changed', _on_user_changed)
+events.listen('bus_reconnected', _on_bus_reconnected)
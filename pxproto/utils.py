@@ -1,4 +1,3 @@
-import json
 from typing import Union, Optional, Literal
 
 from sqlalchemy import select, and_
@@ -24,7 +23,7 @@ async def send_toast(
     detail: Optional[str],
     life: int
 ):
-  await ctx.connection.send(json.dumps({
+  await ctx.send({
     'type': 'toast',
     'data': {
       'severity': severity,
@@ -32,4 +31,4 @@ async def send_toast(
       'detail': detail,
       'life': life
     }
-  }, ensure_ascii=False))
+  })
@@ -0,0 +1,72 @@
+"""
+Тесты работают с SQLite в памяти вместо MySQL: database.SessionLocal перепривязывается к тестовому движку.
+Каждый тест выполняет свой сценарий через asyncio.run, движок создается и закрывается внутри него.
+
+  pip install -r requirements-dev.txt
+  python -m pytest tests
+"""
+import os
+import sys
+
+# Модули приложения импортируются и как пакет pxproto, и из его каталога (как при запуске main.py)
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path[:0] = [os.path.join(ROOT, 'pxproto'), ROOT]
+
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import ec
+
+
+def _vapid_keys() -> tuple[str, str]:
+  """Одноразовая пара ключей: push_delivery создает клиент WebPush при импорте"""
+  key = ec.generate_private_key(ec.SECP256R1())
+  private = key.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8,
+                              serialization.NoEncryption())
+  public = key.public_key().public_bytes(serialization.Encoding.PEM,
+                                         serialization.PublicFormat.SubjectPublicKeyInfo)
+  return private.decode('ascii'), public.decode('ascii')
+
+
+if 'VAPID_PRIVATE_CERT' not in os.environ:
+  os.environ['VAPID_PRIVATE_CERT'], os.environ['VAPID_PUBLIC_CERT'] = _vapid_keys()
+
+import pytest
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncEngine, create_async_engine
+from sqlalchemy.pool import StaticPool
+
+import database
+import models
+from role_cache import role_cache
+
+
+class TestDatabase:
+  def __init__(self):
+    self.engine: AsyncEngine = create_async_engine('sqlite+aiosqlite://', poolclass=StaticPool)
+    # Текст каждого выполненного запроса
+    self.statements: list[str] = []
+    event.listen(self.engine.sync_engine, 'before_cursor_execute', self._record)
+
+  def _record(self, conn, cursor, statement, parameters, context, executemany):
+    self.statements.append(statement)
+
+  async def create_schema(self):
+    async with self.engine.begin() as conn:
+      await conn.run_sync(models.Base.metadata.create_all)
+    self.statements.clear()
+
+  async def run(self, scenario):
+    """Выполняет сценарий теста и закрывает движок в том же event loop"""
+    try:
+      return await scenario
+    finally:
+      await self.engine.dispose()
+
+
+@pytest.fixture
+def db():
+  test_db = TestDatabase()
+  database.SessionLocal.configure(bind=test_db.engine)
+  role_cache.clear()
+  yield test_db
+  database.SessionLocal.configure(bind=database.engine)
+  role_cache.clear()
@@ -0,0 +1,73 @@
+import asyncio
+
+import database
+import models
+from api.accounts import accounts_access
+from principal import Principal
+
+ORGS = 5
+
+
+def _principal(user_id: int, is_admin: bool = False) -> Principal:
+  return Principal(id=user_id, username=f'user{user_id}', is_admin=is_admin, account_limit=3,
+                   organization_limit=0, version=0)
+
+
+async def _seed(db):
+  """user1 владеет организациями 1..ORGS, user2 - участник четных. Счета: по одному на организацию и пользователя"""
+  await db.create_schema()
+  async with database.SessionLocal() as session:
+    session.add_all(models.User(id=i, username=f'user{i}', password='') for i in (1, 2, 3))
+    session.add_all(models.Organization(id=i, name=f'org{i}', owner_id=1) for i in range(1, ORGS + 1))
+    await session.flush()
+    session.add_all(
+      models.OrganizationMember(organization_id=i, user_id=2, role=models.OrganizationRole.MEMBER)
+      for i in range(2, ORGS + 1, 2)
+    )
+    await session.commit()
+  db.statements.clear()
+
+  # Страница транзакций: счета всех организаций (некоторые дважды), свой и чужой счет
+  accounts = [models.Account(id=i, organization_id=i) for i in range(1, ORGS + 1)]
+  accounts += [models.Account(id=ORGS + i, organization_id=i) for i in range(1, ORGS + 1)]
+  accounts += [models.Account(id=100, user_id=2, is_deleted=False), models.Account(id=101, user_id=3)]
+  return accounts
+
+
+def test_page_roles_loaded_with_one_query(db):
+  async def scenario():
+    accounts = await _seed(db)
+    user = _principal(2)
+
+    async with database.SessionLocal() as session:
+      access = await accounts_access(session, user, accounts)
+      assert len(db.statements) == 1
+
+      # Повторная проверка в том же запросе - из кеша сессии
+      db.statements.clear()
+      assert await accounts_access(session, user, accounts) == access
+      assert db.statements == []
+
+    expected = {account.id: account.organization_id is not None and account.organization_id % 2 == 0
+                for account in accounts}
+    expected[100] = True
+    assert access == expected
+
+    # Другой запрос - из кеша ролей процесса
+    async with database.SessionLocal() as session:
+      assert await accounts_access(session, user, accounts) == access
+    assert db.statements == []
+
+  asyncio.run(db.run(scenario()))
+
+
+def test_admin_needs_no_queries(db):
+  async def scenario():
+    accounts = await _seed(db)
+    async with database.SessionLocal() as session:
+      access = await accounts_access(session, _principal(3, is_admin=True), accounts)
+
+    assert all(access.values())
+    assert db.statements == []
+
+  asyncio.run(db.run(scenario()))
@@ -0,0 +1,46 @@
+import asyncio
+import json
+
+import msgpack
+import pytest
+
+from pxws.codec import EnvelopeError, get_codec
+from pxws.connection_ctx import ConnectionContext
+from pxws.server import Server
+
+REQUEST = msgpack.packb({'type': 'ping', 'id': '1', 'data': None}, use_bin_type=True)
+
+
+class _Connection:
+  remote_address = ('127.0.0.1', 0)
+  subprotocol = 'pxws.msgpack'
+
+  def __init__(self):
+    self.sent = []
+
+  async def send(self, message, text=None):
+    self.sent.append(message)
+
+
+@pytest.mark.parametrize('frame', [REQUEST[:-3], REQUEST[:1], b'\x81\x91\x01\x01'])
+def test_malformed_msgpack_frame_is_envelope_error(frame):
+  with pytest.raises(EnvelopeError):
+    get_codec('msgpack').decode_request(frame)
+
+
+def test_truncated_msgpack_frame_gets_envelope_error_response():
+  server = Server()
+  server.add_subprotocol('pxws.msgpack', get_codec('msgpack'))
+  ctx = ConnectionContext(server, _Connection())
+
+  asyncio.run(server._on_message(ctx, REQUEST[:-3]))
+
+  response = msgpack.unpackb(ctx.connection.sent[-1], raw=False)
+  assert response == {'status': 'error', 'error': EnvelopeError().message, 'id': 'unknown'}
+
+
+def test_malformed_msgspec_frame_is_envelope_error():
+  pytest.importorskip('msgspec')
+  codec = get_codec('msgspec')
+  with pytest.raises(EnvelopeError):
+    codec.decode_request(json.dumps({'type': 'ping', 'id': '1'})[:-2])
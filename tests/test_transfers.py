@@ -0,0 +1,49 @@
+import asyncio
+import decimal
+
+import pytest
+from sqlalchemy import func, select
+
+import database
+import models
+from api.accounts import transfer
+from pxws.error_with_data import ProtocolError
+
+
+def test_transfer_to_same_account_is_rejected(db):
+  async def scenario():
+    await db.create_schema()
+    async with database.SessionLocal() as session:
+      session.add(models.User(id=1, username='user1', password=''))
+      session.add(models.Currency(id=1, name='c', icon='c'))
+      account = models.Account(id=1, user_id=1, currency_id=1, account_number='100001', balance=100)
+      session.add(account)
+      await session.commit()
+
+      with pytest.raises(ProtocolError):
+        await transfer(session, 1, '', account, account, decimal.Decimal(1))
+
+    async with database.SessionLocal() as session:
+      assert (await session.get(models.Account, 1)).balance == 100
+      assert await session.scalar(select(func.count()).select_from(models.Transaction)) == 0
+
+  asyncio.run(db.run(scenario()))
+
+
+def test_deadlock_retry_requires_its_own_transaction(db):
+  @database.retry_on_deadlock
+  async def handler(session):
+    return await session.scalar(select(func.count()).select_from(models.Account))
+
+  async def scenario():
+    await db.create_schema()
+    async with database.SessionLocal() as session:
+      assert await handler(session=session) == 0
+      await session.commit()
+
+      # Работа, начатая до обработчика, откатилась бы при повторе
+      await session.scalar(select(func.count()).select_from(models.User))
+      with pytest.raises(RuntimeError):
+        await handler(session=session)
+
+  asyncio.run(db.run(scenario()))